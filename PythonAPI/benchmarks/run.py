@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from pydantic import TypeAdapter
+
+from benchmarks.synthetic_statements import STATEMENT_LAYOUTS, generate_statement, load_initial_statement_settings, write_statement_files
+from src.category_tree import invalidate_category_tree
+from src.entitybuilder import bulk_insert_finance_items
+from src.extensions.entity_serializers import serialize_entities
+from src.extensions.object_extensions import to_json
+from src.file_utils import _extract_transaction_pages_in_range, extract_transaction_pages_from_pdf_bytes, extract_transactions, extract_transactions_batch, shutdown_pdf_extraction_pool
+from src.models.apimodels import FinanceItemModel
+from src.models.base import Base
+from src.models.entities import FinanceItem
+from src.models.enumerations import StatementType
+
+#--------------------------------------------------------------------------------------------
+# Benchmarks of the statement import pipeline on synthetic statements.
+#
+#   python -m benchmarks.run                                  # every layout, 1 to 10,000 transactions
+#   python -m benchmarks.run --sizes 100,1000 --repeat 5 --output before.json
+#   python -m benchmarks.run --output after.json --compare before.json
+#   python -m benchmarks.run --write-statements statements/   # only write the PDFs and texts
+#
+# Results are written as JSON: run metadata plus one record per (statement type, size,
+# stage) with every timing sample, so runs on the same machine can be compared.
+#--------------------------------------------------------------------------------------------
+DEFAULT_SIZES = [1, 10, 100, 1000, 10000]
+_finance_item_models = TypeAdapter(list[FinanceItemModel])
+
+def measure(function: Callable[[], Any], repeat: int, warmup: int) -> tuple[list[float], Any]:
+    """Runs function warmup + repeat times with the garbage collector paused; returns the timed samples and the last result."""
+    samples: list[float] = []
+    result = None
+    for iteration in range(warmup + repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        if iteration >= warmup:
+            samples.append(elapsed)
+    return samples, result
+
+def persist_to_fresh_sqlite(models: list[FinanceItemModel], directory: str) -> list[int]:
+    """Bulk inserts into a new SQLite database file, as the first import of a statement would."""
+    database_path = os.path.join(directory, f"benchmark-{time.perf_counter_ns()}.db")
+    engine = _sql.create_engine(f"sqlite:///{database_path}")
+    try:
+        Base.metadata.create_all(engine)
+        invalidate_category_tree()
+        with _orm.Session(engine) as database_session:
+            return bulk_insert_finance_items(models, database_session)
+    finally:
+        engine.dispose()
+        os.remove(database_path)
+
+def run_benchmarks(
+        statement_types: list[StatementType],
+        sizes: list[int],
+        stages: list[str],
+        repeat: int,
+        warmup: int,
+        seed: int) -> list[dict[str, Any]]:
+    settings = load_initial_statement_settings()
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for statement_type in statement_types:
+            for size in sizes:
+                statement = generate_statement(statement_type, size, settings, seed)
+                settings_json = statement.settings_json
+                models = extract_transactions(statement.text, settings_json, statement_type)
+                if len(models) != size:
+                    print(f"warning: {statement_type.value} parsed {len(models)} of {size} transactions", file=sys.stderr)
+                entities = [FinanceItem(**model.model_dump()) for model in models]
+                keywords = settings_json.transaction_page_keywords
+
+                benchmarks: dict[str, Callable[[], Any]] = {
+                    "extract_pages_serial": lambda: _extract_transaction_pages_in_range(statement.pdf, 0, len(statement.pages), keywords),
+                    "extract_pages_pooled": lambda: asyncio.run(extract_transaction_pages_from_pdf_bytes(statement.pdf, keywords)),
+                    "parse_transactions": lambda: extract_transactions(statement.text, settings_json, statement_type),
+                    "parse_transactions_batch": lambda: extract_transactions_batch(statement.text, settings_json, statement_type),
+                    "serialize_to_json": lambda: to_json(entities),
+                    "serialize_entities": lambda: serialize_entities(entities, FinanceItem),
+                    "serialize_models": lambda: _finance_item_models.dump_json(models),
+                    "persist_sqlite": lambda: persist_to_fresh_sqlite(models, directory),
+                }
+                for stage in stages:
+                    samples, _ = measure(benchmarks[stage], repeat, warmup)
+                    median = statistics.median(samples)
+                    results.append({
+                        "statement_type": statement_type.value,
+                        "transactions": size,
+                        "pages": len(statement.pages),
+                        "stage": stage,
+                        "samples_seconds": samples,
+                        "min_seconds": min(samples),
+                        "median_seconds": median,
+                        "transactions_per_second": size / median if median > 0 else None
+                    })
+                    print(f"{statement_type.value:<26} {size:>6} {stage:<26} median {median * 1000:>10.3f} ms")
+    shutdown_pdf_extraction_pool()
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(results: list[dict[str, Any]], baseline: list[dict[str, Any]]) -> None:
+    """Prints the median of every measurement next to the baseline's, with the ratio."""
+    baseline_medians = {
+        (result["statement_type"], result["transactions"], result["stage"]): result["median_seconds"]
+        for result in baseline
+    }
+    print(f"\n{'statement type':<26} {'size':>6} {'stage':<26} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for result in results:
+        key = (result["statement_type"], result["transactions"], result["stage"])
+        baseline_median = baseline_medians.get(key)
+        if baseline_median is None:
+            continue
+        ratio = result["median_seconds"] / baseline_median if baseline_median > 0 else float("inf")
+        print(f"{key[0]:<26} {key[1]:>6} {key[2]:<26} {baseline_median * 1000:>12.3f} {result['median_seconds'] * 1000:>12.3f} {ratio:>6.2f}x")
+
+def main(arguments: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmarks the statement import pipeline.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="comma separated transaction counts")
+    parser.add_argument("--types", default=",".join(statement_type.value for statement_type in STATEMENT_LAYOUTS), help="comma separated statement types")
+    parser.add_argument("--stages", default="all", help="comma separated stages, or all")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the timed ones")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic transactions")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--write-statements", metavar="DIRECTORY", help="only write the synthetic statements to DIRECTORY")
+    args = parser.parse_args(arguments)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    if args.write_statements:
+        for path in write_statement_files(Path(args.write_statements), sizes, args.seed):
+            print(path)
+        return 0
+
+    statement_types = [StatementType(statement_type) for statement_type in args.types.split(",") if statement_type]
+    all_stages = [
+        "extract_pages_serial", "extract_pages_pooled", "parse_transactions", "parse_transactions_batch",
+        "serialize_to_json", "serialize_entities", "serialize_models", "persist_sqlite"]
+    stages = all_stages if args.stages == "all" else [stage for stage in args.stages.split(",") if stage]
+    unknown_stages = set(stages) - set(all_stages)
+    if unknown_stages:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown_stages))}")
+
+    results = run_benchmarks(statement_types, sizes, stages, max(1, args.repeat), max(0, args.warmup), args.seed)
+    document = {
+        "metadata": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    Path(args.output).write_text(json.dumps(document, indent=2), encoding="utf-8")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        compare_results(results, baseline["results"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import json
+import random
+import re
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+from src.models.entities import SettingsJson
+from src.models.enumerations import StatementType
+
+#--------------------------------------------------------------------------------------------
+# Synthetic statements in the layouts configured by sqls/InitialData.sql. The settings
+# are read from that script, so the generated statements are parsed with exactly the
+# settings a fresh database is seeded with.
+#--------------------------------------------------------------------------------------------
+INITIAL_DATA_PATH = Path(__file__).resolve().parent.parent / "sqls" / "InitialData.sql"
+_SETTINGS_PATTERN = re.compile(r"VALUES\s*\('(\w+)',\s*'(\{.*?\})'\)", re.DOTALL)
+
+MERCHANTS = (
+    "TESCO STORES 2345", "SAINSBURYS S/MKTS", "AMAZON.CO.UK*AB12C", "AMAZON PRIME*RT4X",
+    "SHELL WEMBLEY", "BP CONNECT HARROW", "NETFLIX.COM", "TFL TRAVEL CH", "COSTA COFFEE",
+    "PRET A MANGER", "ALDI STORES", "LIDL GB", "BOOTS THE CHEMIST", "B&Q WATFORD",
+    "ARGOS LTD", "CURRYS PC WORLD", "UBER *TRIP", "DELIVEROO", "JUST EAT.CO.UK",
+    "THAMES WATER", "BRITISH GAS", "VIRGIN MEDIA", "PUREGYM", "WAITROSE", "M&S SIMPLY FOOD",
+)
+LOCATIONS = ("LONDON", "WATFORD", "HARROW", "MANCHESTER", "READING", "LUTON", "SLOUGH", "CROYDON")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+class SyntheticTransaction:
+    def __init__(
+            self,
+            record_date: date,
+            merchant: str,
+            location: str,
+            amount: float,
+            is_credit: bool):
+        self.record_date = record_date
+        self.merchant = merchant
+        self.location = location
+        self.amount = amount
+        self.is_credit = is_credit
+
+    @property
+    def date_text(self) -> str:
+        return f"{self.record_date.day:02d} {MONTH_NAMES[self.record_date.month - 1]}"
+
+def load_initial_statement_settings(path: Path = INITIAL_DATA_PATH) -> dict[StatementType, SettingsJson]:
+    """Reads the StatementTypeSettings rows inserted by InitialData.sql."""
+    script = path.read_bytes().decode("cp1252")
+    return {
+        StatementType(statement_type): SettingsJson.from_json(settings_json)
+        for statement_type, settings_json in _SETTINGS_PATTERN.findall(script)
+    }
+
+def generate_transactions(count: int, seed: int = 0) -> list[SyntheticTransaction]:
+    """Card spend over one year in date order: mostly small purchases, a few larger ones and refunds."""
+    rng = random.Random(seed)
+    start = date(2025, 1, 1)
+    days = sorted(rng.randrange(365) for _ in range(count))
+    transactions = []
+    for day in days:
+        amount = round(rng.lognormvariate(2.8, 1.0), 2)
+        transactions.append(SyntheticTransaction(
+            start + timedelta(days=day),
+            rng.choice(MERCHANTS),
+            rng.choice(LOCATIONS),
+            max(amount, 0.01),
+            rng.random() < 0.05))
+    return transactions
+
+#--------------------------------------------------------------------------------------------
+# Page layouts. Each layout writes the header lines of a transaction page, containing
+# every transaction_page_keyword, and the lines of one transaction at the line offsets
+# (description_indices, amount_index, credit_index) of its settings.
+#--------------------------------------------------------------------------------------------
+class StatementLayout:
+    def __init__(
+            self,
+            statement_type: StatementType,
+            header_lines: list[str],
+            render_transaction: Callable[[SyntheticTransaction], list[str]],
+            filler_lines: Optional[list[str]] = None):
+        self.statement_type = statement_type
+        self.header_lines = header_lines
+        self.render_transaction = render_transaction
+        self.filler_lines = filler_lines or []
+
+def _sainsburys_transaction(transaction: SyntheticTransaction) -> list[str]:
+    # date, description, amount and a CR line for refunds
+    lines = [transaction.date_text, f"{transaction.merchant} {transaction.location}", f"{transaction.amount:.2f}"]
+    if transaction.is_credit:
+        lines.append("CR")
+    return lines
+
+def _capital_one_transaction(transaction: SyntheticTransaction) -> list[str]:
+    # date, merchant, location, currency and the amount, paid in amounts carry a minus sign
+    amount = f"-{transaction.amount:.2f}" if transaction.is_credit else f"{transaction.amount:.2f}"
+    return [transaction.date_text, transaction.merchant, transaction.location, "GBP", amount]
+
+STATEMENT_LAYOUTS: dict[StatementType, StatementLayout] = {
+    StatementType.SAINSBURYS_CREDIT_CARD: StatementLayout(
+        StatementType.SAINSBURYS_CREDIT_CARD,
+        ["Your credit card transactions continued", "Debit date", "Description", "Amount £"],
+        _sainsburys_transaction,
+        ["DIRECT DEBIT RECEIVED, THANK YOU"]),
+    StatementType.CAPITAL_ONE_CREDIT_CARD: StatementLayout(
+        StatementType.CAPITAL_ONE_CREDIT_CARD,
+        ["Your transaction details", "Date", "Transaction", "Paid in", "Paid out"],
+        _capital_one_transaction,
+        ["STATEMENT TOTALS"]),
+}
+
+def render_statement_pages(
+        layout: StatementLayout,
+        transactions: list[SyntheticTransaction],
+        lines_per_page: int = 60) -> list[list[str]]:
+    """Splits the statement into pages of at most lines_per_page lines, each starting with the header."""
+    pages: list[list[str]] = []
+    page: list[str] = list(layout.header_lines)
+    for transaction in transactions:
+        transaction_lines = layout.render_transaction(transaction)
+        if len(page) + len(transaction_lines) > lines_per_page:
+            pages.append(page + layout.filler_lines)
+            page = list(layout.header_lines)
+        page.extend(transaction_lines)
+    pages.append(page + layout.filler_lines)
+    return pages
+
+def render_statement_text(pages: list[list[str]]) -> str:
+    """The text extract_transaction_pages_from_pdf_bytes returns for these pages, joined as /upload-pdf/ does."""
+    return "".join("\n".join(page) for page in pages)
+
+#--------------------------------------------------------------------------------------------
+# Minimal PDF writer: one Helvetica text block per page, no dependencies
+#--------------------------------------------------------------------------------------------
+def _pdf_string(text: str) -> bytes:
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("cp1252") + b")"
+
+def write_statement_pdf(pages: list[list[str]]) -> bytes:
+    """Renders the pages into a PDF whose extracted text has one line per statement line."""
+    objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_object_numbers = []
+    for page in pages:
+        content = b"BT /F1 10 Tf 12 TL 50 800 Td " + b" T* ".join(_pdf_string(line) + b" Tj" for line in page) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects))
+        page_object_numbers.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % number for number in page_object_numbers), len(page_object_numbers))
+
+    document = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(document))
+        document += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(document)
+    document += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    document += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    document += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(document)
+
+class SyntheticStatement:
+    """One generated statement: its settings, the expected transactions, text and PDF."""
+
+    def __init__(
+            self,
+            statement_type: StatementType,
+            settings_json: SettingsJson,
+            transactions: list[SyntheticTransaction],
+            pages: list[list[str]]):
+        self.statement_type = statement_type
+        self.settings_json = settings_json
+        self.transactions = transactions
+        self.pages = pages
+        self.text = render_statement_text(pages)
+        self._pdf: Optional[bytes] = None
+
+    @property
+    def pdf(self) -> bytes:
+        if self._pdf is None:
+            self._pdf = write_statement_pdf(self.pages)
+        return self._pdf
+
+def generate_statement(
+        statement_type: StatementType,
+        transaction_count: int,
+        settings: Optional[dict[StatementType, SettingsJson]] = None,
+        seed: int = 0) -> SyntheticStatement:
+    settings = settings if settings is not None else load_initial_statement_settings()
+    layout = STATEMENT_LAYOUTS[statement_type]
+    transactions = generate_transactions(transaction_count, seed)
+    return SyntheticStatement(statement_type, settings[statement_type], transactions, render_statement_pages(layout, transactions))
+
+def write_statement_files(directory: Path, sizes: list[int], seed: int = 0) -> list[Path]:
+    """Writes <TYPE>-<size>.pdf and .txt for every layout and size, plus the settings used."""
+    directory.mkdir(parents=True, exist_ok=True)
+    settings = load_initial_statement_settings()
+    paths = []
+    for statement_type in STATEMENT_LAYOUTS:
+        for size in sizes:
+            statement = generate_statement(statement_type, size, settings, seed)
+            for suffix, content in ((".pdf", statement.pdf), (".txt", statement.text.encode("utf-8"))):
+                path = directory / f"{statement_type.value}-{size}{suffix}"
+                path.write_bytes(content)
+                paths.append(path)
+        settings_path = directory / f"{statement_type.value}.settings.json"
+        settings_path.write_text(json.dumps(json.loads(settings[statement_type].to_json()), indent=2), encoding="utf-8")
+        paths.append(settings_path)
+    return paths
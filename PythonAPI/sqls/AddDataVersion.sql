@@ -0,0 +1,15 @@
+CREATE TABLE DataVersion (
+    id INT IDENTITY(1,1) NOT NULL PRIMARY KEY,
+    created_at DATETIME NOT NULL DEFAULT (getdate()),
+    updated_at DATETIME NOT NULL DEFAULT (getdate()),
+    table_name VARCHAR(100) NOT NULL,
+    personal_data_id INT NOT NULL,
+    version INT NOT NULL
+);
+GO
+
+CREATE UNIQUE INDEX ix_DataVersion_table_name_personal_data_id
+    ON DataVersion (table_name, personal_data_id);
+GO
+
+-- personal_data_id is 0 for tables without one, so it has no foreign key to PersonalData.
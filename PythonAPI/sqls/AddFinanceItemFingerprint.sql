@@ -0,0 +1,12 @@
+ALTER TABLE FinanceItem ADD
+    fingerprint VARCHAR(64) NULL,
+    occurrence INT NOT NULL CONSTRAINT DF_FinanceItem_occurrence DEFAULT 1;
+GO
+
+CREATE UNIQUE INDEX ix_FinanceItem_fingerprint_occurrence
+    ON FinanceItem (fingerprint, occurrence)
+    WHERE fingerprint IS NOT NULL;
+GO
+
+-- Existing rows keep a NULL fingerprint until backfill_finance_item_fingerprints
+-- (src/entitybuilder.py) has been run once against the database.
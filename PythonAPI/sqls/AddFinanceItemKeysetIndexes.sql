@@ -0,0 +1,7 @@
+CREATE INDEX ix_FinanceItem_personal_data_id_record_date_id
+    ON FinanceItem (personal_data_id, record_date, id);
+GO
+
+CREATE INDEX ix_FinanceItem_personal_data_id_category_record_date_id
+    ON FinanceItem (personal_data_id, finance_item_category_id, record_date, id);
+GO
@@ -0,0 +1,24 @@
+CREATE TABLE FinanceItemMonthlySummary (
+    id INT IDENTITY(1,1) NOT NULL PRIMARY KEY,
+    created_at DATETIME NOT NULL DEFAULT (getdate()),
+    updated_at DATETIME NOT NULL DEFAULT (getdate()),
+    personal_data_id INT NOT NULL FOREIGN KEY REFERENCES PersonalData (id),
+    month DATE NOT NULL,
+    finance_item_category_id INT NOT NULL FOREIGN KEY REFERENCES FinanceItemCategory (id),
+    direct_amount NUMERIC(18, 2) NOT NULL,
+    direct_count INT NOT NULL,
+    rollup_amount NUMERIC(18, 2) NOT NULL,
+    rollup_count INT NOT NULL
+);
+GO
+
+CREATE UNIQUE INDEX ix_FinanceItemMonthlySummary_personal_data_id_month_category
+    ON FinanceItemMonthlySummary (personal_data_id, month, finance_item_category_id);
+GO
+
+CREATE INDEX ix_FinanceItemMonthlySummary_finance_item_category_id
+    ON FinanceItemMonthlySummary (finance_item_category_id);
+GO
+
+-- Summaries of finance items stored before this table existed are filled in by
+-- rebuild_monthly_summaries (src/monthly_summaries.py), once per PersonalData.
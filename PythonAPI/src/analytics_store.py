@@ -0,0 +1,320 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import extract, func, select
+from sqlalchemy.orm import Session
+
+import src.config as config
+from src.models.entities import FinanceItem, FinanceItemCategory
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------------
+# Columnar copy of the FinanceItem history for reporting. Rows are stored as Arrow IPC
+# files partitioned by person and month:
+#
+#   <ANALYTICS_DIRECTORY>/finance_items/personal_data_id=<id>/month=<YYYY-MM>/part-<first id>-<last id>.arrow
+#
+# Uncompressed Arrow IPC files are read through memory maps without copying or
+# building Python objects per row. pyarrow is optional and only imported when the
+# store is used.
+#--------------------------------------------------------------------------------------------
+TABLE_DIRECTORY = "finance_items"
+MANIFEST_FILE = "_manifest.json"
+_PART_PATTERN = re.compile(r"^part-(\d+)-(\d+)\.arrow$")
+
+class AnalyticsUnavailableError(RuntimeError):
+    pass
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        return pyarrow
+    except ImportError as e:
+        raise AnalyticsUnavailableError("The analytics store needs pyarrow, install it with `pip install pyarrow`") from e
+
+def _schema(pa: Any) -> Any:
+    return pa.schema([
+        ("id", pa.int64()),
+        ("personal_data_id", pa.int32()),
+        ("month", pa.string()),
+        ("record_date", pa.timestamp("us")),
+        ("description", pa.string()),
+        ("amount", pa.float64()),
+        ("finance_item_category_id", pa.int32()),
+        ("category_name", pa.string()),
+        ("category_parent_id", pa.int32()),
+    ])
+
+def to_month_key(value: date | datetime) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+def _partition_signatures(database_session: Session) -> dict[str, list[Any]]:
+    """[count, highest id, latest updated_at, total amount] of every "person/YYYY-MM" partition, in one GROUP BY."""
+    year = extract("year", FinanceItem.record_date)
+    month = extract("month", FinanceItem.record_date)
+    rows = database_session.execute(
+        select(
+            FinanceItem.personal_data_id, year, month, func.count(), func.max(FinanceItem.id),
+            func.max(FinanceItem.updated_at), func.sum(FinanceItem.amount))
+        .group_by(FinanceItem.personal_data_id, year, month))
+    return {
+        f"{personal_data_id}/{int(row_year):04d}-{int(row_month):02d}": [
+            count, last_id, str(updated_at), str(Decimal(str(total or 0)).quantize(Decimal("0.01")))]
+        for personal_data_id, row_year, row_month, count, last_id, updated_at, total in rows
+    }
+
+def _categories_signature(database_session: Session) -> list[Any]:
+    count, updated_at = database_session.execute(
+        select(func.count(), func.max(FinanceItemCategory.updated_at))).one()
+    return [count, str(updated_at)]
+
+class AnalyticsStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    @property
+    def table_directory(self) -> str:
+        return os.path.join(self.directory, TABLE_DIRECTORY)
+
+    #----------------------------------------------------------------------------------------
+    # Export
+    #----------------------------------------------------------------------------------------
+    def _read_manifest(self) -> dict[str, Any]:
+        try:
+            with open(os.path.join(self.table_directory, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+            return manifest if isinstance(manifest.get("partitions"), dict) else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _write_manifest(self, manifest: dict[str, Any]) -> None:
+        path = os.path.join(self.table_directory, MANIFEST_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(path + ".tmp", path)
+
+    def exported_at(self) -> Optional[datetime]:
+        """When the last export finished, None before the first one."""
+        exported_at = self._read_manifest().get("exported_at")
+        return datetime.fromisoformat(exported_at) if exported_at else None
+
+    def _partition_directory(self, personal_data_id: int, month: str) -> str:
+        return os.path.join(self.table_directory, f"personal_data_id={personal_data_id}", f"month={month}")
+
+    def _iter_partition_directories(self) -> Iterable[tuple[str, str]]:
+        """(partition key, path) of every partition directory, and of any left over by an interrupted export."""
+        if not os.path.isdir(self.table_directory):
+            return
+        for person_directory in os.listdir(self.table_directory):
+            person_path = os.path.join(self.table_directory, person_directory)
+            if not person_directory.startswith("personal_data_id=") or not os.path.isdir(person_path):
+                continue
+            for month_directory in os.listdir(person_path):
+                month = month_directory.removeprefix("month=").removeprefix(".month=").removesuffix(".tmp")
+                yield f"{person_directory.removeprefix('personal_data_id=')}/{month}", os.path.join(person_path, month_directory)
+
+    def export(self, database_session: Session, rebuild: bool = False, batch_size: Optional[int] = None) -> int:
+        """
+        Brings the store in line with the FinanceItem table. Every (person, month) partition
+        is compared with the database by a signature of its rows (count, highest id, latest
+        updated_at and total amount); the partitions whose signature changed are written
+        again, which picks up rows committed late under a lower id, edits, deletes and
+        recategorizations. A change to any category rewrites every partition, as the rows
+        carry the category name and parent. rebuild starts over from an empty store.
+        Returns the rows written.
+        """
+        pa = _import_pyarrow()
+        batch_size = batch_size or config.ANALYTICS_EXPORT_BATCH_SIZE
+        with self._lock:
+            if rebuild and os.path.isdir(self.table_directory):
+                shutil.rmtree(self.table_directory)
+            os.makedirs(self.table_directory, exist_ok=True)
+            manifest = self._read_manifest()
+            exported_partitions: dict[str, Any] = manifest.get("partitions", {})
+            signatures = _partition_signatures(database_session)
+            categories_signature = _categories_signature(database_session)
+            if manifest.get("categories") != categories_signature:
+                exported_partitions = {}
+
+            for partition_key, path in list(self._iter_partition_directories()):
+                if partition_key not in signatures or path.endswith(".tmp"):
+                    shutil.rmtree(path)
+                    exported_partitions.pop(partition_key, None)
+
+            schema = _schema(pa)
+            exported = 0
+            changed_keys = [key for key, signature in signatures.items() if exported_partitions.get(key) != signature]
+            for partition_key in changed_keys:
+                exported += self._export_partition(pa, schema, database_session, partition_key, batch_size)
+                exported_partitions[partition_key] = signatures[partition_key]
+                self._write_manifest({"partitions": exported_partitions, "categories": manifest.get("categories")})
+            self._write_manifest({
+                "partitions": exported_partitions,
+                "categories": categories_signature,
+                "exported_at": datetime.now().isoformat()})
+            logger.info("Exported %d finance items in %d partitions to %s.", exported, len(changed_keys), self.table_directory)
+            return exported
+
+    def _export_partition(self, pa: Any, schema: Any, database_session: Session, partition_key: str, batch_size: int) -> int:
+        """Writes one (person, month) partition next to the old one, then swaps them."""
+        personal_data_id, month = int(partition_key.split("/")[0]), partition_key.split("/")[1]
+        month_start = datetime.strptime(month, "%Y-%m")
+        month_end = datetime(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+        query = (
+            select(
+                FinanceItem.id, FinanceItem.personal_data_id, FinanceItem.record_date, FinanceItem.description,
+                FinanceItem.amount, FinanceItem.finance_item_category_id, FinanceItemCategory.name,
+                FinanceItemCategory.parent_id)
+            .outerjoin(FinanceItemCategory, FinanceItemCategory.id == FinanceItem.finance_item_category_id)
+            .where(
+                FinanceItem.personal_data_id == personal_data_id,
+                FinanceItem.record_date >= month_start,
+                FinanceItem.record_date < month_end)
+            .order_by(FinanceItem.id)
+            .execution_options(yield_per=batch_size)
+        )
+        directory = self._partition_directory(personal_data_id, month)
+        staging_directory = os.path.join(os.path.dirname(directory), f".month={month}.tmp")
+        os.makedirs(staging_directory, exist_ok=True)
+        exported = 0
+        for rows in database_session.execute(query).partitions():
+            self._write_batch(pa, schema, rows, staging_directory)
+            exported += len(rows)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(staging_directory, directory)
+        return exported
+
+    def _write_batch(self, pa: Any, schema: Any, rows: list[Any], directory: str) -> None:
+        """Writes the rows of one partition as one part file in directory."""
+        columns: dict[str, list[Any]] = {name: [] for name in schema.names}
+        for finance_item_id, personal_data_id, record_date, description, amount, category_id, category_name, parent_id in rows:
+            month = to_month_key(record_date)
+            columns["id"].append(finance_item_id)
+            columns["personal_data_id"].append(personal_data_id)
+            columns["month"].append(month)
+            columns["record_date"].append(record_date)
+            columns["description"].append(description)
+            columns["amount"].append(float(amount) if amount is not None else None)
+            columns["finance_item_category_id"].append(category_id)
+            columns["category_name"].append(category_name)
+            columns["category_parent_id"].append(parent_id)
+
+        ids = columns["id"]
+        path = os.path.join(directory, f"part-{ids[0]:012d}-{ids[-1]:012d}.arrow")
+        table = pa.Table.from_pydict(columns, schema=schema)
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+
+    #----------------------------------------------------------------------------------------
+    # Queries
+    #----------------------------------------------------------------------------------------
+    def _partition_files(
+            self,
+            personal_data_id: Optional[int],
+            month_from: Optional[str],
+            month_to: Optional[str]) -> list[str]:
+        """Lists the part files of the selected partitions, pruning on the directory names alone."""
+        if not os.path.isdir(self.table_directory):
+            return []
+        person_directories = (
+            [f"personal_data_id={personal_data_id}"] if personal_data_id is not None
+            else [name for name in os.listdir(self.table_directory) if name.startswith("personal_data_id=")]
+        )
+        paths = []
+        for person_directory in person_directories:
+            person_path = os.path.join(self.table_directory, person_directory)
+            if not os.path.isdir(person_path):
+                continue
+            for month_directory in sorted(os.listdir(person_path)):
+                if not month_directory.startswith("month="):
+                    continue  # A partition being written
+                month = month_directory.removeprefix("month=")
+                if (month_from and month < month_from) or (month_to and month > month_to):
+                    continue
+                month_path = os.path.join(person_path, month_directory)
+                paths.extend(
+                    os.path.join(month_path, filename)
+                    for filename in sorted(os.listdir(month_path)) if _PART_PATTERN.match(filename))
+        return paths
+
+    def scan(
+            self,
+            personal_data_id: Optional[int] = None,
+            month_from: Optional[date] = None,
+            month_to: Optional[date] = None,
+            category_ids: Optional[Iterable[int]] = None,
+            columns: Optional[list[str]] = None) -> Any:
+        """Returns the matching rows as one pyarrow Table backed by the memory-mapped files."""
+        pa = _import_pyarrow()
+        schema = _schema(pa)
+        tables = []
+        for path in self._partition_files(
+                personal_data_id,
+                to_month_key(month_from) if month_from else None,
+                to_month_key(month_to) if month_to else None):
+            with pa.memory_map(path, "r") as source:
+                tables.append(pa.ipc.open_file(source).read_all())
+        table = pa.concat_tables(tables) if tables else schema.empty_table()
+        if category_ids is not None:
+            table = table.filter(pa.compute.is_in(table["finance_item_category_id"], value_set=pa.array(list(category_ids), pa.int32())))
+        return table.select(columns) if columns else table
+
+    def monthly_spend(
+            self,
+            personal_data_id: Optional[int] = None,
+            month_from: Optional[date] = None,
+            month_to: Optional[date] = None,
+            category_ids: Optional[Iterable[int]] = None) -> list[dict[str, Any]]:
+        """Total amount and transaction count per month and category, computed inside Arrow."""
+        table = self.scan(
+            personal_data_id, month_from, month_to, category_ids,
+            ["personal_data_id", "month", "finance_item_category_id", "category_name", "amount"])
+        aggregated = table.group_by(["personal_data_id", "month", "finance_item_category_id", "category_name"]).aggregate(
+            [("amount", "sum"), ("amount", "count")])
+        aggregated = aggregated.sort_by([("personal_data_id", "ascending"), ("month", "ascending"), ("finance_item_category_id", "ascending")])
+        return [
+            {
+                "personal_data_id": row["personal_data_id"],
+                "month": row["month"],
+                "finance_item_category_id": row["finance_item_category_id"],
+                "category_name": row["category_name"],
+                "amount": round(row["amount_sum"], 2) if row["amount_sum"] is not None else 0.0,
+                "count": row["amount_count"]
+            }
+            for row in aggregated.to_pylist()
+        ]
+
+    def export_parquet(self, destination: str) -> None:
+        """Writes the store as a Parquet dataset with the same person and month partitioning."""
+        pa = _import_pyarrow()
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(self._partition_files(None, None, None), schema=_schema(pa), format="ipc")
+        ds.write_dataset(
+            dataset, destination, format="parquet", partitioning=["personal_data_id", "month"],
+            partitioning_flavor="hive", existing_data_behavior="delete_matching")
+
+analytics_store = AnalyticsStore(config.ANALYTICS_DIRECTORY)
+
+if __name__ == "__main__":
+    import src.database as _database
+    if sys.argv[1:2] == ["export"]:
+        with _database.create_session() as database_session:
+            print(f"Exported {analytics_store.export(database_session, rebuild='--rebuild' in sys.argv[2:])} rows")
+    elif sys.argv[1:2] == ["export-parquet"] and len(sys.argv) == 3:
+        analytics_store.export_parquet(sys.argv[2])
+    else:
+        print("Usage: python -m src.analytics_store export [--rebuild] | export-parquet <directory>")
+        sys.exit(2)
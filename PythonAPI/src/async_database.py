@@ -0,0 +1,76 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+import sqlalchemy.ext.asyncio as _async_sql
+from sqlalchemy.engine import make_url
+
+import src.config as config
+import src.database as _database
+from src.metrics import count_database_round_trips
+
+T = TypeVar("T")
+
+# Sync drivers and the asyncio driver of the same database
+ASYNC_DRIVERS = {
+    "mssql": "aioodbc",
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+def to_async_database_url(database_url: str) -> str:
+    """Swaps the driver of a sync database URL for the asyncio driver of the same backend."""
+    url = make_url(database_url)
+    async_driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if async_driver is None:
+        raise ValueError(f"No asyncio driver known for database URL '{url.render_as_string(hide_password=True)}'")
+    return url.set(drivername=f"{url.get_backend_name()}+{async_driver}").render_as_string(hide_password=False)
+
+_async_engine: Optional[_async_sql.AsyncEngine] = None
+AsyncSessionLocal = _async_sql.async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def get_async_engine() -> _async_sql.AsyncEngine:
+    """Returns the shared async engine, creating it on first use."""
+    global _async_engine
+    if _async_engine is None:
+        _database.register_session_listeners()
+        database_url = config.ASYNC_DATABASE_URL or to_async_database_url(_database.SQLALCHEMY_DATABASE_URL)
+        _async_engine = _async_sql.create_async_engine(database_url, **_database.engine_options(database_url))
+        count_database_round_trips(_async_engine.sync_engine, "async")
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+async def dispose_async_engine() -> None:
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+def create_async_session() -> _async_sql.AsyncSession:
+    get_async_engine()
+    return AsyncSessionLocal()
+
+# Dependency to get an async DB session
+async def get_async_database_session() -> AsyncIterator[_async_sql.AsyncSession]:
+    async with create_async_session() as database_session:
+        yield database_session
+
+#--------------------------------------------------------------------------------------------
+# Bounded thread pool for database work that has to stay synchronous
+#--------------------------------------------------------------------------------------------
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(
+            max_workers=config.DATABASE_THREAD_POOL_SIZE,
+            thread_name_prefix="database")
+    return _blocking_executor
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking call on the bounded database thread pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_blocking_executor(), partial(func, *args, **kwargs))
@@ -0,0 +1,320 @@
+import codecs
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Optional
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import src.config as config
+from src.async_database import run_blocking
+from src.category_tree import get_category_tree, invalidate_category_tree
+from src.entitybuilder import bulk_insert_entities, insert_finance_items
+from src.metrics import timed_stage
+from src.models.apimodels import (
+    BulkIngestChunkSummary, BulkIngestRejectedRow, BulkIngestResult,
+    FinanceItemCategoryModel, FinanceItemModel, PersonalDataModel)
+from src.models.entities import FinanceItemCategory, PersonalData
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------------
+# Incremental JSON row reader. The request body is either one JSON array of rows or
+# NDJSON, one row per line; which one is decided by its first non-blank character.
+# Rows are handed out as soon as they are complete, so at most one row, plus the
+# network chunk it arrived in, is buffered.
+#--------------------------------------------------------------------------------------------
+_WHITESPACE = " \t\r\n"
+
+class JsonRowReader:
+    """
+    Splits a JSON array or NDJSON body into rows. feed() and close() return
+    (row number, value, error) tuples; rows are numbered from 1, NDJSON rows by line.
+    A malformed NDJSON line only rejects that line, while a malformed array ends the
+    body, because there is no way to find the next element; failed is then set.
+    """
+
+    def __init__(self, max_row_bytes: int):
+        self.max_row_bytes = max_row_bytes
+        self.failed: Optional[str] = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._mode: Optional[str] = None  # "array" or "ndjson" once the first character arrived
+        self._row_number = 0
+        self._expect_value = True
+        self._array_closed = False
+        self._skip_line = False
+
+    def feed(self, data: bytes) -> list[tuple[int, Any, Optional[str]]]:
+        try:
+            self._buffer += self._decoder.decode(data)
+        except UnicodeDecodeError as e:
+            return self._fail(f"Body is not valid UTF-8: {e}")
+        return self._parse(final=False)
+
+    def close(self) -> list[tuple[int, Any, Optional[str]]]:
+        try:
+            self._buffer += self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            return self._fail(f"Body is not valid UTF-8: {e}")
+        rows = self._parse(final=True)
+        if self._mode == "array" and not self._array_closed and self.failed is None:
+            rows.extend(self._fail("JSON array is not closed"))
+        return rows
+
+    def _fail(self, error: str) -> list[tuple[int, Any, Optional[str]]]:
+        if self.failed is not None:
+            return []
+        self.failed = error
+        self._buffer = ""
+        return [(self._row_number + 1, None, error)]
+
+    def _parse(self, final: bool) -> list[tuple[int, Any, Optional[str]]]:
+        if self.failed is not None:
+            return []
+        if self._mode is None:
+            self._buffer = self._buffer.lstrip(_WHITESPACE + "\ufeff")
+            if not self._buffer:
+                return []
+            if self._buffer[0] == "[":
+                self._mode = "array"
+                self._buffer = self._buffer[1:]
+            else:
+                self._mode = "ndjson"
+        return self._parse_array(final) if self._mode == "array" else self._parse_ndjson(final)
+
+    def _parse_ndjson(self, final: bool) -> list[tuple[int, Any, Optional[str]]]:
+        rows: list[tuple[int, Any, Optional[str]]] = []
+        lines = self._buffer.split("\n")
+        self._buffer = "" if final else lines.pop()
+        for line in lines:
+            self._row_number += 1
+            if self._skip_line:
+                self._skip_line = False
+                continue
+            if not line.strip():
+                continue
+            if len(line) > self.max_row_bytes:
+                rows.append((self._row_number, None, f"Row is longer than {self.max_row_bytes} bytes"))
+                continue
+            try:
+                rows.append((self._row_number, json.loads(line), None))
+            except json.JSONDecodeError as e:
+                rows.append((self._row_number, None, f"Invalid JSON: {e}"))
+        if len(self._buffer) > self.max_row_bytes and not self._skip_line:
+            # Reject the oversized line now and drop the rest of it as it arrives
+            rows.append((self._row_number + 1, None, f"Row is longer than {self.max_row_bytes} bytes"))
+            self._skip_line = True
+        if self._skip_line:
+            self._buffer = ""
+        return rows
+
+    def _parse_array(self, final: bool) -> list[tuple[int, Any, Optional[str]]]:
+        rows: list[tuple[int, Any, Optional[str]]] = []
+        buffer = self._buffer
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            if self._array_closed:
+                return rows + self._fail("Unexpected data after the JSON array")
+            if self._expect_value:
+                if buffer[position] == "]" and self._row_number == 0:
+                    self._array_closed = True
+                    position += 1
+                    continue
+                try:
+                    value, end = self._json_decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    if final:
+                        return rows + self._fail(f"Invalid JSON in row {self._row_number + 1}: {e}")
+                    if len(buffer) - position > self.max_row_bytes:
+                        return rows + self._fail(f"Row is longer than {self.max_row_bytes} bytes")
+                    break  # The row is not complete yet
+                if end == len(buffer) and not final and not isinstance(value, (dict, list, str)):
+                    break  # A number or literal may continue in the next chunk
+                self._row_number += 1
+                if end - position > self.max_row_bytes:
+                    rows.append((self._row_number, None, f"Row is longer than {self.max_row_bytes} bytes"))
+                else:
+                    rows.append((self._row_number, value, None))
+                self._expect_value = False
+                position = end
+            elif buffer[position] == ",":
+                self._expect_value = True
+                position += 1
+            elif buffer[position] == "]":
+                self._array_closed = True
+                position += 1
+            else:
+                return rows + self._fail(f"Expected ',' or ']' after row {self._row_number}")
+        self._buffer = buffer[position:]
+        return rows
+
+#--------------------------------------------------------------------------------------------
+# Chunk writers. Each validates the references of its rows, stores the valid ones with
+# one INSERT and one commit, and returns the rows stored, the rows skipped as already
+# stored and the rejected positions.
+#--------------------------------------------------------------------------------------------
+ChunkWriter = Callable[[list[Any], Session], tuple[int, int, dict[int, str]]]
+
+class FinanceItemChunkWriter:
+    """
+    Chunk writer of one finance item upload. Identical rows are numbered across all of
+    its chunks, so a legitimate duplicate in a later chunk is stored rather than taken
+    for the row of an earlier one; rows imported before are skipped, not duplicated.
+    """
+
+    def __init__(self):
+        self.occurrence_counts: dict[str, int] = {}
+
+    def __call__(self, models: list[FinanceItemModel], database_session: Session) -> tuple[int, int, dict[int, str]]:
+        person_ids = {model.personal_data_id for model in models}
+        known_person_ids = set(database_session.execute(
+            select(PersonalData.id).where(PersonalData.id.in_(person_ids))).scalars())
+        category_tree = get_category_tree(database_session)
+        rejected: dict[int, str] = {}
+        for position, model in enumerate(models):
+            if model.personal_data_id not in known_person_ids:
+                rejected[position] = f"Unknown PersonalData {model.personal_data_id}"
+            elif model.finance_item_category_id not in category_tree:
+                rejected[position] = f"Unknown FinanceItemCategory {model.finance_item_category_id}"
+        accepted = [model for position, model in enumerate(models) if position not in rejected]
+        _, skipped = insert_finance_items(accepted, database_session, self.occurrence_counts)
+        return len(accepted) - skipped, skipped, rejected
+
+def store_finance_item_category_chunk(models: list[FinanceItemCategoryModel], database_session: Session) -> tuple[int, int, dict[int, str]]:
+    category_tree = get_category_tree(database_session)
+    rejected = {
+        position: f"Unknown parent FinanceItemCategory {model.parent_id}"
+        for position, model in enumerate(models)
+        if model.parent_id is not None and model.parent_id not in category_tree
+    }
+    rows = [model.model_dump() for position, model in enumerate(models) if position not in rejected]
+    bulk_insert_entities(FinanceItemCategory, rows, database_session)
+    if rows:
+        invalidate_category_tree()
+    return len(rows), 0, rejected
+
+def store_personal_data_chunk(models: list[PersonalDataModel], database_session: Session) -> tuple[int, int, dict[int, str]]:
+    rows = [model.model_dump() for model in models]
+    bulk_insert_entities(PersonalData, rows, database_session)
+    return len(rows), 0, {}
+
+#--------------------------------------------------------------------------------------------
+# Ingest loop
+#--------------------------------------------------------------------------------------------
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}"
+        for detail in error.errors(include_url=False))
+
+class _IngestState:
+    def __init__(self, model_class: type[BaseModel], store_chunk: ChunkWriter, database_session: Session, chunk_size: int):
+        self.model_class = model_class
+        self.store_chunk = store_chunk
+        self.database_session = database_session
+        self.chunk_size = chunk_size
+        self.result = BulkIngestResult()
+        self.pending_rows: list[int] = []
+        self.pending_models: list[BaseModel] = []
+        self.pending_values: list[Any] = []
+        self.chunk_rejected = 0
+
+    def reject(self, row_number: int, error: str, value: Any = None) -> None:
+        self.result.rejected += 1
+        if len(self.result.rejected_rows) < config.BULK_INGEST_MAX_REJECTED_ROWS:
+            self.result.rejected_rows.append(BulkIngestRejectedRow(row=row_number, error=error, value=value))
+        else:
+            self.result.rejected_rows_truncated = True
+
+    def add(self, row_number: int, value: Any, error: Optional[str]) -> None:
+        self.result.received += 1
+        if not self.chunk_started:
+            self.chunk_first_row = row_number
+        self.chunk_last_row = row_number
+        if error is not None:
+            self.chunk_rejected += 1
+            self.reject(row_number, error, value)
+            return
+        try:
+            model = self.model_class.model_validate(value)
+        except ValidationError as e:
+            self.chunk_rejected += 1
+            self.reject(row_number, _format_validation_error(e), value)
+            return
+        self.pending_rows.append(row_number)
+        self.pending_models.append(model)
+        self.pending_values.append(value)
+
+    @property
+    def chunk_started(self) -> bool:
+        return bool(self.pending_rows) or self.chunk_rejected > 0
+
+    async def flush(self) -> None:
+        if not self.chunk_started:
+            return
+        summary = BulkIngestChunkSummary(
+            chunk=len(self.result.chunks) + 1,
+            first_row=self.chunk_first_row,
+            last_row=self.chunk_last_row,
+            received=len(self.pending_rows) + self.chunk_rejected,
+            rejected=self.chunk_rejected)
+        try:
+            stored, skipped, rejected_positions = 0, 0, {}
+            if self.pending_models:
+                with timed_stage("bulk_ingest_chunk"):
+                    stored, skipped, rejected_positions = await run_blocking(self.store_chunk, self.pending_models, self.database_session)
+            summary.stored = stored
+            summary.skipped = skipped
+            for position, error in sorted(rejected_positions.items()):
+                self.reject(self.pending_rows[position], error, self.pending_values[position])
+            summary.rejected += len(rejected_positions)
+        except Exception as e:
+            # The writer rolled the chunk back; its rows are rejected and ingest goes on
+            logger.error("Bulk ingest chunk %s failed: %s", summary.chunk, e)
+            summary.error = str(e)
+            for row_number, value in zip(self.pending_rows, self.pending_values):
+                self.reject(row_number, f"Chunk {summary.chunk} failed: {e}", value)
+            summary.rejected += len(self.pending_rows)
+        self.result.stored += summary.stored
+        self.result.skipped += summary.skipped
+        self.result.chunks.append(summary)
+        self.pending_rows, self.pending_models, self.pending_values = [], [], []
+        self.chunk_rejected = 0
+
+async def ingest_json_rows(
+        body: AsyncIterator[bytes],
+        model_class: type[BaseModel],
+        store_chunk: ChunkWriter,
+        database_session: Session,
+        chunk_size: Optional[int] = None) -> BulkIngestResult:
+    """
+    Validates the rows of a JSON array or NDJSON body against model_class as they arrive
+    and stores them chunk_size rows at a time, one commit per chunk. The body is not read
+    further while a chunk is being stored, so a fast client is held back by the database
+    instead of filling memory. A failing chunk is rejected as a whole and ingest goes on.
+    """
+    state = _IngestState(model_class, store_chunk, database_session, chunk_size or config.BULK_INGEST_CHUNK_SIZE)
+    reader = JsonRowReader(config.BULK_INGEST_MAX_ROW_BYTES)
+    async for data in body:
+        for row_number, value, error in reader.feed(data):
+            state.add(row_number, value, error)
+            if len(state.pending_rows) + state.chunk_rejected >= state.chunk_size:
+                await state.flush()
+        if reader.failed is not None:
+            break
+    for row_number, value, error in reader.close():
+        state.add(row_number, value, error)
+    await state.flush()
+
+    state.result.error = reader.failed
+    logger.info(
+        "Bulk ingested %d of %d %s rows in %d chunks, %d skipped as already stored, %d rejected.",
+        state.result.stored, state.result.received, model_class.__name__,
+        len(state.result.chunks), state.result.skipped, state.result.rejected)
+    return state.result
@@ -0,0 +1,135 @@
+import logging
+import re
+import threading
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from src.data_versions import get_table_signature, has_uncommitted_writes, record_data_change
+from src.models.apimodels import FinanceItemModel
+from src.models.entities import FinanceItem, SearchPattern
+from src.monthly_summaries import MonthlySummaryDeltas, apply_monthly_summary_deltas
+
+logger = logging.getLogger(__name__)
+
+class CategoryMatcher:
+    """
+    All SearchPattern rows of one person compiled into a single case insensitive
+    alternation, so a description is categorized in one regex pass. Patterns are
+    matched as plain substrings; the leftmost match wins and, at the same position,
+    the longest pattern wins.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[str, int]]):
+        ordered_patterns = sorted(
+            ((pattern, category_id) for pattern, category_id in patterns if pattern),
+            key=lambda pattern_and_category: -len(pattern_and_category[0]))
+        self.category_ids: list[int] = [category_id for _, category_id in ordered_patterns]
+        self.regex = (
+            re.compile('|'.join(f'({re.escape(pattern)})' for pattern, _ in ordered_patterns), re.IGNORECASE)
+            if ordered_patterns else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.category_ids)
+
+    def match(self, description: str) -> Optional[int]:
+        if self.regex is None:
+            return None
+        pattern_match = self.regex.search(description)
+        if pattern_match is None or pattern_match.lastindex is None:
+            return None
+        return self.category_ids[pattern_match.lastindex - 1]
+
+# personal_data_id -> (signature of their search patterns it was built under, matcher)
+_category_matchers: dict[int, tuple[tuple[Any, ...], CategoryMatcher]] = {}
+_category_matchers_lock = threading.Lock()
+
+def get_category_matcher(database_session: Session, personal_data_id: int) -> CategoryMatcher:
+    """
+    Returns the compiled matcher of a person. The cached matcher is checked against the
+    signature of the person's search patterns, one small query, so patterns written by
+    any process, also with plain SQL, are picked up once committed. A transaction that
+    wrote search patterns itself compiles them uncached.
+    """
+    connection = database_session.connection()
+    uncommitted = has_uncommitted_writes(connection, SearchPattern)
+    signature = None if uncommitted else get_table_signature(connection, SearchPattern, personal_data_id)
+    cached = _category_matchers.get(personal_data_id)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    rows = database_session.execute(
+        select(SearchPattern.pattern, SearchPattern.finance_item_category_id)
+        .where(SearchPattern.personal_data_id == personal_data_id)
+        .order_by(SearchPattern.id)
+    ).all()
+    category_matcher = CategoryMatcher((pattern, category_id) for pattern, category_id in rows)
+    if signature is not None:
+        with _category_matchers_lock:
+            _category_matchers[personal_data_id] = (signature, category_matcher)
+    logger.info("Compiled %s search patterns for PersonalData %s.", len(category_matcher), personal_data_id)
+    return category_matcher
+
+def invalidate_category_matcher(personal_data_id: int) -> None:
+    with _category_matchers_lock:
+        _category_matchers.pop(personal_data_id, None)
+
+def categorize_transactions(
+        transactions: list[FinanceItemModel],
+        category_matcher: CategoryMatcher) -> list[FinanceItemModel]:
+    """Sets the category of every transaction matching a search pattern, in place."""
+    for transaction in transactions:
+        category_id = category_matcher.match(transaction.description)
+        if category_id is not None:
+            transaction.finance_item_category_id = category_id
+    return transactions
+
+def recategorize_finance_items(
+        database_session: Session,
+        personal_data_id: int,
+        chunk_size: int = 1000) -> int:
+    """
+    Re-applies the search patterns of a person to all of their stored finance items.
+    Rows are read in id order, chunk by chunk, and only rows whose category changes are
+    updated, with one executemany and one commit per chunk. Returns the rows updated.
+    """
+    category_matcher = get_category_matcher(database_session, personal_data_id)
+    if not len(category_matcher):
+        return 0
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = database_session.execute(
+            select(
+                FinanceItem.id, FinanceItem.description, FinanceItem.finance_item_category_id,
+                FinanceItem.record_date, FinanceItem.amount)
+            .where(FinanceItem.personal_data_id == personal_data_id, FinanceItem.id > last_id)
+            .order_by(FinanceItem.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        changes = []
+        connection = database_session.connection()
+        summary_deltas = MonthlySummaryDeltas()
+        for finance_item_id, description, current_category_id, record_date, amount in rows:
+            category_id = category_matcher.match(description)
+            if category_id is not None and category_id != current_category_id:
+                changes.append({"id": finance_item_id, "finance_item_category_id": category_id})
+                summary_deltas.add(connection, personal_data_id, record_date, current_category_id, amount, sign=-1)
+                summary_deltas.add(connection, personal_data_id, record_date, category_id, amount)
+        if changes:
+            # Bulk updates by primary key bypass the flush events, move the summaries explicitly
+            database_session.execute(update(FinanceItem), changes)
+            apply_monthly_summary_deltas(connection, summary_deltas)
+            record_data_change(database_session, {(FinanceItem.__tablename__, personal_data_id)})
+            database_session.commit()
+            updated += len(changes)
+
+    logger.info("Recategorized %s finance items for PersonalData %s.", updated, personal_data_id)
+    return updated
@@ -0,0 +1,126 @@
+import logging
+import threading
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.data_versions import get_table_signature, has_uncommitted_writes
+from src.models.entities import FinanceItemCategory
+
+logger = logging.getLogger(__name__)
+
+class CategoryTreeIndex:
+    """
+    The FinanceItemCategory hierarchy with interval numbering: categories are numbered
+    in pre-order, so the subtree of a category is the contiguous range enter..exit of
+    that numbering. "Is X under Y" is two integer comparisons and the descendants of a
+    category are one slice, without walking parent_id. Rows whose parent is missing, or
+    that sit on a parent_id cycle, are treated as roots.
+    """
+
+    def __init__(self, parents: Iterable[tuple[int, Optional[int]]]):
+        parent_by_category = dict(parents)
+        children_by_category: dict[int, list[int]] = {}
+        for category_id in sorted(parent_by_category):
+            parent_id = parent_by_category[category_id]
+            if parent_id is not None and parent_id in parent_by_category and parent_id != category_id:
+                children_by_category.setdefault(parent_id, []).append(category_id)
+
+        self.order: list[int] = []
+        self.enter: dict[int, int] = {}
+        self.exit: dict[int, int] = {}
+        self.ancestors_by_category: dict[int, tuple[int, ...]] = {}
+
+        # Proper roots first, then whatever is left over on a cycle
+        candidates = [
+            category_id for category_id in sorted(parent_by_category)
+            if parent_by_category[category_id] not in parent_by_category or parent_by_category[category_id] == category_id
+        ]
+        candidates.extend(sorted(parent_by_category))
+        for root_id in candidates:
+            if root_id not in self.enter:
+                self._number_subtree(root_id, children_by_category)
+
+    def _number_subtree(self, root_id: int, children_by_category: dict[int, list[int]]) -> None:
+        stack: list[tuple[int, tuple[int, ...], bool]] = [(root_id, (), False)]
+        while stack:
+            category_id, parent_ancestors, leaving = stack.pop()
+            if leaving:
+                self.exit[category_id] = len(self.order) - 1
+                continue
+            self.enter[category_id] = len(self.order)
+            self.order.append(category_id)
+            ancestors = (category_id, *parent_ancestors)
+            self.ancestors_by_category[category_id] = ancestors
+            stack.append((category_id, parent_ancestors, True))
+            for child_id in reversed(children_by_category.get(category_id, ())):
+                if child_id not in self.enter:
+                    stack.append((child_id, ancestors, False))
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __contains__(self, finance_item_category_id: object) -> bool:
+        return finance_item_category_id in self.enter
+
+    def ancestors(self, finance_item_category_id: int) -> tuple[int, ...]:
+        """The category followed by its parent, grandparent and so on up to the root."""
+        ancestors = self.ancestors_by_category.get(finance_item_category_id)
+        if ancestors is None:
+            raise KeyError(f"Unknown FinanceItemCategory {finance_item_category_id}")
+        return ancestors
+
+    def is_descendant(self, finance_item_category_id: int, ancestor_id: int, include_self: bool = True) -> bool:
+        """Whether the category lies in the subtree of ancestor_id."""
+        enter = self.enter.get(finance_item_category_id)
+        ancestor_enter = self.enter.get(ancestor_id)
+        if enter is None or ancestor_enter is None:
+            return False
+        if enter == ancestor_enter:
+            return include_self
+        return ancestor_enter < enter <= self.exit[ancestor_id]
+
+    def descendants(self, finance_item_category_id: int, include_self: bool = True) -> list[int]:
+        """All categories in the subtree, in pre-order; empty for an unknown category."""
+        enter = self.enter.get(finance_item_category_id)
+        if enter is None:
+            return []
+        return self.order[enter if include_self else enter + 1:self.exit[finance_item_category_id] + 1]
+
+# (table signature it was read under, index)
+_category_tree: Optional[tuple[tuple[Any, ...], CategoryTreeIndex]] = None
+_category_tree_lock = threading.Lock()
+
+def load_category_tree(connection: Connection) -> CategoryTreeIndex:
+    """Reads the category index from the database, bypassing the cache."""
+    rows = connection.execute(select(FinanceItemCategory.id, FinanceItemCategory.parent_id)).all()
+    return CategoryTreeIndex((category_id, parent_id) for category_id, parent_id in rows)
+
+def get_category_tree(database_session: Session | Connection) -> CategoryTreeIndex:
+    """
+    Returns the category index. The cached index is checked against the signature of the
+    category table, one small query, so categories written by any process are picked up
+    once committed; the whole table is only read again after such a write. A transaction
+    that wrote categories itself reads them uncached and does not cache what it read.
+    """
+    global _category_tree
+    connection = database_session.connection() if isinstance(database_session, Session) else database_session
+    if has_uncommitted_writes(connection, FinanceItemCategory):
+        return load_category_tree(connection)
+
+    signature = get_table_signature(connection, FinanceItemCategory)
+    cached = _category_tree
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    category_tree = load_category_tree(connection)
+    with _category_tree_lock:
+        _category_tree = (signature, category_tree)
+    logger.info("Indexed %s finance item categories.", len(category_tree))
+    return category_tree
+
+def invalidate_category_tree() -> None:
+    global _category_tree
+    with _category_tree_lock:
+        _category_tree = None
@@ -0,0 +1,177 @@
+import os
+
+#--------------------------------------------------------------------------------------------
+# Environment driven application settings. Every value can be overridden with the
+# matching MYFINANCE_* environment variable.
+#--------------------------------------------------------------------------------------------
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+def _env_mapping(name: str, default: str = "") -> dict[str, str]:
+    """Parses 'key=value,key=value' pairs, skipping malformed entries."""
+    mapping: dict[str, str] = {}
+    for pair in os.environ.get(name, default).split(","):
+        key, separator, value = pair.partition("=")
+        if separator and key.strip() and value.strip():
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+def _env_rates(name: str, default: str = "") -> dict[str, float]:
+    rates: dict[str, float] = {}
+    for key, value in _env_mapping(name, default).items():
+        try:
+            rates[key] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+#--------------------------------------------------------------------------------------------
+# Logging
+#--------------------------------------------------------------------------------------------
+LOG_LEVEL = os.environ.get("MYFINANCE_LOG_LEVEL", "INFO").strip().upper() or "INFO"
+# "json" writes one JSON object per line, "text" the classic single line format.
+LOG_FORMAT = os.environ.get("MYFINANCE_LOG_FORMAT", "json").strip().lower()
+# Log file written next to the console output. Leave empty to log to the console only.
+LOG_FILE = os.environ.get("MYFINANCE_LOG_FILE", "app.log")
+# Per logger levels, e.g. "src.entitybuilder=WARNING,sqlalchemy.engine=INFO".
+LOG_LEVELS = {
+    logger_name: level.upper()
+    for logger_name, level in _env_mapping("MYFINANCE_LOG_LEVELS").items()
+}
+# Fraction of the DEBUG/INFO records kept per logger, e.g. "src.controllers.finance=0.1".
+LOG_SAMPLING = _env_rates("MYFINANCE_LOG_SAMPLING")
+
+#--------------------------------------------------------------------------------------------
+# PDF extraction
+#--------------------------------------------------------------------------------------------
+# Number of worker processes used to extract page text from large statements.
+PDF_EXTRACTION_MAX_WORKERS = max(1, _env_int("MYFINANCE_PDF_EXTRACTION_MAX_WORKERS", os.cpu_count() or 1))
+# Uploads of at least this many bytes are parsed page by page straight from the spooled
+# upload file instead of being read into memory. 0 streams every upload.
+STREAMING_EXTRACTION_MIN_BYTES = max(0, _env_int("MYFINANCE_STREAMING_EXTRACTION_MIN_BYTES", 32 * 1024 * 1024))
+# Statements with fewer pages than this are extracted serially.
+PDF_EXTRACTION_PARALLEL_MIN_PAGES = max(1, _env_int("MYFINANCE_PDF_EXTRACTION_PARALLEL_MIN_PAGES", 8))
+# Smallest page range handed to a single worker process.
+PDF_EXTRACTION_MIN_PAGES_PER_WORKER = max(1, _env_int("MYFINANCE_PDF_EXTRACTION_MIN_PAGES_PER_WORKER", 4))
+
+#--------------------------------------------------------------------------------------------
+# Statement cache
+#--------------------------------------------------------------------------------------------
+# Maximum number of parsed statements kept in memory.
+STATEMENT_CACHE_MAX_ENTRIES = max(0, _env_int("MYFINANCE_STATEMENT_CACHE_MAX_ENTRIES", 128))
+# Directory of the optional on-disk cache tier. Leave empty to disable it.
+STATEMENT_CACHE_DIRECTORY = os.environ.get("MYFINANCE_STATEMENT_CACHE_DIRECTORY", "")
+
+#--------------------------------------------------------------------------------------------
+# Batch statement upload
+#--------------------------------------------------------------------------------------------
+# Statements of one batch processed at the same time.
+STATEMENT_BATCH_MAX_CONCURRENCY = max(1, _env_int("MYFINANCE_STATEMENT_BATCH_MAX_CONCURRENCY", 4))
+# Statement PDFs accepted per batch, counting the PDFs inside zip archives.
+STATEMENT_BATCH_MAX_FILES = max(1, _env_int("MYFINANCE_STATEMENT_BATCH_MAX_FILES", 100))
+# Uncompressed size limit of one uploaded zip archive.
+STATEMENT_BATCH_MAX_ARCHIVE_BYTES = max(1, _env_int("MYFINANCE_STATEMENT_BATCH_MAX_ARCHIVE_BYTES", 256 * 1024 * 1024))
+
+#--------------------------------------------------------------------------------------------
+# Background import jobs
+#--------------------------------------------------------------------------------------------
+# SQLite file holding the queued jobs and their uploads, so jobs survive a restart.
+IMPORT_JOB_DATABASE_PATH = os.environ.get("MYFINANCE_IMPORT_JOB_DATABASE_PATH", "import_jobs.db")
+# Workers started inside the API process. Set to 0 when jobs are run by a separate
+# `python -m src.import_jobs worker` process instead.
+IMPORT_JOB_WORKERS = max(0, _env_int("MYFINANCE_IMPORT_JOB_WORKERS", 2))
+# Idle workers look for jobs queued by other processes this often.
+IMPORT_JOB_POLL_INTERVAL_MS = max(10, _env_int("MYFINANCE_IMPORT_JOB_POLL_INTERVAL_MS", 1000))
+# A running job whose worker stops renewing its lease for this long is picked up again.
+IMPORT_JOB_LEASE_SECONDS = max(1, _env_int("MYFINANCE_IMPORT_JOB_LEASE_SECONDS", 60))
+# Jobs started this many times without finishing are marked failed.
+IMPORT_JOB_MAX_ATTEMPTS = max(1, _env_int("MYFINANCE_IMPORT_JOB_MAX_ATTEMPTS", 3))
+# How often the Server-Sent Events stream checks a job for progress.
+IMPORT_JOB_EVENT_INTERVAL_MS = max(10, _env_int("MYFINANCE_IMPORT_JOB_EVENT_INTERVAL_MS", 500))
+
+#--------------------------------------------------------------------------------------------
+# Metrics and profiling
+#--------------------------------------------------------------------------------------------
+# Percentage of requests profiled with cProfile, 0 disables profiling.
+PROFILE_SAMPLE_PERCENT = min(100, max(0, _env_int("MYFINANCE_PROFILE_SAMPLE_PERCENT", 0)))
+# Directory the .prof files of sampled requests are written to.
+PROFILE_DIRECTORY = os.environ.get("MYFINANCE_PROFILE_DIRECTORY", "profiles")
+
+#--------------------------------------------------------------------------------------------
+# Statement type settings registry
+#--------------------------------------------------------------------------------------------
+# Seconds before the cached StatementTypeSettings are reloaded. 0 only reloads on invalidation.
+STATEMENT_SETTINGS_TTL_SECONDS = max(0, _env_int("MYFINANCE_STATEMENT_SETTINGS_TTL_SECONDS", 300))
+# Leading pages read to detect the type of a statement uploaded without one.
+STATEMENT_DETECTION_MAX_PAGES = max(1, _env_int("MYFINANCE_STATEMENT_DETECTION_MAX_PAGES", 5))
+
+#--------------------------------------------------------------------------------------------
+# Database access
+#--------------------------------------------------------------------------------------------
+# Use & to separate parameters, and ensure driver name is correct and URL-encoded.
+DATABASE_URL = os.environ.get(
+    "MYFINANCE_DATABASE_URL",
+    "mssql+pyodbc://@2KJG544-W10\\SQLEXPRESS/MyFinanceDB?driver=ODBC+Driver+17+for+SQL+Server&Trusted_Connection=yes")
+# Create missing tables when the application starts. Off by default, run
+# `python -m src.database create-schema` (or the sqls/ scripts) as a deployment step instead.
+CREATE_SCHEMA_ON_STARTUP = _env_bool("MYFINANCE_CREATE_SCHEMA_ON_STARTUP", False)
+# URL of the async engine. Derived from the sync URL when empty (e.g. mssql+pyodbc becomes
+# mssql+aioodbc); use sqlite+aiosqlite:///./myfinance.db to run locally without SQL Server.
+ASYNC_DATABASE_URL = os.environ.get("MYFINANCE_ASYNC_DATABASE_URL", "")
+DATABASE_POOL_SIZE = max(1, _env_int("MYFINANCE_DATABASE_POOL_SIZE", 10))
+DATABASE_MAX_OVERFLOW = max(0, _env_int("MYFINANCE_DATABASE_MAX_OVERFLOW", 20))
+DATABASE_POOL_TIMEOUT_SECONDS = max(1, _env_int("MYFINANCE_DATABASE_POOL_TIMEOUT_SECONDS", 30))
+DATABASE_POOL_RECYCLE_SECONDS = _env_int("MYFINANCE_DATABASE_POOL_RECYCLE_SECONDS", 1800)
+# Threads available to database work that has to stay synchronous.
+DATABASE_THREAD_POOL_SIZE = max(1, _env_int("MYFINANCE_DATABASE_THREAD_POOL_SIZE", 8))
+
+#--------------------------------------------------------------------------------------------
+# Finance item queries
+#--------------------------------------------------------------------------------------------
+FINANCE_ITEM_PAGE_SIZE = max(1, _env_int("MYFINANCE_FINANCE_ITEM_PAGE_SIZE", 100))
+FINANCE_ITEM_MAX_PAGE_SIZE = max(1, _env_int("MYFINANCE_FINANCE_ITEM_MAX_PAGE_SIZE", 1000))
+# Rows fetched from the server-side cursor per round trip when streaming
+FINANCE_ITEM_STREAM_BATCH_SIZE = max(1, _env_int("MYFINANCE_FINANCE_ITEM_STREAM_BATCH_SIZE", 1000))
+
+#--------------------------------------------------------------------------------------------
+# Analytics store
+#--------------------------------------------------------------------------------------------
+# Directory of the columnar finance item copy (Arrow IPC files, needs pyarrow).
+ANALYTICS_DIRECTORY = os.environ.get("MYFINANCE_ANALYTICS_DIRECTORY", "analytics")
+# Rows read from the database and written per file while exporting.
+ANALYTICS_EXPORT_BATCH_SIZE = max(1, _env_int("MYFINANCE_ANALYTICS_EXPORT_BATCH_SIZE", 50000))
+
+#--------------------------------------------------------------------------------------------
+# Bulk ingest
+#--------------------------------------------------------------------------------------------
+# Rows stored per INSERT and commit by the /bulk endpoints.
+BULK_INGEST_CHUNK_SIZE = max(1, _env_int("MYFINANCE_BULK_INGEST_CHUNK_SIZE", 1000))
+# Longest accepted row, in characters of JSON.
+BULK_INGEST_MAX_ROW_BYTES = max(1, _env_int("MYFINANCE_BULK_INGEST_MAX_ROW_BYTES", 1024 * 1024))
+# Rejected rows listed in a response; the rest are only counted.
+BULK_INGEST_MAX_REJECTED_ROWS = max(0, _env_int("MYFINANCE_BULK_INGEST_MAX_REJECTED_ROWS", 1000))
+
+#--------------------------------------------------------------------------------------------
+# HTTP response caching
+#--------------------------------------------------------------------------------------------
+# ETags and 304 Not Modified on the read endpoints, built from the DataVersion table
+# (sqls/AddDataVersion.sql). Every write bumps that table whether this is on or not;
+# it only decides whether the read endpoints answer conditional requests.
+HTTP_CACHE_ENABLED = _env_bool("MYFINANCE_HTTP_CACHE_ENABLED", False)
+# Encoded read responses kept in memory, 0 only answers conditional requests.
+RESPONSE_CACHE_MAX_ENTRIES = max(0, _env_int("MYFINANCE_RESPONSE_CACHE_MAX_ENTRIES", 256))
+# Larger responses are sent but not kept.
+RESPONSE_CACHE_MAX_ENTRY_BYTES = max(0, _env_int("MYFINANCE_RESPONSE_CACHE_MAX_ENTRY_BYTES", 256 * 1024))
@@ -1,42 +1,47 @@
 #--------------------------------------------------------------------------------------------
 # Third library party imports
 #--------------------------------------------------------------------------------------------
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi import Body, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import Body, Depends, Form, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import Any
-from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, AsyncIterator, BinaryIO, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.requests import Request
 import logging
-from datetime import datetime
+from datetime import date, datetime, timezone
+from email.utils import format_datetime
 #--------------------------------------------------------------------------------------------
 
 #--------------------------------------------------------------------------------------------
 # Custom library imports
 #--------------------------------------------------------------------------------------------
-from src.models.apimodels import FinanceItemCategoryModel, FinanceItemModel, PersonalDataModel
-from src.models.entities import PersonalData, FinanceItemCategory, FinanceItem, SettingsJson
+import src.config as config
+from src.models.apimodels import BulkIngestResult, FinanceItemCategoryModel, FinanceItemModel, PersistedFinanceItemModel, PersonalDataModel, StatementImportResult
+from src.models.entities import PersonalData, FinanceItemCategory, FinanceItem, FinanceItemMonthlySummary
 from src.models.enumerations import StatementType
-from src.file_utils import extract_transaction_pages_as_text_from_pdf, extract_transactions
-from src.entitybuilder import add_or_update_model, get_database_session, get_statement_type_settings_by_type
-from src.extensions.object_extensions import to_json
-#--------------------------------------------------------------------------------------------
-
-app = FastAPI()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Console
-        logging.FileHandler('app.log', encoding='utf-8')  # File
-    ]
-)
+from src.async_database import create_async_session, get_async_database_session, run_blocking
+from src.entitybuilder import add_or_update_model_async, assign_finance_item_fingerprint, get_database_session
+from src.extensions.entity_serializers import EntityJSONResponse, entities_response, entity_response
+from src.finance_item_queries import FinanceItemFilter, get_finance_item_page, get_monthly_summaries, stream_finance_items_ndjson
+from src.analytics_store import AnalyticsUnavailableError, analytics_store
+from src.bulk_ingest import FinanceItemChunkWriter, ingest_json_rows, store_finance_item_category_chunk, store_personal_data_chunk
+from src.category_tree import get_category_tree
+from src.categorization import recategorize_finance_items
+from src.metrics import metrics_response, timed_stage
+from src.response_cache import conditional_response
+from src.import_jobs import import_job_store, import_job_workers, stream_import_job_events
+from src.statement_detection import StatementTypeNotDetectedError
+from src.statement_import import StatementUpload, expand_zip_archive, import_statement, import_statement_batch, is_zip_archive
+#--------------------------------------------------------------------------------------------
+
+router = APIRouter()
+
 logger = logging.getLogger(__name__)
 
 
-@app.get("/ping")
+@router.get("/ping")
 async def ping() -> dict[str, Any]:
     return {
         "message": "pong", 
@@ -46,12 +51,12 @@ async def ping() -> dict[str, Any]:
 #--------------------------------------------------------------------------------------------
 # POST: Create Personal Data
 #--------------------------------------------------------------------------------------------
-@app.post("/personal-data/")
+@router.post("/personal-data/")
 async def create_personal_data(
     personal_data_model: PersonalDataModel = Body(...),
-    database_session: Session = Depends(get_database_session)
-) -> str:
-    logger.info(f"Creating PersonalData: {personal_data_model}")
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    logger.debug("Creating PersonalData: %s", personal_data_model)
     personal_data = PersonalData(
         first_name=personal_data_model.first_name,
         last_name=personal_data_model.last_name,
@@ -61,74 +66,244 @@ async def create_personal_data(
         address=personal_data_model.address,
         pin=personal_data_model.pin
     )
-    personal_data = await add_or_update_model(personal_data, database_session)
+    personal_data = await add_or_update_model_async(personal_data, database_session)
     logger.info("PersonalData saved successfully.")
 
-    return to_json(personal_data)  # Using utility function
+    return entity_response(personal_data)  # Encoded once, straight from the column metadata
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Personal Data
+#--------------------------------------------------------------------------------------------
+@router.get("/personal-data/{personal_data_id}")
+async def get_personal_data(
+    personal_data_id: int,
+    request: Request,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    async def build_response() -> Response:
+        personal_data = await database_session.get(PersonalData, personal_data_id)
+        if personal_data is None:
+            raise HTTPException(status_code=404, detail=f"PersonalData {personal_data_id} not found")
+        return entity_response(personal_data)
+
+    return await conditional_response(request, database_session, [(PersonalData.__tablename__, personal_data_id)], build_response)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Prometheus metrics
+#--------------------------------------------------------------------------------------------
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    return metrics_response()
 
 #--------------------------------------------------------------------------------------------
 
 #--------------------------------------------------------------------------------------------
 # POST: Upload PDF and extract transactions
 #--------------------------------------------------------------------------------------------
-@app.post("/upload-pdf/")
+@router.post("/upload-pdf/")
 async def upload_pdf(
     pdf_file: UploadFile = File(...),
-    statement_type: StatementType = Body(...),
+    statement_type: Optional[StatementType] = Body(None),
+    personal_data_id: int = Body(1),
+    persist: bool = Body(False),
     database_session: Session = Depends(get_database_session)
-) -> list[FinanceItemModel]:
-    logger.info(f"Received file upload: {pdf_file.filename}")
+) -> list[PersistedFinanceItemModel] | list[FinanceItemModel]:
+    """Without a statement_type the type is detected from the first pages of the PDF."""
+    logger.info("Received file upload: %s", pdf_file.filename)
     try:
-        settings_json_obj: SettingsJson = get_statement_type_settings_by_type(
+        content: bytes | BinaryIO
+        if pdf_file.size is not None and pdf_file.size >= config.STREAMING_EXTRACTION_MIN_BYTES:
+            content = pdf_file.file  # Spooled to disk by Starlette, parsed page by page
+        else:
+            with timed_stage("read_upload"):
+                content = await pdf_file.read()
+        return await import_statement(
+            content,
+            statement_type,
+            personal_data_id,
+            persist,
             database_session,
-            statement_type)
-
-        pdf_content = await extract_transaction_pages_as_text_from_pdf(
-            pdf_file, 
-            settings_json_obj.transaction_page_keywords)
-
-        extracted_transactions: list[FinanceItemModel] = extract_transactions(
-            pdf_content, 
-            settings_json_obj
-        )        # file_path = await save_pdf_file(pdf_file)
+            pdf_file.filename or "")
 
-        # Convert FinanceItem objects to dicts for FastAPI serialization
-        return extracted_transactions
-        
+    except StatementTypeNotDetectedError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.error(f"Failed to read PDF: {e}")
+        logger.error("Failed to read PDF: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to read PDF: {str(e)}")
 #--------------------------------------------------------------------------------------------
 
+#--------------------------------------------------------------------------------------------
+# POST: Upload many PDF Statements (or zip archives of them) in one request
+#--------------------------------------------------------------------------------------------
+@router.post("/upload-statements/")
+async def upload_statements(
+    files: list[UploadFile] = File(...),
+    statement_types: list[StatementType] = Form([]),
+    personal_data_id: int = Form(1),
+    persist: bool = Form(False)
+) -> list[StatementImportResult]:
+    """
+    Imports several statements at once. statement_types holds one type per file, or a
+    single type used for every file; without any the type of each statement is detected.
+    Results come back per statement, failures included; archives that cannot be opened
+    are reported first.
+    """
+    if len(statement_types) not in (0, 1, len(files)):
+        raise HTTPException(status_code=400, detail="Give one statement type, or one per uploaded file")
+    file_statement_types: list[Optional[StatementType]] = (
+        list(statement_types) if len(statement_types) == len(files) else [statement_types[0] if statement_types else None] * len(files))
+
+    uploads: list[StatementUpload] = []
+    rejected: list[StatementImportResult] = []
+    for upload_file, statement_type in zip(files, file_statement_types):
+        filename = upload_file.filename or ""
+        content: bytes = await upload_file.read()
+        if not is_zip_archive(filename, content):
+            uploads.append(StatementUpload(filename, content, statement_type))
+            continue
+        try:
+            uploads.extend(await run_blocking(
+                expand_zip_archive, filename, content, statement_type, config.STATEMENT_BATCH_MAX_FILES))
+        except ValueError as e:
+            rejected.append(StatementImportResult(filename=filename, statement_type=statement_type, error=str(e)))
+
+    if len(uploads) > config.STATEMENT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {config.STATEMENT_BATCH_MAX_FILES} statements per batch")
+    logger.info("Received %s statements for PersonalData %s.", len(uploads), personal_data_id)
+
+    return rejected + await import_statement_batch(uploads, personal_data_id, persist)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# POST: Queue a PDF Statement import as a background job
+#--------------------------------------------------------------------------------------------
+@router.post("/import-jobs/", status_code=202)
+async def create_import_job(
+    pdf_file: UploadFile = File(...),
+    statement_type: Optional[StatementType] = Body(None),
+    personal_data_id: int = Body(1),
+    persist: bool = Body(True)
+) -> dict[str, Any]:
+    content: bytes = await pdf_file.read()
+    import_job = await run_blocking(
+        import_job_store.enqueue,
+        pdf_file.filename or "",
+        content,
+        statement_type,
+        personal_data_id,
+        persist)
+    import_job_workers.notify()
+
+    return import_job.to_dict(include_result=False)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Import job status and result
+#--------------------------------------------------------------------------------------------
+@router.get("/import-jobs/{job_id}")
+async def get_import_job(job_id: str) -> dict[str, Any]:
+    import_job = await run_blocking(import_job_store.get, job_id)
+    if import_job is None:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+
+    return import_job.to_dict()
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Import job progress as Server-Sent Events
+#--------------------------------------------------------------------------------------------
+@router.get("/import-jobs/{job_id}/events")
+async def get_import_job_events(job_id: str) -> StreamingResponse:
+    if await run_blocking(import_job_store.get, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+
+    return StreamingResponse(
+        stream_import_job_events(import_job_store, job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+#--------------------------------------------------------------------------------------------
+
 #--------------------------------------------------------------------------------------------
 # POST: Create Finance Item Category
 #--------------------------------------------------------------------------------------------
-@app.post("/finance-item-category/")
+@router.post("/finance-item-category/")
 async def create_finance_item_category(
     finance_item_category_model: FinanceItemCategoryModel = Body(...),
-    database_session: Session = Depends(get_database_session)
-) -> str:
-    logger.info(f"Creating FinanceItemCategory: {finance_item_category_model}")
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    logger.debug("Creating FinanceItemCategory: %s", finance_item_category_model)
+    parent_id = finance_item_category_model.parent_id
+    if parent_id is not None:
+        category_tree = await database_session.run_sync(get_category_tree)
+        if parent_id not in category_tree:
+            raise HTTPException(status_code=400, detail=f"Unknown parent FinanceItemCategory {parent_id}")
     finance_item_category = FinanceItemCategory(
         name=finance_item_category_model.name,
-        description=finance_item_category_model.description
+        description=finance_item_category_model.description,
+        parent_id=parent_id
     )
-    finance_item_category = await add_or_update_model(finance_item_category, database_session)
-    logger.info("FinanceItemCategory saved successfully.")
+    finance_item_category = await add_or_update_model_async(finance_item_category, database_session)
+    logger.info("FinanceItemCategory saved successfully.")  # The category tree index is rebuilt on next use
 
-    return to_json(finance_item_category)  # Using utility function
+    return entity_response(finance_item_category)  # Encoded once, straight from the column metadata
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Finance Item Categories and a category subtree
+#--------------------------------------------------------------------------------------------
+@router.get("/finance-item-category/")
+async def list_finance_item_categories(
+    request: Request,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    async def build_response() -> Response:
+        categories = (await database_session.execute(
+            select(FinanceItemCategory).order_by(FinanceItemCategory.id))).scalars().all()
+        return entities_response(list(categories), FinanceItemCategory)
+
+    return await conditional_response(request, database_session, [(FinanceItemCategory.__tablename__, None)], build_response)
+
+@router.get("/finance-item-category/{finance_item_category_id}/descendants")
+async def get_finance_item_category_descendants(
+    finance_item_category_id: int,
+    request: Request,
+    include_self: bool = True,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    async def build_response() -> Response:
+        category_tree = await database_session.run_sync(get_category_tree)
+        if finance_item_category_id not in category_tree:
+            raise HTTPException(status_code=404, detail=f"FinanceItemCategory {finance_item_category_id} not found")
+
+        category_ids = category_tree.descendants(finance_item_category_id, include_self)
+        categories = (await database_session.execute(
+            select(FinanceItemCategory).where(FinanceItemCategory.id.in_(category_ids)))).scalars()
+        categories_by_id = {category.id: category for category in categories}
+
+        return entities_response([categories_by_id[category_id] for category_id in category_ids if category_id in categories_by_id], FinanceItemCategory)
+
+    return await conditional_response(request, database_session, [(FinanceItemCategory.__tablename__, None)], build_response)
 
 #--------------------------------------------------------------------------------------------
 
 #--------------------------------------------------------------------------------------------
 # POST: Create Finance Item
 #--------------------------------------------------------------------------------------------
-@app.post("/finance-item/")
+@router.post("/finance-item/")
 async def create_finance_item(
     finance_item_model: FinanceItemModel = Body(...),
-    database_session: Session = Depends(get_database_session)
-) -> str:
-    logger.info(f"Creating FinanceItem: {finance_item_model}")
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    logger.debug("Creating FinanceItem: %s", finance_item_model)
     finance_item = FinanceItem(
         record_date=finance_item_model.record_date,
         description=finance_item_model.description,
@@ -136,16 +311,187 @@ async def create_finance_item(
         amount=finance_item_model.amount,
         personal_data_id=finance_item_model.personal_data_id
     )
-    finance_item = await add_or_update_model(finance_item, database_session)
+    await database_session.run_sync(lambda sync_session: assign_finance_item_fingerprint(finance_item, sync_session))
+    finance_item = await add_or_update_model_async(finance_item, database_session)
     logger.info("FinanceItem saved successfully.")
 
-    return to_json(finance_item)  # Using utility function
+    return entity_response(finance_item)  # Encoded once, straight from the column metadata
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# POST: Bulk ingest of Personal Data, Finance Item Categories and Finance Items.
+# The body is a JSON array or NDJSON, read and stored chunk by chunk as it arrives.
+#--------------------------------------------------------------------------------------------
+@router.post("/personal-data/bulk")
+async def bulk_ingest_personal_data(
+    request: Request,
+    chunk_size: Optional[int] = Query(None, ge=1),
+    database_session: Session = Depends(get_database_session)
+) -> BulkIngestResult:
+    return await ingest_json_rows(request.stream(), PersonalDataModel, store_personal_data_chunk, database_session, chunk_size)
+
+@router.post("/finance-item-category/bulk")
+async def bulk_ingest_finance_item_categories(
+    request: Request,
+    chunk_size: Optional[int] = Query(None, ge=1),
+    database_session: Session = Depends(get_database_session)
+) -> BulkIngestResult:
+    return await ingest_json_rows(request.stream(), FinanceItemCategoryModel, store_finance_item_category_chunk, database_session, chunk_size)
+
+@router.post("/finance-item/bulk")
+async def bulk_ingest_finance_items(
+    request: Request,
+    chunk_size: Optional[int] = Query(None, ge=1),
+    database_session: Session = Depends(get_database_session)
+) -> BulkIngestResult:
+    return await ingest_json_rows(request.stream(), FinanceItemModel, FinanceItemChunkWriter(), database_session, chunk_size)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: List and stream Finance Items
+#--------------------------------------------------------------------------------------------
+def get_finance_item_filter(
+    personal_data_id: int,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    finance_item_category_id: Optional[int] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None
+) -> FinanceItemFilter:
+    return FinanceItemFilter(personal_data_id, date_from, date_to, finance_item_category_id, amount_min, amount_max)
+
+@router.get("/finance-item/")
+async def list_finance_items(
+    request: Request,
+    finance_item_filter: FinanceItemFilter = Depends(get_finance_item_filter),
+    limit: int = Query(config.FINANCE_ITEM_PAGE_SIZE, ge=1, le=config.FINANCE_ITEM_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    descending: bool = False,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    async def build_response() -> Response:
+        try:
+            page = await get_finance_item_page(database_session, finance_item_filter, limit, cursor, descending)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return EntityJSONResponse(content=page)
+
+    return await conditional_response(
+        request, database_session, [(FinanceItem.__tablename__, finance_item_filter.personal_data_id)], build_response)
+
+@router.get("/finance-item/stream")
+async def stream_finance_items(
+    request: Request,
+    finance_item_filter: FinanceItemFilter = Depends(get_finance_item_filter),
+    descending: bool = False
+) -> Response:
+    async def build_response() -> Response:
+        logger.info("Streaming FinanceItems of PersonalData %s", finance_item_filter.personal_data_id)
+
+        async def ndjson_rows() -> AsyncIterator[bytes]:
+            # The session lives as long as the stream, not as long as the request handler
+            async with create_async_session() as database_session:
+                async for chunk in stream_finance_items_ndjson(
+                    database_session, finance_item_filter, config.FINANCE_ITEM_STREAM_BATCH_SIZE, descending):
+                    yield chunk
+
+        return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
+
+    # Answers If-None-Match, the stream itself is never cached
+    async with create_async_session() as database_session:
+        return await conditional_response(
+            request, database_session, [(FinanceItem.__tablename__, finance_item_filter.personal_data_id)], build_response)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# GET: Monthly spend per category report
+#--------------------------------------------------------------------------------------------
+@router.get("/reports/monthly-spend")
+async def get_monthly_spend_report(
+    personal_data_id: int,
+    request: Request,
+    month_from: Optional[date] = None,
+    month_to: Optional[date] = None,
+    finance_item_category_id: Optional[int] = None,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> Response:
+    async def build_response() -> Response:
+        summaries = await get_monthly_summaries(
+            database_session, personal_data_id, month_from, month_to, finance_item_category_id)
+        return entities_response(summaries, FinanceItemMonthlySummary)
+
+    # The rollups follow the finance items and the category hierarchy
+    scopes = [
+        (FinanceItem.__tablename__, personal_data_id),
+        (FinanceItemMonthlySummary.__tablename__, personal_data_id),
+        (FinanceItemCategory.__tablename__, None)]
+    return await conditional_response(request, database_session, scopes, build_response)
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# Analytics store: columnar export and aggregates over the memory-mapped files
+#--------------------------------------------------------------------------------------------
+@router.post("/analytics/export")
+async def export_analytics(
+    rebuild: bool = False,
+    database_session: Session = Depends(get_database_session)
+) -> dict[str, Any]:
+    try:
+        with timed_stage("analytics_export"):
+            exported = await run_blocking(analytics_store.export, database_session, rebuild)
+    except AnalyticsUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    return {"exported": exported, "rebuild": rebuild}
+
+@router.get("/analytics/monthly-spend")
+async def get_analytics_monthly_spend(
+    response: Response,
+    personal_data_id: Optional[int] = None,
+    month_from: Optional[date] = None,
+    month_to: Optional[date] = None,
+    finance_item_category_id: Optional[int] = None,
+    database_session: AsyncSession = Depends(get_async_database_session)
+) -> list[dict[str, Any]]:
+    category_ids = None
+    if finance_item_category_id is not None:
+        category_tree = await database_session.run_sync(get_category_tree)
+        category_ids = category_tree.descendants(finance_item_category_id, include_self=True)
+    try:
+        monthly_spend = await run_blocking(
+            analytics_store.monthly_spend, personal_data_id, month_from, month_to, category_ids)
+    except AnalyticsUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    # The store is as old as its last export, not as the database
+    exported_at = await run_blocking(analytics_store.exported_at)
+    if exported_at is not None:
+        response.headers["Last-Modified"] = format_datetime(exported_at.astimezone(timezone.utc), usegmt=True)
+    return monthly_spend
+
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# POST: Re-categorize stored Finance Items from Search Patterns
+#--------------------------------------------------------------------------------------------
+@router.post("/finance-item/recategorize/{personal_data_id}")
+async def recategorize_finance_items_of_person(
+    personal_data_id: int,
+    database_session: Session = Depends(get_database_session)
+) -> dict[str, Any]:
+    logger.info("Recategorizing FinanceItems of PersonalData %s", personal_data_id)
+    updated = await run_blocking(recategorize_finance_items, database_session, personal_data_id)
+
+    return {"personal_data_id": personal_data_id, "updated": updated}
 
 #--------------------------------------------------------------------------------------------
 
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error"}
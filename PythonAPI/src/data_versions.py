@@ -0,0 +1,184 @@
+import logging
+from functools import partial
+from typing import Any, Iterable, Optional
+
+import sqlalchemy as _sql
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.models.entities import DataVersion, EntityBase, PersonalData
+from src.upserts import increment_rows, register_upsert_listener
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------------
+# Write counters per table and person, the source of the ETags of read responses. The
+# DataVersion rows of the tables and people a transaction writes are bumped inside that
+# transaction, so every process sees a new version together with the rows behind it.
+# Rows of tables without a personal_data_id (categories, settings) count under None and
+# a PersonalData row under its own id. Writes are counted whether or not HTTP caching is
+# on, so a process with it off never leaves another process serving stale 304s.
+#--------------------------------------------------------------------------------------------
+DataScope = tuple[str, Optional[int]]
+
+# The unique index of DataVersion and the counter added up under it
+_VERSION_KEY_COLUMNS = ["table_name", "personal_data_id"]
+_VERSION_COUNTER_COLUMNS = ["version"]
+
+# connection.info entry: (transaction, names of the tables it wrote)
+_WRITTEN_TABLES_KEY = "data_versions.written_tables"
+
+def _personal_data_ids(entity: EntityBase) -> set[Optional[int]]:
+    """The person an entity belongs to, and the one it belonged to before an unflushed change."""
+    if isinstance(entity, PersonalData):
+        # A person without an id yet was never read, so no ETag of it needs to change
+        person_id = entity.__dict__.get("id")
+        return {person_id} if person_id else set()
+    if "personal_data_id" not in _sql.inspect(type(entity)).column_attrs:
+        return {None}
+    history = _sql.inspect(entity).attrs["personal_data_id"].history
+    return {*history.deleted, entity.__dict__.get("personal_data_id")}
+
+def entity_scopes(entities: Iterable[EntityBase]) -> set[DataScope]:
+    return {
+        (entity.__tablename__, personal_data_id)
+        for entity in entities
+        if not isinstance(entity, DataVersion)
+        for personal_data_id in _personal_data_ids(entity)
+    }
+
+def row_scopes(entity_class: type[EntityBase], rows: Iterable[dict[str, Any]], ids: Iterable[int]) -> set[DataScope]:
+    """entity_scopes of rows written as column dicts, ids being the ids of those rows."""
+    table_name = entity_class.__tablename__
+    if entity_class is PersonalData:
+        return {(table_name, row_id) for row_id in ids}
+    if "personal_data_id" not in entity_class.__table__.c:  # type: ignore
+        return {(table_name, None)}
+    return {(table_name, row["personal_data_id"]) for row in rows}
+
+def _scope_key(scope: DataScope) -> tuple[str, int]:
+    table_name, personal_data_id = scope
+    return table_name, personal_data_id or 0
+
+def _mark_written(connection: Connection, table_names: Iterable[str]) -> None:
+    transaction = connection.get_transaction()
+    written = connection.info.get(_WRITTEN_TABLES_KEY)
+    if written is None or written[0] is not transaction:
+        written = (transaction, set())
+        connection.info[_WRITTEN_TABLES_KEY] = written
+    written[1].update(table_names)
+
+def has_uncommitted_writes(connection: Connection, entity_class: type[EntityBase]) -> bool:
+    """
+    Whether the open transaction of connection wrote rows of entity_class. What it reads
+    of that table is not committed yet, so it must not be cached for other transactions.
+    """
+    written = connection.info.get(_WRITTEN_TABLES_KEY)
+    return (
+        written is not None
+        and written[0] is not None
+        and written[0] is connection.get_transaction()
+        and entity_class.__tablename__ in written[1])
+
+def bump_data_versions(connection: Connection, scopes: Iterable[DataScope]) -> None:
+    """Adds one to the DataVersion rows of scopes, within the transaction of connection."""
+    scopes = set(scopes)
+    _mark_written(connection, {table_name for table_name, _ in scopes})
+    # Sorted, so concurrent writers lock the rows they share in the same order
+    rows = [
+        {"table_name": table_name, "personal_data_id": personal_data_id, "version": 1}
+        for table_name, personal_data_id in sorted({_scope_key(scope) for scope in scopes})
+    ]
+    if not rows or increment_rows(connection, DataVersion.__table__, rows, _VERSION_KEY_COLUMNS, _VERSION_COUNTER_COLUMNS):  # type: ignore
+        return
+    for row in rows:
+        result = connection.execute(
+            update(DataVersion)
+            .where(
+                DataVersion.table_name == row["table_name"],
+                DataVersion.personal_data_id == row["personal_data_id"])
+            .values(version=DataVersion.version + 1))
+        if result.rowcount == 0:
+            connection.execute(insert(DataVersion).values(**row))
+
+def record_data_change(database_session: Session, scopes: Iterable[DataScope]) -> None:
+    """
+    Bumps the versions of scopes written in the current transaction, for writes that
+    bypass the ORM unit of work. A rollback takes the bump back with the write.
+    """
+    bump_data_versions(database_session.connection(), scopes)
+
+def get_table_signature(
+        connection: Connection,
+        entity_class: type[EntityBase],
+        personal_data_id: Optional[int] = None) -> tuple[Any, ...]:
+    """
+    Changes whenever rows of entity_class (of one person, when given) are written: the
+    DataVersion of the scope, which counts every write made through the application, and
+    the row count and highest id, which also catch rows inserted or deleted with plain SQL.
+    Caches of data derived from the table compare it before reusing what they hold.
+    """
+    table = entity_class.__table__  # type: ignore
+    table_name, version_personal_data_id = _scope_key((entity_class.__tablename__, personal_data_id))
+    version = (
+        select(DataVersion.version)
+        .where(DataVersion.table_name == table_name, DataVersion.personal_data_id == version_personal_data_id)
+        .scalar_subquery())
+    query = select(version, func.count(table.c.id), func.max(table.c.id))
+    if personal_data_id is not None:
+        query = query.where(table.c.personal_data_id == personal_data_id)
+    return tuple(connection.execute(query).one())
+
+async def get_data_versions(database_session: AsyncSession, scopes: list[DataScope]) -> list[int]:
+    """The current version of each scope, in order; 0 for a scope never written."""
+    keys = [_scope_key(scope) for scope in scopes]
+    result = await database_session.execute(
+        select(DataVersion.table_name, DataVersion.personal_data_id, DataVersion.version)
+        .where(or_(*(
+            and_(DataVersion.table_name == table_name, DataVersion.personal_data_id == personal_data_id)
+            for table_name, personal_data_id in set(keys)
+        ))))
+    versions = {(table_name, personal_data_id): version for table_name, personal_data_id, version in result.all()}
+    return [versions.get(key, 0) for key in keys]
+
+#--------------------------------------------------------------------------------------------
+# Bump on flush and from the upsert listeners, so the versions commit or roll back with
+# the rows of the unit of work, upsert or bulk insert that wrote them
+#--------------------------------------------------------------------------------------------
+def _on_before_flush(database_session: Session, flush_context: Any, instances: Any) -> None:
+    # Marked before the flush, so after_flush listeners reading these tables see the mark
+    changed = [*database_session.new, *database_session.deleted, *database_session.dirty]
+    if changed:
+        _mark_written(database_session.connection(), {entity.__tablename__ for entity in changed})
+
+def _on_after_flush(database_session: Session, flush_context: Any) -> None:
+    changed = [*database_session.new, *database_session.deleted]
+    changed.extend(entity for entity in database_session.dirty if database_session.is_modified(entity))
+    if changed:
+        record_data_change(database_session, entity_scopes(changed))
+
+def _before_upsert(entity_class: type[EntityBase], connection: Connection, ids: list[int]) -> set[DataScope]:
+    """The people the updated rows belong to before the upsert, which may move them."""
+    table = entity_class.__table__  # type: ignore
+    if not ids or entity_class is PersonalData or "personal_data_id" not in table.c:
+        return set()
+    personal_data_ids = connection.execute(
+        select(table.c.personal_data_id).where(table.c.id.in_(ids)).distinct()).scalars()
+    return {(entity_class.__tablename__, personal_data_id) for personal_data_id in personal_data_ids}
+
+def _after_upsert(
+        entity_class: type[EntityBase],
+        connection: Connection,
+        written_rows: list[dict[str, Any]],
+        previous_scopes: set[DataScope]) -> None:
+    if written_rows:
+        scopes = row_scopes(entity_class, written_rows, (row["id"] for row in written_rows))
+        bump_data_versions(connection, scopes | previous_scopes)
+
+_sql.event.listen(Session, "before_flush", _on_before_flush)
+_sql.event.listen(Session, "after_flush", _on_after_flush)
+for _mapper in EntityBase.registry.mappers:
+    if _mapper.class_ is not DataVersion:
+        register_upsert_listener(_mapper.class_, partial(_after_upsert, _mapper.class_), partial(_before_upsert, _mapper.class_))
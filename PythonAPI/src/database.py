@@ -1,23 +1,71 @@
+import sys
+from typing import Any, Optional
+
 import sqlalchemy as _sql
 import sqlalchemy.orm as _orm
+from sqlalchemy.engine import make_url
+
+import src.config as config
+from src.metrics import count_database_round_trips
+
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
+
+_engine: Optional[_sql.Engine] = None
+SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False)
+
+def engine_options(database_url: str) -> dict[str, Any]:
+    """Connection pool settings shared by the sync and async engines."""
+    url = make_url(database_url)
+    options: dict[str, Any] = {
+        "pool_pre_ping": True,
+        "pool_recycle": config.DATABASE_POOL_RECYCLE_SECONDS,
+    }
+    # In-memory SQLite uses a single static connection, there is no pool to size
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        options.update(
+            pool_size=config.DATABASE_POOL_SIZE,
+            max_overflow=config.DATABASE_MAX_OVERFLOW,
+            pool_timeout=config.DATABASE_POOL_TIMEOUT_SECONDS)
+    return options
 
-SQLALCHEMY_DATABASE_URL = (
-    "mssql+pyodbc://@2KJG544-W10\\SQLEXPRESS/MyFinanceDB?driver=ODBC+Driver+17+for+SQL+Server&Trusted_Connection=yes"
-)
-# Use & to separate parameters, and ensure driver name is correct and URL-encoded.
+def register_session_listeners() -> None:
+    """Imports the modules whose Session events keep derived tables in step with writes."""
+    from src import monthly_summaries
+    _ = monthly_summaries
 
-engine = _sql.create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
+def get_engine() -> _sql.Engine:
+    """Returns the shared engine, creating it on first use rather than at import time."""
+    global _engine
+    if _engine is None:
+        register_session_listeners()
+        _engine = _sql.create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+        count_database_round_trips(_engine, "sync")
+        SessionLocal.configure(bind=_engine)
+    return _engine
 
-SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def create_session() -> _orm.Session:
+    get_engine()
+    return SessionLocal()
 
-# Import Base from a single source to ensure all models share the same Base
-from src.models.base import Base
+def dispose_engine() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
 
-from src.models import entities  # Ensure all models are imported so tables are created
-_ = entities  # Explicitly reference to avoid unused import warning
+def create_schema() -> list[str]:
+    """Creates every missing table. Run explicitly at deployment, never on import."""
+    # Import Base from a single source to ensure all models share the same Base
+    from src.models.base import Base
+    from src.models import entities  # Ensure all models are imported so tables are created
+    _ = entities  # Explicitly reference to avoid unused import warning
 
-print(Base.metadata.tables.keys())
+    Base.metadata.create_all(get_engine())
+    return list(Base.metadata.tables.keys())
 
-Base.metadata.create_all(engine)
+if __name__ == "__main__":
+    if sys.argv[1:] == ["create-schema"]:
+        print(f"Schema ready: {', '.join(create_schema())}")
+    else:
+        print("Usage: python -m src.database create-schema")
+        sys.exit(2)
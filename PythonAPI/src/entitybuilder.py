@@ -1,74 +1,275 @@
 import src.database as _database
 import logging
 
-from src.models.entities import EntityBase, StatementTypeSettings, SettingsJson
+from src.async_database import run_blocking
+from src.data_versions import record_data_change, row_scopes
+
+from src.fingerprints import assign_occurrences, compute_finance_item_fingerprint
+from src.models.apimodels import FinanceItemModel
+from src.metrics import rows_persisted, timed_stage
+from src.monthly_summaries import apply_finance_item_rows
+from src.upserts import notify_inserted_rows, supports_upsert, upsert_models
+from src.models.entities import EntityBase, FinanceItem, StatementTypeSettings, SettingsJson
 from src.models.enumerations import StatementType
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Console
-        logging.FileHandler('app.log', encoding='utf-8')  # File
-    ]
-)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, select
+from typing import Iterable, Optional
+
 logger = logging.getLogger(__name__)
 
 # Dependency to get DB session
 def get_database_session():
-    logger.info("Creating new database session.")
-    database_session = _database.SessionLocal()
+    logger.debug("Creating new database session.")
+    database_session = _database.create_session()
     try:
         yield database_session
     finally:
-        logger.info("Closing database session.")
+        logger.debug("Closing database session.")
         database_session.close()
 
 # Utility function to add models to the database
 def add_models_to_database(entity: EntityBase, database_session: Session):
-    logger.info(f"Adding entity to database: {entity}")
+    logger.debug("Adding entity to database: %s", entity)
     try:
         database_session.add(entity)
         database_session.commit()
         database_session.refresh(entity)
         logger.info("Entity added and committed successfully.")
     except Exception as e:
-        logger.error(f"Error adding entity to database: {e}")
+        logger.error("Error adding entity to database: %s", e)
         database_session.rollback()
         raise
 
 async def add_or_update_model(entity: EntityBase, database_session: Session) -> EntityBase:
-    logger.info(f"Adding or updating entity in database: {entity}")
+    """Adds or updates the entity on the bounded database thread pool, keeping the event loop free."""
+    return await run_blocking(add_or_update_model_sync, entity, database_session)
+
+async def add_or_update_model_async(entity: EntityBase, database_session: AsyncSession) -> EntityBase:
+    """Adds or updates the entity through an async session."""
+    return await database_session.run_sync(lambda sync_session: add_or_update_model_sync(entity, sync_session))
+
+async def add_or_update_models_async(entities: list[EntityBase], database_session: AsyncSession) -> list[EntityBase]:
+    """Batch variant of add_or_update_model_async for entities of one class."""
+    return await database_session.run_sync(lambda sync_session: add_or_update_models_sync(entities, sync_session))
+
+def add_or_update_model_sync(entity: EntityBase, database_session: Session) -> EntityBase:
+    """
+    Inserts the entity, or updates the row with its id. On SQL Server, PostgreSQL and
+    SQLite this is one upsert statement returning the generated columns, see
+    src/upserts.py; other databases go through the ORM with a get, commit and refresh.
+    """
+    if supports_upsert(database_session):
+        logger.debug("Upserting entity: %s", entity)
+        upsert_models([entity], database_session)
+        logger.info("Entity upserted successfully.")
+        return entity
+    return _add_or_update_model_orm(entity, database_session)
+
+def add_or_update_models_sync(entities: list[EntityBase], database_session: Session) -> list[EntityBase]:
+    """Batch variant of add_or_update_model_sync: one statement per group of rows, one commit."""
+    if supports_upsert(database_session):
+        return upsert_models(entities, database_session)
+    return [_add_or_update_model_orm(entity, database_session) for entity in entities]
+
+def _add_or_update_model_orm(entity: EntityBase, database_session: Session) -> EntityBase:
+    logger.debug("Adding or updating entity in database: %s", entity)
     try:
         if hasattr(entity, "id") and isinstance(getattr(entity, "id", None), int) and getattr(entity, "id", 0) > 0:
-            db_entity = database_session.get(type(entity), entity.id)
+            with timed_stage("database_get"):
+                db_entity = database_session.get(type(entity), entity.id)
             if db_entity:
                 for attr, value in entity.__dict__.items():
                     if attr != '_sa_instance_state':
                         setattr(db_entity, attr, value)
-                database_session.commit()
-                database_session.refresh(db_entity)
+                with timed_stage("database_commit"):
+                    database_session.commit()
+                with timed_stage("database_refresh"):
+                    database_session.refresh(db_entity)
+                rows_persisted.inc(table=db_entity.__tablename__)
                 logger.info("Entity updated successfully.")
                 return db_entity
         database_session.add(entity)
-        database_session.commit()
-        database_session.refresh(entity)
+        with timed_stage("database_commit"):
+            database_session.commit()
+        with timed_stage("database_refresh"):
+            database_session.refresh(entity)
+        rows_persisted.inc(table=entity.__tablename__)
         logger.info("Entity added successfully.")
     
         return entity
     
     except Exception as e:
-        logger.error(f"Error adding or updating entity: {e}")
+        logger.error("Error adding or updating entity: %s", e)
+        database_session.rollback()
+        raise
+
+# SQL Server accepts at most 2100 parameters per statement
+FINGERPRINT_LOOKUP_CHUNK_SIZE = 1000
+
+def get_existing_finance_item_ids(
+    fingerprints: Iterable[str], database_session: Session
+) -> dict[tuple[str, int], int]:
+    """Looks up the ids of finance items by (fingerprint, occurrence) using the unique index."""
+    unique_fingerprints = list(dict.fromkeys(fingerprints))
+    existing: dict[tuple[str, int], int] = {}
+    for start in range(0, len(unique_fingerprints), FINGERPRINT_LOOKUP_CHUNK_SIZE):
+        rows = database_session.execute(
+            select(FinanceItem.id, FinanceItem.fingerprint, FinanceItem.occurrence)
+            .where(FinanceItem.fingerprint.in_(unique_fingerprints[start:start + FINGERPRINT_LOOKUP_CHUNK_SIZE]))
+        )
+        for finance_item_id, fingerprint, occurrence in rows:
+            existing[(fingerprint, occurrence)] = finance_item_id
+    return existing
+
+def assign_finance_item_fingerprint(finance_item: FinanceItem, database_session: Session) -> FinanceItem:
+    """Fingerprints a single finance item, numbering it after the rows already stored for that day."""
+    finance_item.fingerprint = compute_finance_item_fingerprint(
+        finance_item.personal_data_id,  # type: ignore
+        finance_item.record_date,  # type: ignore
+        finance_item.amount,  # type: ignore
+        finance_item.description)  # type: ignore
+    last_occurrence = database_session.execute(
+        select(func.max(FinanceItem.occurrence)).where(FinanceItem.fingerprint == finance_item.fingerprint)
+    ).scalar()
+    finance_item.occurrence = (last_occurrence or 0) + 1
+    return finance_item
+
+def bulk_insert_finance_items(
+    finance_item_models: list[FinanceItemModel], database_session: Session
+) -> list[int]:
+    """
+    Inserts all finance items with one multi-row INSERT in a single transaction and
+    returns their ids, in the order of the given models. Rows whose fingerprint and
+    occurrence already exist are skipped and the id of the stored row is returned, so
+    importing the same or an overlapping statement again does not create duplicates.
+    """
+    finance_item_ids, _ = insert_finance_items(finance_item_models, database_session)
+    return finance_item_ids
+
+def insert_finance_items(
+    finance_item_models: list[FinanceItemModel],
+    database_session: Session,
+    occurrence_counts: Optional[dict[str, int]] = None
+) -> tuple[list[int], int]:
+    """
+    bulk_insert_finance_items returning (ids, rows skipped as already imported). Pass the
+    same occurrence_counts for every chunk of one upload, so identical rows in different
+    chunks are numbered as one statement; it is only updated once the chunk is committed.
+    A new row is numbered after the highest occurrence stored for its fingerprint.
+    """
+    if not finance_item_models:
+        return [], 0
+    chunk_occurrence_counts = dict(occurrence_counts or {})
+    keys = assign_occurrences(
+        (
+            compute_finance_item_fingerprint(
+                finance_item_model.personal_data_id,
+                finance_item_model.record_date,
+                finance_item_model.amount,
+                finance_item_model.description)
+            for finance_item_model in finance_item_models
+        ),
+        chunk_occurrence_counts)
+    # SQLite hands out rowids in VALUES order but SQLAlchemy cannot rely on it and would
+    # fall back to one INSERT per row, every other dialect returns ids in parameter order.
+    ordered_returning = database_session.get_bind().dialect.name != "sqlite"
+    try:
+        existing_ids = get_existing_finance_item_ids((fingerprint for fingerprint, _ in keys), database_session)
+        last_occurrences: dict[str, int] = {}
+        for fingerprint, occurrence in existing_ids:
+            last_occurrences[fingerprint] = max(occurrence, last_occurrences.get(fingerprint, 0))
+        new_rows = []
+        new_row_positions = []
+        for position, (finance_item_model, (fingerprint, occurrence)) in enumerate(zip(finance_item_models, keys)):
+            if (fingerprint, occurrence) in existing_ids:
+                continue
+            occurrence = max(occurrence, last_occurrences.get(fingerprint, 0) + 1)
+            last_occurrences[fingerprint] = occurrence
+            new_rows.append({
+                "record_date": finance_item_model.record_date,
+                "description": finance_item_model.description,
+                "finance_item_category_id": finance_item_model.finance_item_category_id,
+                "amount": finance_item_model.amount,
+                "personal_data_id": finance_item_model.personal_data_id,
+                "fingerprint": fingerprint,
+                "occurrence": occurrence
+            })
+            new_row_positions.append(position)
+        skipped = len(keys) - len(new_rows)
+        logger.info("Bulk inserting %d finance items, skipping %d already imported.", len(new_rows), skipped)
+
+        finance_item_ids = [existing_ids.get(key, 0) for key in keys]
+        if new_rows:
+            result = database_session.execute(
+                insert(FinanceItem).returning(FinanceItem.id, sort_by_parameter_order=ordered_returning),
+                new_rows
+            )
+            inserted_ids = list(result.scalars()) if ordered_returning else sorted(result.scalars())
+            for position, finance_item_id in zip(new_row_positions, inserted_ids):
+                finance_item_ids[position] = finance_item_id
+            apply_finance_item_rows(database_session.connection(), new_rows)
+            record_data_change(database_session, row_scopes(FinanceItem, new_rows, inserted_ids))
+            with timed_stage("database_commit"):
+                database_session.commit()
+            rows_persisted.inc(len(new_rows), table=FinanceItem.__tablename__)
+            logger.info("Finance items inserted successfully.")
+
+        if occurrence_counts is not None:
+            occurrence_counts.update(chunk_occurrence_counts)
+        return finance_item_ids, skipped
+    except Exception as e:
+        logger.error("Error bulk inserting finance items: %s", e)
         database_session.rollback()
         raise
 
+def bulk_insert_entities(
+    entity_class: type[EntityBase], rows: list[dict], database_session: Session
+) -> list[int]:
+    """
+    Inserts the rows with one multi-row INSERT and commits, returning the new ids in row
+    order. Mapper events do not fire for these rows, the upsert listeners of entity_class do.
+    """
+    if not rows:
+        return []
+    ordered_returning = database_session.get_bind().dialect.name != "sqlite"  # See bulk_insert_finance_items
+    try:
+        result = database_session.execute(
+            insert(entity_class).returning(entity_class.id, sort_by_parameter_order=ordered_returning),
+            rows
+        )
+        inserted_ids = list(result.scalars()) if ordered_returning else sorted(result.scalars())
+        notify_inserted_rows(
+            database_session.connection(), entity_class,
+            [{**row, "id": inserted_id} for row, inserted_id in zip(rows, inserted_ids)])
+        with timed_stage("database_commit"):
+            database_session.commit()
+        rows_persisted.inc(len(rows), table=entity_class.__tablename__)
+        return inserted_ids
+    except Exception as e:
+        logger.error("Error bulk inserting %s rows: %s", entity_class.__tablename__, e)
+        database_session.rollback()
+        raise
+
+def backfill_finance_item_fingerprints(database_session: Session, chunk_size: int = 1000) -> int:
+    """Fingerprints finance items stored before fingerprints existed. Returns the number of rows updated."""
+    updated = 0
+    while True:
+        finance_items = database_session.execute(
+            select(FinanceItem).where(FinanceItem.fingerprint.is_(None)).order_by(FinanceItem.id).limit(chunk_size)
+        ).scalars().all()
+        if not finance_items:
+            return updated
+        for finance_item in finance_items:
+            assign_finance_item_fingerprint(finance_item, database_session)
+            database_session.flush()
+        database_session.commit()
+        updated += len(finance_items)
+
 def get_all_statement_type_settings(database_session: Session) -> list[StatementTypeSettings]:
     """Fetch all StatementTypeSettings records from the database."""
 
-    return database_session.query(StatementTypeSettings).all()
+    return database_session.query(StatementTypeSettings).order_by(StatementTypeSettings.id).all()
 
 def get_statement_type_settings_by_type(
     database_session: Session, statement_type: StatementType
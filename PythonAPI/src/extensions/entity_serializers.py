@@ -0,0 +1,81 @@
+import json
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+import sqlalchemy as _sql
+from fastapi.responses import Response
+
+from src.models.base import Base
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+def encode_json(value: Any) -> bytes:
+    """Compact UTF-8 JSON encoding used for every pre-encoded response body."""
+    return _json_encoder.encode(value).encode("utf-8")
+
+def _converter_for(column_type: _sql.types.TypeEngine) -> Optional[Callable[[Any], Any]]:
+    """Picks the conversion of a column value to a JSON type, None when none is needed."""
+    if isinstance(column_type, (_sql.DateTime, _sql.Date, _sql.Time)):
+        return lambda value: value.isoformat()
+    if isinstance(column_type, _sql.Enum):
+        return lambda value: value.value if hasattr(value, "value") else value
+    if isinstance(column_type, _sql.Numeric):  # Float(asdecimal=True) hands back Decimal
+        return float
+    return None
+
+class EntityEncoder:
+    """
+    JSON encoder of one entity class, built once from its SQLAlchemy column metadata.
+    Encoding reads the loaded column values straight from the instance, without any
+    per-object type inspection and without triggering lazy loads.
+    """
+
+    def __init__(self, entity_class: type):
+        self.entity_class = entity_class
+        self.fields: list[tuple[str, Optional[Callable[[Any], Any]]]] = [
+            (column_property.key, _converter_for(column_property.columns[0].type))
+            for column_property in _sql.inspect(entity_class).column_attrs
+        ]
+
+    def to_dict(self, entity: Any) -> dict[str, Any]:
+        values = entity.__dict__
+        row: dict[str, Any] = {}
+        for key, converter in self.fields:
+            value = values.get(key)
+            row[key] = converter(value) if converter is not None and value is not None else value
+        return row
+
+    def encode(self, entity: Any) -> bytes:
+        return encode_json(self.to_dict(entity))
+
+    def encode_many(self, entities: Iterable[Any]) -> bytes:
+        return encode_json([self.to_dict(entity) for entity in entities])
+
+_entity_encoders: dict[type, EntityEncoder] = {}
+_entity_encoders_lock = threading.Lock()
+
+def get_entity_encoder(entity_class: type) -> EntityEncoder:
+    entity_encoder = _entity_encoders.get(entity_class)
+    if entity_encoder is None:
+        with _entity_encoders_lock:
+            entity_encoder = _entity_encoders.setdefault(entity_class, EntityEncoder(entity_class))
+    return entity_encoder
+
+def serialize_entity(entity: Base) -> bytes:
+    return get_entity_encoder(type(entity)).encode(entity)
+
+def serialize_entities(entities: list[Any], entity_class: Optional[type] = None) -> bytes:
+    """Encodes a batch of rows of one entity class as a JSON array."""
+    if not entities:
+        return b"[]"
+    return get_entity_encoder(entity_class or type(entities[0])).encode_many(entities)
+
+class EntityJSONResponse(Response):
+    """JSON response whose body is already encoded, so FastAPI does not encode it again."""
+    media_type = "application/json"
+
+def entity_response(entity: Base, status_code: int = 200) -> EntityJSONResponse:
+    return EntityJSONResponse(content=serialize_entity(entity), status_code=status_code)
+
+def entities_response(entities: list[Any], entity_class: Optional[type] = None, status_code: int = 200) -> EntityJSONResponse:
+    return EntityJSONResponse(content=serialize_entities(entities, entity_class), status_code=status_code)
@@ -1,133 +1,316 @@
+import asyncio
 import io
-import logging
-import re
+import math
 
-from PyPDF2 import PdfReader
-from fastapi import UploadFile
-from typing import List
+from collections import deque
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+import src.config as config
+from src.metrics import pdf_pages_kept, pdf_pages_scanned
 from src.models.entities import SettingsJson
+from src.models.enumerations import StatementType
+from src.parser_plan import AMOUNT_NOISE_PATTERN, ParserPlan, get_parser_plan, parse_statement_date
+from src.transaction_columns import RawTransactionColumns, TransactionBatch, normalize_transaction_columns
 from src.models.apimodels import FinanceItemModel
 
 def standardize_date(
         date_str: str) -> datetime:
-    try:
-        date_str = re.sub(r'\s+', ' ', date_str.strip())
-        # Handle formats like 'DD Mon' (e.g., '12 May') or 'DD/MM/YYYY'
-        for fmt in ['%d %b', '%d/%m/%Y', '%d-%m-%Y']:
-            try:
-                parsed_date = datetime.strptime(date_str, fmt)
-                # If no year is provided, assume 2025 (based on context)
-                if fmt == '%d %b':
-                    parsed_date = parsed_date.replace(year=2025)
-                return parsed_date
-            except ValueError:
-                continue
-        return datetime.now()  # Default to now if no format matches
-    except Exception:
-        return datetime.now()
+    # Handle formats like 'DD Mon' (e.g., '12 May') or 'DD/MM/YYYY'
+    parsed_date = parse_statement_date(date_str)
+    return parsed_date if parsed_date is not None else datetime.now()  # Default to now if no format matches
 
 def standardize_amount(
         amount_str: str, 
         is_credit: bool=False) -> float:
     try:
         # Remove currency symbols, commas, and extra spaces
-        amount_str = re.sub(r'[^\d.-]', '', amount_str)
+        amount_str = AMOUNT_NOISE_PATTERN.sub('', amount_str)
         amount = round(float(amount_str), 2)
         # Negate amount if it's a credit (CR)
         return float(-amount if is_credit else amount)
     except:
         return 0
 
+def scan_transaction_lines(
+        lines: list[str],
+        plan: ParserPlan) -> Iterator[tuple[int, str, str, str, bool]]:
+    """
+    Walks the stripped statement lines and yields the raw fields of every transaction
+    as (line_index, date, description, amount, is_credit), without normalizing them.
+    """
+    match_date = plan.date_pattern.match
+    should_skip = plan.should_skip
+    description_offsets = plan.description_offsets
+    amount_offset = plan.amount_offset
+    credit_offset = plan.credit_offset
+    credit_line_exists = plan.credit_line_exists
+
+    line_count = len(lines)
+    line_index = 0
+    while line_index < line_count:
+        date_match = match_date(lines[line_index])
+        if not date_match:
+            line_index += 1
+            continue
+
+        description = "".join([
+            lines[line_index + offset] if line_index + offset < line_count else ''
+            for offset in description_offsets])
+        if should_skip(description):
+            line_index += 1
+            continue
+
+        amount_line = lines[line_index + amount_offset] if line_index + amount_offset < line_count else ''
+        if credit_line_exists:
+            credit_line = lines[line_index + credit_offset] if line_index + credit_offset < line_count else ''
+            credit = credit_line != 'CR'
+        else:
+            credit = True
+
+        yield line_index, date_match.group(0), description, amount_line, credit
+
+        if credit_line_exists and credit:
+            line_index += 3
+        else:
+            line_index += 2
+
+def scan_transaction_line_stream(
+        lines: Iterable[str],
+        plan: ParserPlan) -> Iterator[tuple[int, str, str, str, bool]]:
+    """
+    Incremental scan_transaction_lines: consumes stripped lines one at a time and only
+    holds the look-ahead window the description, amount and credit offsets reach into,
+    yielding exactly what scan_transaction_lines yields for the same lines.
+    """
+    match_date = plan.date_pattern.match
+    should_skip = plan.should_skip
+    description_offsets = plan.description_offsets
+    amount_offset = plan.amount_offset
+    credit_offset = plan.credit_offset
+    credit_line_exists = plan.credit_line_exists
+    window_size = max((*description_offsets, amount_offset, credit_offset if credit_line_exists else 0, 0)) + 1
+
+    line_iterator = iter(lines)
+    window: deque[str] = deque()
+    line_index = 0
+
+    def fill_window() -> None:
+        while len(window) < window_size:
+            line = next(line_iterator, None)
+            if line is None:
+                return
+            window.append(line)
+
+    def advance(step: int) -> None:
+        nonlocal line_index
+        line_index += step
+        for _ in range(step):
+            if window:
+                window.popleft()
+            elif next(line_iterator, None) is None:
+                return
+
+    def line_at(offset: int) -> str:
+        return window[offset] if offset < len(window) else ''
+
+    while True:
+        fill_window()
+        if not window:
+            return
+        date_match = match_date(window[0])
+        if not date_match:
+            advance(1)
+            continue
+
+        description = "".join([line_at(offset) for offset in description_offsets])
+        if should_skip(description):
+            advance(1)
+            continue
+
+        amount_line = line_at(amount_offset)
+        credit = line_at(credit_offset) != 'CR' if credit_line_exists else True
+
+        yield line_index, date_match.group(0), description, amount_line, credit
+
+        advance(3 if credit_line_exists and credit else 2)
+
+def iter_page_lines(pages: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the stripped lines of the pages as if they had been joined into one string
+    and split on newlines, without building that string.
+    """
+    carry = ""
+    for page in pages:
+        page_lines = page.split('\n')
+        page_lines[0] = carry + page_lines[0]
+        carry = page_lines.pop()
+        for line in page_lines:
+            yield line.strip()
+    yield carry.strip()
+
+def _build_finance_item_models(
+        scanned_transactions: Iterable[tuple[int, str, str, str, bool]],
+        plan: ParserPlan) -> List[FinanceItemModel]:
+    parse_date = plan.parse_date
+    return [
+        # Create the transaction object from the standardized date and amount
+        FinanceItemModel(
+            record_date=parse_date(date_str) or datetime.now(),
+            description=description,
+            amount=standardize_amount(amount_line, credit),
+            finance_item_category_id=1,
+            personal_data_id=1
+        )
+        for _, date_str, description, amount_line, credit in scanned_transactions
+    ]
+
 # Function to extract transactions from text
 def extract_transactions(
         text: str,
-        settings_json: SettingsJson):
-    transactions: List[FinanceItemModel] = []
+        settings_json: SettingsJson,
+        statement_type: Optional[StatementType] = None):
+    plan = get_parser_plan(settings_json, statement_type)
+    lines = [line.strip() for line in text.split('\n')]
+    return _build_finance_item_models(scan_transaction_lines(lines, plan), plan)
 
-    amount_index = settings_json.amount_index
-    credit_index = settings_json.credit_index
-    credit_line_exists = settings_json.credit_line_exists
+def extract_transactions_batch(
+        text: str,
+        settings_json: SettingsJson,
+        statement_type: Optional[StatementType] = None) -> TransactionBatch:
+    """
+    Batch variant of extract_transactions, used by statement imports. The raw fields are
+    collected into columns and normalized in a single pass; rows whose date or amount
+    cannot be parsed are reported in the batch failures instead of defaulting to now() or 0.
+    """
+    plan = get_parser_plan(settings_json, statement_type)
+    lines = [line.strip() for line in text.split('\n')]
+    return _build_transaction_batch(scan_transaction_lines(lines, plan))
 
-    lines = text.split('\n')
-    line_index = 0
-    while line_index < len(lines):
-        line = lines[line_index].strip()
-        date_match = re.match(r'(\d{1,2}\s+\w{3}|\d{1,2}/\d{1,2}/\d{4})', line)
-        credit = False  # Default to debit
-        if date_match:
-            
-            # Extract and standardize the date
-            date_str = date_match.group(0)
-            date = standardize_date(date_str)
-
-            # Extract and standardize the description
-            description_index = 1
-            description = ""
-            description_indices = settings_json.description_indices.copy()
-            if len(description_indices) == 1:
-                description_index = description_indices[0]
-                description = lines[line_index + description_index].strip() if line_index + description_index < len(lines) else ''
-            else:
-                while description_indices:
-                    description_index = description_indices.pop(0)
-                    # Safely get next lines for description and amount
-                    description += lines[line_index + description_index].strip() if line_index + description_index < len(lines) else ''
-            if not description or any(keyword in description for keyword in settings_json.transaction_lines_to_skip):
-                line_index += 1
-                continue
-
-            # Extract and standardize the amount
-            amount_line = lines[line_index + amount_index].strip() if line_index + amount_index < len(lines) else ''
-            if credit_line_exists:
-                credit = False if lines[line_index + credit_index].strip() == 'CR' else True
-            else:
-                credit = True
-            amount = standardize_amount(amount_line, credit)
-
-            # Create the transaction object
-            transaction = FinanceItemModel(
-                record_date=date,
-                description=description,
-                amount=amount,
-                finance_item_category_id=1,
-                personal_data_id=1
-            )
-            transactions.append(transaction)
-
-            if credit_line_exists and credit:
-                line_index += 3
-            else:
-                line_index += 2
-        else:
-            line_index += 1
-        continue
-    return transactions
+def extract_transactions_batch_from_pages(
+        pages: Iterable[str],
+        settings_json: SettingsJson,
+        statement_type: Optional[StatementType] = None) -> TransactionBatch:
+    """extract_transactions_batch over page texts consumed one by one, e.g. from iter_transaction_pages."""
+    plan = get_parser_plan(settings_json, statement_type)
+    return _build_transaction_batch(scan_transaction_line_stream(iter_page_lines(pages), plan))
 
-async def extract_transaction_pages_as_text_from_pdf(
-    file: UploadFile, 
+def _build_transaction_batch(scanned_transactions: Iterable[tuple[int, str, str, str, bool]]) -> TransactionBatch:
+    raw_columns = RawTransactionColumns()
+    for line_index, date_str, description, amount_line, credit in scanned_transactions:
+        raw_columns.append(line_index, date_str, description, amount_line, credit)
+    return TransactionBatch(normalize_transaction_columns(raw_columns))
+
+def _split_page_range(
+    page_count: int,
+    max_workers: int
+) -> list[tuple[int, int]]:
+    """
+    Splits [0, page_count) into contiguous ranges, one per worker. Small documents
+    get a single range so they are extracted serially.
+    """
+    if page_count < config.PDF_EXTRACTION_PARALLEL_MIN_PAGES or max_workers <= 1:
+        return [(0, page_count)]
+    chunk_count = min(max_workers, math.ceil(page_count / config.PDF_EXTRACTION_MIN_PAGES_PER_WORKER))
+    chunk_size = math.ceil(page_count / chunk_count)
+    return [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+def _count_pdf_pages(content: bytes) -> int:
+    from PyPDF2 import PdfReader  # Loaded on first use to keep application start-up light
+    return len(PdfReader(io.BytesIO(content)).pages)
+
+def _extract_transaction_pages_in_range(
+    content: bytes,
+    start: int,
+    stop: int,
     transaction_page_keywords: list[str]
-) -> str:
+) -> list[str]:
     """
-    Extracts text from a PDF file (bytes) that contains 'Debit date', 'Description',
-    and 'Amount £'. Returns the concatenated text from relevant pages.
+    Extracts the text of pages [start, stop) and keeps only the pages containing every
+    transaction page keyword. Runs inside the extraction worker processes.
     """
-    logger = logging.getLogger(__name__)
-    try:
-        content: bytes = await file.read()
-        reader = PdfReader(io.BytesIO(content))
-        text = ""
-        # transaction_page_keywords = [
-        #     "Debit date",
-        #     "Description",
-        #     "Amount £"
-        # ]
-        for page in reader.pages:
-            page_content = page.extract_text()
-            if page_content and all(keyword in page_content for keyword in transaction_page_keywords):
-                text += page_content
-        return text
-    except Exception as e:
-        logger.error(f"Failed to extract text from PDF: {e}")
-        raise
+    from PyPDF2 import PdfReader  # Loaded on first use to keep application start-up light
+    reader = PdfReader(io.BytesIO(content))
+    pages: list[str] = []
+    for page_number in range(start, stop):
+        page_content = reader.pages[page_number].extract_text()
+        if page_content and all(keyword in page_content for keyword in transaction_page_keywords):
+            pages.append(page_content)
+    return pages
+
+def iter_transaction_pages(
+    source: BinaryIO,
+    transaction_page_keywords: list[str]
+) -> Iterator[str]:
+    """
+    Yields the text of the transaction pages of a PDF one page at a time. The PDF is
+    read from the seekable file on demand (e.g. an upload spooled to disk), so neither
+    the document nor its text has to fit in memory at once.
+    """
+    from PyPDF2 import PdfReader  # Loaded on first use to keep application start-up light
+    reader = PdfReader(source)
+    for page in reader.pages:
+        page_content = page.extract_text()
+        pdf_pages_scanned.inc()
+        if page_content and all(keyword in page_content for keyword in transaction_page_keywords):
+            pdf_pages_kept.inc()
+            yield page_content
+
+def extract_transactions_streaming(
+    source: BinaryIO,
+    settings_json: SettingsJson,
+    statement_type: Optional[StatementType] = None
+) -> TransactionBatch:
+    """
+    Extracts the transactions of a PDF file page by page, in the calling thread. Peak
+    memory is one page of text plus the parsed transactions, whatever the document size.
+    """
+    source.seek(0)
+    pages = iter_transaction_pages(source, settings_json.transaction_page_keywords)
+    return extract_transactions_batch_from_pages(pages, settings_json, statement_type)
+
+_pdf_extraction_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pdf_extraction_pool() -> ProcessPoolExecutor:
+    """Returns the process pool shared by all PDF extractions, creating it on first use."""
+    global _pdf_extraction_pool
+    if _pdf_extraction_pool is None:
+        _pdf_extraction_pool = ProcessPoolExecutor(max_workers=config.PDF_EXTRACTION_MAX_WORKERS)
+    return _pdf_extraction_pool
+
+def shutdown_pdf_extraction_pool() -> None:
+    global _pdf_extraction_pool
+    if _pdf_extraction_pool is not None:
+        _pdf_extraction_pool.shutdown(wait=True)
+        _pdf_extraction_pool = None
+
+async def extract_transaction_pages_from_pdf_bytes(
+    content: bytes,
+    transaction_page_keywords: list[str],
+    max_workers: Optional[int] = None
+) -> list[str]:
+    """
+    Extracts the transaction pages of a PDF, in page order. Large documents are split
+    across the extraction process pool; small ones are extracted serially on a thread
+    so the event loop is never blocked.
+    """
+    loop = asyncio.get_running_loop()
+    max_workers = config.PDF_EXTRACTION_MAX_WORKERS if max_workers is None else max_workers
+    page_count = await loop.run_in_executor(None, _count_pdf_pages, content)
+    page_ranges = _split_page_range(page_count, max_workers)
+
+    if len(page_ranges) == 1:
+        pages = await loop.run_in_executor(
+            None, _extract_transaction_pages_in_range, content, 0, page_count, transaction_page_keywords)
+    else:
+        pool = get_pdf_extraction_pool()
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(pool, _extract_transaction_pages_in_range, content, start, stop, transaction_page_keywords)
+            for start, stop in page_ranges
+        ))
+        pages = [page for chunk in chunks for page in chunk]
+
+    pdf_pages_scanned.inc(page_count)
+    pdf_pages_kept.inc(len(pages))
+    return pages
@@ -0,0 +1,132 @@
+import base64
+from datetime import date, datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import Select, and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.extensions.entity_serializers import encode_json, get_entity_encoder
+from src.models.entities import FinanceItem, FinanceItemMonthlySummary
+from src.monthly_summaries import to_month
+
+class FinanceItemFilter:
+    """Filters of the finance item list and stream endpoints; bounds are inclusive."""
+
+    def __init__(
+            self,
+            personal_data_id: int,
+            date_from: Optional[datetime] = None,
+            date_to: Optional[datetime] = None,
+            finance_item_category_id: Optional[int] = None,
+            amount_min: Optional[float] = None,
+            amount_max: Optional[float] = None):
+        self.personal_data_id = personal_data_id
+        self.date_from = date_from
+        self.date_to = date_to
+        self.finance_item_category_id = finance_item_category_id
+        self.amount_min = amount_min
+        self.amount_max = amount_max
+
+def encode_cursor(record_date: datetime, finance_item_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{record_date.isoformat()}|{finance_item_id}".encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decodes a cursor returned by encode_cursor, raising ValueError when it is malformed."""
+    try:
+        record_date, finance_item_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(record_date), int(finance_item_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+
+def build_finance_item_query(
+        finance_item_filter: FinanceItemFilter,
+        after: Optional[tuple[datetime, int]] = None,
+        descending: bool = False) -> Select:
+    """
+    Selects the filtered finance items ordered by (record_date, id). Paging continues
+    after the given key instead of using OFFSET, so every page is a single range scan of
+    the (personal_data_id[, finance_item_category_id], record_date, id) indexes.
+    """
+    query = select(FinanceItem).where(FinanceItem.personal_data_id == finance_item_filter.personal_data_id)
+    if finance_item_filter.finance_item_category_id is not None:
+        query = query.where(FinanceItem.finance_item_category_id == finance_item_filter.finance_item_category_id)
+    if finance_item_filter.date_from is not None:
+        query = query.where(FinanceItem.record_date >= finance_item_filter.date_from)
+    if finance_item_filter.date_to is not None:
+        query = query.where(FinanceItem.record_date <= finance_item_filter.date_to)
+    if finance_item_filter.amount_min is not None:
+        query = query.where(FinanceItem.amount >= finance_item_filter.amount_min)
+    if finance_item_filter.amount_max is not None:
+        query = query.where(FinanceItem.amount <= finance_item_filter.amount_max)
+
+    if after is not None:
+        # Expanded row value comparison, SQL Server has no (a, b) > (x, y)
+        after_record_date, after_id = after
+        if descending:
+            query = query.where(or_(
+                FinanceItem.record_date < after_record_date,
+                and_(FinanceItem.record_date == after_record_date, FinanceItem.id < after_id)))
+        else:
+            query = query.where(or_(
+                FinanceItem.record_date > after_record_date,
+                and_(FinanceItem.record_date == after_record_date, FinanceItem.id > after_id)))
+
+    if descending:
+        return query.order_by(FinanceItem.record_date.desc(), FinanceItem.id.desc())
+    return query.order_by(FinanceItem.record_date, FinanceItem.id)
+
+async def get_finance_item_page(
+        database_session: AsyncSession,
+        finance_item_filter: FinanceItemFilter,
+        limit: int,
+        cursor: Optional[str] = None,
+        descending: bool = False) -> bytes:
+    """Returns one page as an encoded {"items": [...], "next_cursor": ...} JSON body."""
+    after = decode_cursor(cursor) if cursor else None
+    query = build_finance_item_query(finance_item_filter, after, descending).limit(limit + 1)
+    finance_items = list((await database_session.execute(query)).scalars())
+
+    next_cursor = None
+    if len(finance_items) > limit:
+        finance_items = finance_items[:limit]
+        next_cursor = encode_cursor(finance_items[-1].record_date, finance_items[-1].id)  # type: ignore
+
+    encoder = get_entity_encoder(FinanceItem)
+    return encode_json({
+        "items": [encoder.to_dict(finance_item) for finance_item in finance_items],
+        "next_cursor": next_cursor
+    })
+
+async def stream_finance_items_ndjson(
+        database_session: AsyncSession,
+        finance_item_filter: FinanceItemFilter,
+        batch_size: int,
+        descending: bool = False) -> AsyncIterator[bytes]:
+    """
+    Yields the filtered finance items as NDJSON, one chunk per batch read from a
+    server-side cursor, so memory stays flat however many rows are streamed.
+    """
+    encoder = get_entity_encoder(FinanceItem)
+    query = build_finance_item_query(finance_item_filter, descending=descending).execution_options(yield_per=batch_size)
+    result = await database_session.stream(query)
+    async for partition in result.scalars().partitions():
+        # The identity map only holds weak references, rows of earlier batches are freed
+        yield b"".join(encoder.encode(finance_item) + b"\n" for finance_item in partition)
+
+async def get_monthly_summaries(
+        database_session: AsyncSession,
+        personal_data_id: int,
+        month_from: Optional[date] = None,
+        month_to: Optional[date] = None,
+        finance_item_category_id: Optional[int] = None) -> list[FinanceItemMonthlySummary]:
+    """Reads the maintained monthly summaries, never the finance items themselves."""
+    summary = FinanceItemMonthlySummary
+    query = select(summary).where(summary.personal_data_id == personal_data_id, summary.rollup_count != 0)
+    if month_from is not None:
+        query = query.where(summary.month >= to_month(month_from))
+    if month_to is not None:
+        query = query.where(summary.month <= to_month(month_to))
+    if finance_item_category_id is not None:
+        query = query.where(summary.finance_item_category_id == finance_item_category_id)
+    query = query.order_by(summary.month, summary.finance_item_category_id)
+    return list((await database_session.execute(query)).scalars())
@@ -0,0 +1,42 @@
+import hashlib
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+CENT = Decimal('0.01')
+
+def normalize_description(description: str) -> str:
+    """Case and whitespace insensitive form of a transaction description."""
+    return WHITESPACE_PATTERN.sub(' ', description).strip().casefold()
+
+def compute_finance_item_fingerprint(
+        personal_data_id: int,
+        record_date: date | datetime,
+        amount: float | Decimal,
+        description: str) -> str:
+    """
+    Hash identifying a transaction by owner, day, amount and normalized description.
+    Legitimate same-day duplicates share a fingerprint and differ by occurrence.
+    """
+    record_day = record_date.date() if isinstance(record_date, datetime) else record_date
+    normalized_amount = Decimal(str(amount)).quantize(CENT)
+    key = f"{personal_data_id}|{record_day.isoformat()}|{normalized_amount}|{normalize_description(description)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def assign_occurrences(
+        fingerprints: Iterable[str],
+        occurrence_counts: Optional[dict[str, int]] = None) -> list[tuple[str, int]]:
+    """
+    Numbers repeated fingerprints in order of appearance, so the n-th identical
+    transaction of a statement always gets occurrence n. occurrence_counts carries the
+    numbering over from earlier calls, e.g. earlier chunks of one upload, and is updated.
+    """
+    seen = occurrence_counts if occurrence_counts is not None else {}
+    keys: list[tuple[str, int]] = []
+    for fingerprint in fingerprints:
+        occurrence = seen.get(fingerprint, 0) + 1
+        seen[fingerprint] = occurrence
+        keys.append((fingerprint, occurrence))
+    return keys
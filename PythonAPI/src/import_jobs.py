@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Optional
+
+import src.config as config
+import src.database as _database
+from src.async_database import run_blocking
+from src.logging_config import configure_logging, shutdown_logging
+from src.models.enumerations import StatementType
+from src.statement_import import build_import_result, import_statement, resolve_statement_type
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+_JOB_COLUMNS = (
+    "id, status, filename, statement_type, personal_data_id, persist, stage, progress, "
+    "transaction_count, result, error, attempts, created_at, updated_at")
+
+class ImportJob:
+    """One statement import as stored in the job queue. content is only loaded when claimed."""
+
+    def __init__(self, row: sqlite3.Row):
+        self.id: str = row["id"]
+        self.status: str = row["status"]
+        self.filename: str = row["filename"]
+        # Stored as "" for uploads whose type is detected when the job runs
+        self.statement_type = StatementType(row["statement_type"]) if row["statement_type"] else None
+        self.personal_data_id: int = row["personal_data_id"]
+        self.persist = bool(row["persist"])
+        self.stage: Optional[str] = row["stage"]
+        self.progress: float = row["progress"]
+        self.transaction_count: int = row["transaction_count"]
+        self.result: Optional[str] = row["result"]
+        self.error: Optional[str] = row["error"]
+        self.attempts: int = row["attempts"]
+        self.created_at: float = row["created_at"]
+        self.updated_at: float = row["updated_at"]
+        self.content: Optional[bytes] = row["content"] if "content" in row.keys() else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self, include_result: bool = True) -> dict[str, Any]:
+        job = {
+            "id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "statement_type": self.statement_type.value if self.statement_type else None,
+            "personal_data_id": self.personal_data_id,
+            "persist": self.persist,
+            "stage": self.stage,
+            "progress": self.progress,
+            "transaction_count": self.transaction_count,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": datetime.fromtimestamp(self.created_at, timezone.utc).isoformat(),
+            "updated_at": datetime.fromtimestamp(self.updated_at, timezone.utc).isoformat()
+        }
+        if include_result:
+            job["result"] = json.loads(self.result) if self.result else None
+        return job
+
+class ImportJobStore:
+    """
+    Durable queue of statement imports in a local SQLite file. Uploads are stored with
+    their job, and a job is claimed with a single UPDATE ... RETURNING, so several worker
+    threads or processes can share one file. A claimed job holds a lease its worker keeps
+    renewing; once the lease lapses (the worker died or the process restarted) the job
+    is claimed again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS import_jobs ("
+                        " id TEXT PRIMARY KEY,"
+                        " status TEXT NOT NULL,"
+                        " filename TEXT NOT NULL,"
+                        " statement_type TEXT NOT NULL,"
+                        " personal_data_id INTEGER NOT NULL,"
+                        " persist INTEGER NOT NULL,"
+                        " content BLOB,"
+                        " stage TEXT,"
+                        " progress REAL NOT NULL DEFAULT 0,"
+                        " transaction_count INTEGER NOT NULL DEFAULT 0,"
+                        " result TEXT,"
+                        " error TEXT,"
+                        " attempts INTEGER NOT NULL DEFAULT 0,"
+                        " lease_expires_at REAL,"
+                        " created_at REAL NOT NULL,"
+                        " updated_at REAL NOT NULL)")
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS ix_import_jobs_status_created_at ON import_jobs (status, created_at)")
+                    self._initialized = True
+        return connection
+
+    def enqueue(
+            self,
+            filename: str,
+            content: bytes,
+            statement_type: Optional[StatementType],
+            personal_data_id: int,
+            persist: bool) -> ImportJob:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO import_jobs (id, status, filename, statement_type, personal_data_id, persist, content, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, statement_type.value if statement_type else "", personal_data_id, int(persist), content, now, now))
+        logger.info("Queued import job %s for %s.", job_id, filename)
+        return self.get(job_id)  # type: ignore
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(f"SELECT {_JOB_COLUMNS} FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        return ImportJob(row) if row is not None else None
+
+    def claim_next(self, lease_seconds: int) -> Optional[ImportJob]:
+        """Marks the oldest queued job, or a running job with an expired lease, as running and returns it."""
+        now = time.time()
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "UPDATE import_jobs SET status = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ?"
+                " WHERE id = ("
+                "  SELECT id FROM import_jobs"
+                "  WHERE status = ? OR (status = ? AND lease_expires_at < ?)"
+                "  ORDER BY created_at LIMIT 1)"
+                f" RETURNING {_JOB_COLUMNS}, content",
+                (RUNNING, now + lease_seconds, now, QUEUED, RUNNING, now)).fetchone()
+        return ImportJob(row) if row is not None else None
+
+    def renew_lease(self, job_id: str, lease_seconds: int) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE import_jobs SET lease_expires_at = ? WHERE id = ? AND status = ?",
+                (time.time() + lease_seconds, job_id, RUNNING))
+
+    def set_progress(self, job_id: str, stage: str, progress: float) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE import_jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+                (stage, progress, time.time(), job_id))
+
+    def complete(self, job_id: str, result: str, transaction_count: int) -> None:
+        """Stores the result and drops the upload, which is no longer needed."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE import_jobs SET status = ?, stage = ?, progress = 1, transaction_count = ?, result = ?,"
+                " content = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (SUCCEEDED, "done", transaction_count, result, time.time(), job_id))
+
+    def fail(self, job_id: str, error: str) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE import_jobs SET status = ?, error = ?, content = NULL, lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ?",
+                (FAILED, error, time.time(), job_id))
+
+import_job_store = ImportJobStore(config.IMPORT_JOB_DATABASE_PATH)
+
+#--------------------------------------------------------------------------------------------
+# Running jobs
+#--------------------------------------------------------------------------------------------
+async def _renew_lease(store: ImportJobStore, job_id: str, lease_seconds: int) -> None:
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        await run_blocking(store.renew_lease, job_id, lease_seconds)
+
+async def run_import_job(store: ImportJobStore, job: ImportJob) -> None:
+    """Imports the statement of a claimed job, recording progress and the outcome in the store."""
+    if job.attempts > config.IMPORT_JOB_MAX_ATTEMPTS or job.content is None:
+        await run_blocking(store.fail, job.id, f"Gave up after {job.attempts - 1} interrupted attempts")
+        return
+
+    logger.info("Running import job %s for %s (attempt %s).", job.id, job.filename, job.attempts)
+    lease_renewal = asyncio.create_task(_renew_lease(store, job.id, config.IMPORT_JOB_LEASE_SECONDS))
+    database_session = _database.create_session()
+
+    async def on_progress(stage: str, progress: float) -> None:
+        await run_blocking(store.set_progress, job.id, stage, progress)
+
+    statement_type = job.statement_type
+    try:
+        statement_type = await resolve_statement_type(job.content, statement_type, database_session, job.filename)
+        transactions = await import_statement(
+            job.content,
+            statement_type,
+            job.personal_data_id,
+            job.persist,
+            database_session,
+            job.filename,
+            on_progress)
+        result = build_import_result(job.filename, statement_type, transactions)
+        await run_blocking(store.complete, job.id, result.model_dump_json(), len(transactions))
+        logger.info("Import job %s finished with %s transactions.", job.id, len(transactions))
+    except Exception as e:
+        logger.error("Import job %s failed: %s", job.id, e)
+        await run_blocking(database_session.rollback)
+        await run_blocking(store.fail, job.id, str(e))
+    finally:
+        lease_renewal.cancel()
+        await run_blocking(database_session.close)
+
+class ImportJobWorkerPool:
+    """
+    Asyncio workers taking jobs off the store. Enqueueing in the same process wakes them
+    at once; jobs queued by other processes are found by polling.
+    """
+
+    def __init__(self, store: ImportJobStore):
+        self.store = store
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, worker_count: int) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run_worker()) for _ in range(worker_count)]
+        logger.info("Started %s import job workers.", worker_count)
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run_worker(self) -> None:
+        wakeup = self._wakeup
+        assert wakeup is not None
+        while True:
+            wakeup.clear()
+            try:
+                job = await run_blocking(self.store.claim_next, config.IMPORT_JOB_LEASE_SECONDS)
+            except Exception as e:
+                logger.error("Failed to claim an import job: %s", e)
+                job = None
+            if job is not None:
+                await run_import_job(self.store, job)
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), config.IMPORT_JOB_POLL_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+import_job_workers = ImportJobWorkerPool(import_job_store)
+
+#--------------------------------------------------------------------------------------------
+# Progress events
+#--------------------------------------------------------------------------------------------
+async def stream_import_job_events(store: ImportJobStore, job_id: str) -> AsyncIterator[bytes]:
+    """
+    Yields Server-Sent Events for a job: a "progress" event whenever its stage or status
+    changes and a final "done" event carrying the finished job. A comment line is sent
+    every 15 seconds without changes to keep proxies from closing the connection.
+    """
+    last_state: Optional[tuple[str, Optional[str], float]] = None
+    last_sent = time.monotonic()
+    while True:
+        job = await run_blocking(store.get, job_id)
+        if job is None:
+            yield b"event: error\ndata: {\"detail\": \"Import job not found\"}\n\n"
+            return
+        if job.finished:
+            yield b"event: done\ndata: " + json.dumps(job.to_dict()).encode("utf-8") + b"\n\n"
+            return
+        state = (job.status, job.stage, job.progress)
+        if state != last_state:
+            last_state = state
+            last_sent = time.monotonic()
+            yield b"event: progress\ndata: " + json.dumps(job.to_dict(include_result=False)).encode("utf-8") + b"\n\n"
+        elif time.monotonic() - last_sent >= 15:
+            last_sent = time.monotonic()
+            yield b": keep-alive\n\n"
+        await asyncio.sleep(config.IMPORT_JOB_EVENT_INTERVAL_MS / 1000)
+
+#--------------------------------------------------------------------------------------------
+# Stand-alone worker process: python -m src.import_jobs worker [count]
+#--------------------------------------------------------------------------------------------
+async def run_worker_process(worker_count: int) -> None:
+    import_job_workers.start(worker_count)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await import_job_workers.stop()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        configure_logging()
+        worker_count = int(sys.argv[2]) if len(sys.argv) > 2 else max(1, config.IMPORT_JOB_WORKERS)
+        try:
+            asyncio.run(run_worker_process(worker_count))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shutdown_logging()
+    else:
+        print("Usage: python -m src.import_jobs worker [count]")
+        sys.exit(2)
@@ -0,0 +1,125 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import src.config as config
+
+#--------------------------------------------------------------------------------------------
+# Application logging, configured once per process. Loggers only put records on an
+# in-memory queue; a background listener thread formats them and does the console and
+# file I/O, so request handlers never wait on a log write.
+#--------------------------------------------------------------------------------------------
+
+# Attributes every LogRecord has; anything else was passed with extra= and is emitted as a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extra fields and the exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the DEBUG and INFO records of the configured loggers; warnings and errors always pass."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, logger_name: str) -> float:
+        name = logger_name
+        while True:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return rate
+            if "." not in name:
+                return 1.0
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them. Only the message is merged with its
+    arguments here, while the objects it refers to are still in the state being logged;
+    the formatter runs on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+def _build_formatter() -> logging.Formatter:
+    if config.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+def configure_logging() -> None:
+    """Routes all logging through the background queue. Safe to call more than once."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        formatter = _build_formatter()
+        handlers: list[logging.Handler] = [logging.StreamHandler()]
+        if config.LOG_FILE:
+            handlers.append(logging.FileHandler(config.LOG_FILE, encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        if config.LOG_SAMPLING:
+            queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLING))
+
+        root_logger = logging.getLogger()
+        for handler in list(root_logger.handlers):
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(queue_handler)
+        root_logger.setLevel(config.LOG_LEVEL)
+        for logger_name, level in config.LOG_LEVELS.items():
+            logging.getLogger(logger_name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+def shutdown_logging() -> None:
+    """Writes out the queued records and stops the listener thread."""
+    global _listener
+    with _configure_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
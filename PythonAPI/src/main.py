@@ -0,0 +1,50 @@
+#--------------------------------------------------------------------------------------------
+# Third library party imports
+#--------------------------------------------------------------------------------------------
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import FastAPI
+#--------------------------------------------------------------------------------------------
+
+#--------------------------------------------------------------------------------------------
+# Custom library imports
+#--------------------------------------------------------------------------------------------
+import src.config as config
+import src.database as _database
+from src.async_database import dispose_async_engine
+from src.controllers.finance import router as finance_router, global_exception_handler
+from src.file_utils import shutdown_pdf_extraction_pool
+from src.import_jobs import import_job_workers
+from src.logging_config import configure_logging, shutdown_logging
+from src.metrics import metrics_middleware
+#--------------------------------------------------------------------------------------------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    configure_logging()
+    if config.CREATE_SCHEMA_ON_STARTUP:
+        await asyncio.to_thread(_database.create_schema)
+    if config.IMPORT_JOB_WORKERS:
+        import_job_workers.start(config.IMPORT_JOB_WORKERS)
+    yield
+    await import_job_workers.stop()
+    shutdown_pdf_extraction_pool()
+    await dispose_async_engine()
+    _database.dispose_engine()
+    shutdown_logging()
+
+def create_app() -> FastAPI:
+    """
+    Application factory. Building the app does no I/O: database engines are created on
+    the first request and the schema is only created when configured to.
+    Run with `uvicorn src.main:app` or `uvicorn --factory src.main:create_app`.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(metrics_middleware)
+    app.include_router(finance_router)
+    app.add_exception_handler(Exception, global_exception_handler)
+    return app
+
+app = create_app()
@@ -0,0 +1,211 @@
+import bisect
+import cProfile
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+import sqlalchemy as _sql
+from fastapi.requests import Request
+from fastapi.responses import Response
+
+import src.config as config
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#--------------------------------------------------------------------------------------------
+# Minimal Prometheus metric types, rendered in the text exposition format
+#--------------------------------------------------------------------------------------------
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values)
+        return lines
+
+class Histogram:
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # key -> per bucket counts (the last one is +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bucket_index] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in values:
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+http_requests = metrics_registry.counter(
+    "myfinance_http_requests_total", "HTTP requests handled.", ("method", "route", "status"))
+http_request_duration = metrics_registry.histogram(
+    "myfinance_http_request_duration_seconds", "Time until the response started.", ("method", "route"))
+stage_duration = metrics_registry.histogram(
+    "myfinance_stage_duration_seconds", "Duration of the import and persistence stages.", ("stage",))
+pdf_pages_scanned = metrics_registry.counter(
+    "myfinance_pdf_pages_scanned_total", "PDF pages whose text was extracted.")
+pdf_pages_kept = metrics_registry.counter(
+    "myfinance_pdf_pages_kept_total", "Extracted pages holding every transaction page keyword.")
+transactions_parsed = metrics_registry.counter(
+    "myfinance_transactions_parsed_total", "Transactions parsed from statement text.")
+transactions_unparsed = metrics_registry.counter(
+    "myfinance_transactions_unparsed_total", "Statement transactions skipped because their date or amount did not parse.")
+rows_persisted = metrics_registry.counter(
+    "myfinance_rows_persisted_total", "Rows inserted or updated.", ("table",))
+database_round_trips = metrics_registry.counter(
+    "myfinance_database_round_trips_total", "Statements sent to the database.", ("engine",))
+http_cache_responses = metrics_registry.counter(
+    "myfinance_http_cache_responses_total", "Cacheable read responses by how they were served.", ("result",))
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Records the wall time of the block, awaits included, in the stage histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+def count_database_round_trips(engine: _sql.Engine, engine_label: str) -> None:
+    """Counts every statement the engine executes, executemany batches count once."""
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        database_round_trips.inc(engine=engine_label)
+    _sql.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+#--------------------------------------------------------------------------------------------
+# Request middleware: request counts and latency, plus cProfile dumps of sampled requests
+#--------------------------------------------------------------------------------------------
+_profiling_lock = threading.Lock()
+
+def _route_label(request: Request) -> str:
+    # The route template keeps the label cardinality bounded, e.g. /import-jobs/{job_id}
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def _start_profiler() -> Optional[cProfile.Profile]:
+    """Starts a profiler for this request when it is sampled and no other request is being profiled."""
+    if config.PROFILE_SAMPLE_PERCENT <= 0 or random.uniform(0, 100) >= config.PROFILE_SAMPLE_PERCENT:
+        return None
+    if not _profiling_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is active in this process
+        _profiling_lock.release()
+        return None
+    return profiler
+
+def _dump_profile(profiler: cProfile.Profile, request: Request, route: str) -> None:
+    profiler.disable()
+    try:
+        os.makedirs(config.PROFILE_DIRECTORY, exist_ok=True)
+        route_name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        path = os.path.join(config.PROFILE_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{route_name}-{time.perf_counter_ns()}.prof")
+        profiler.dump_stats(path)
+        logger.info("Profile of %s %s written to %s", request.method, route, path)
+    except OSError as e:
+        logger.error("Failed to write profile: %s", e)
+    finally:
+        _profiling_lock.release()
+
+async def metrics_middleware(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """
+    Times every request until its response starts. A sampled request is profiled with
+    cProfile; the profiler sees the whole event loop thread, so concurrent requests
+    show up in the dump as well.
+    """
+    profiler = _start_profiler()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = _route_label(request)
+        http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route)
+        http_requests.inc(method=request.method, route=route, status=status)
+        if profiler is not None:
+            _dump_profile(profiler, request, route)
+
+def metrics_response() -> Response:
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,9 +1,13 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Any, Optional
+
+from src.models.enumerations import StatementType
 
 class FinanceItemCategoryModel(BaseModel):
     name: str
     description: str
+    parent_id: Optional[int] = None
 
 class FinanceItemModel(BaseModel):
     record_date: datetime
@@ -12,6 +16,16 @@ class FinanceItemModel(BaseModel):
     finance_item_category_id: int
     personal_data_id: int
 
+class PersistedFinanceItemModel(FinanceItemModel):
+    id: Optional[int] = None
+
+class StatementImportResult(BaseModel):
+    filename: str
+    statement_type: Optional[StatementType] = None
+    transaction_count: int = 0
+    transactions: list[PersistedFinanceItemModel] = []
+    error: Optional[str] = None
+
 class PersonalDataModel(BaseModel):
     first_name: str
     last_name: str
@@ -19,4 +33,29 @@ class PersonalDataModel(BaseModel):
     phone: str
     email: str
     address: str
-    pin: str
\ No newline at end of file
+    pin: str
+
+class BulkIngestRejectedRow(BaseModel):
+    row: int
+    error: str
+    value: Optional[Any] = None
+
+class BulkIngestChunkSummary(BaseModel):
+    chunk: int
+    first_row: int
+    last_row: int
+    received: int
+    stored: int = 0
+    skipped: int = 0  # Already stored by an earlier import
+    rejected: int = 0
+    error: Optional[str] = None
+
+class BulkIngestResult(BaseModel):
+    received: int = 0
+    stored: int = 0
+    skipped: int = 0
+    rejected: int = 0
+    chunks: list[BulkIngestChunkSummary] = []
+    rejected_rows: list[BulkIngestRejectedRow] = []
+    rejected_rows_truncated: bool = False
+    error: Optional[str] = None
@@ -3,7 +3,8 @@ import sqlalchemy.orm as _orm
 from typing import Optional, List
 from src.models.base import Base
 from src.models.enumerations import StatementType
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
 
 class EntityBase(Base):
     __abstract__ = True
@@ -69,6 +70,22 @@ class FinanceItem(EntityBase):
     amount = _sql.Column(_sql.Float(asdecimal=True), index=True, nullable=False)
     personal_data_id = _sql.Column(_sql.Integer, _sql.ForeignKey("PersonalData.id"), index=True, nullable=False)
     personal_data = _orm.relationship("PersonalData", back_populates="financial_items")
+    fingerprint = _sql.Column(_sql.String(64), index=False, nullable=True)
+    occurrence = _sql.Column(_sql.Integer, default=1, server_default="1", index=False, nullable=False)
+
+    __table_args__ = (
+        # One row per (fingerprint, occurrence); rows without a fingerprint are not constrained
+        _sql.Index(
+            "ix_FinanceItem_fingerprint_occurrence", fingerprint, occurrence, unique=True,
+            mssql_where=fingerprint.isnot(None),
+            sqlite_where=fingerprint.isnot(None),
+            postgresql_where=fingerprint.isnot(None)),
+        # Keyset pagination on (record_date, id) per person, optionally within one category
+        _sql.Index("ix_FinanceItem_personal_data_id_record_date_id", "personal_data_id", "record_date", "id"),
+        _sql.Index(
+            "ix_FinanceItem_personal_data_id_category_record_date_id",
+            "personal_data_id", "finance_item_category_id", "record_date", "id"),
+    )
 
     def __init__(
         self,
@@ -76,13 +93,17 @@ class FinanceItem(EntityBase):
         description: str = '',
         finance_item_category_id: int = 0,
         amount: float = 0.0,
-        personal_data_id: int = 0
+        personal_data_id: int = 0,
+        fingerprint: Optional[str] = None,
+        occurrence: int = 1
     ):
         self.record_date = record_date
         self.description = description
         self.amount = amount
         self.finance_item_category_id = finance_item_category_id
         self.personal_data_id = personal_data_id
+        self.fingerprint = fingerprint
+        self.occurrence = occurrence
 
 class SearchPattern(EntityBase):
     __tablename__ = "SearchPattern"
@@ -102,6 +123,68 @@ class SearchPattern(EntityBase):
         self.finance_item_category_id = finance_item_category_id
         self.personal_data_id = personal_data_id
 
+class FinanceItemMonthlySummary(EntityBase):
+    """
+    Spend per person, month and category, maintained incrementally as finance items are
+    written. direct_* covers items booked on the category itself, rollup_* also
+    includes every descendant category.
+    """
+    __tablename__ = "FinanceItemMonthlySummary"
+    personal_data_id = _sql.Column(_sql.Integer, _sql.ForeignKey("PersonalData.id"), index=False, nullable=False)
+    month = _sql.Column(_sql.Date, index=False, nullable=False)
+    finance_item_category_id = _sql.Column(_sql.Integer, _sql.ForeignKey("FinanceItemCategory.id"), index=True, nullable=False)
+    direct_amount = _sql.Column(_sql.Numeric(18, 2), default=0, index=False, nullable=False)
+    direct_count = _sql.Column(_sql.Integer, default=0, index=False, nullable=False)
+    rollup_amount = _sql.Column(_sql.Numeric(18, 2), default=0, index=False, nullable=False)
+    rollup_count = _sql.Column(_sql.Integer, default=0, index=False, nullable=False)
+
+    __table_args__ = (
+        _sql.Index(
+            "ix_FinanceItemMonthlySummary_personal_data_id_month_category",
+            "personal_data_id", "month", "finance_item_category_id", unique=True),
+    )
+
+    def __init__(
+            self,
+            personal_data_id: int = 0,
+            month: Optional[date] = None,
+            finance_item_category_id: int = 0,
+            direct_amount: Decimal = Decimal(0),
+            direct_count: int = 0,
+            rollup_amount: Decimal = Decimal(0),
+            rollup_count: int = 0):
+        self.personal_data_id = personal_data_id
+        self.month = month
+        self.finance_item_category_id = finance_item_category_id
+        self.direct_amount = direct_amount
+        self.direct_count = direct_count
+        self.rollup_amount = rollup_amount
+        self.rollup_count = rollup_count
+
+class DataVersion(EntityBase):
+    """
+    Write counter per table and person, bumped in the transaction of every write to that
+    table for that person; the ETags of read responses are built from it. Rows of tables
+    without a personal_data_id count under personal_data_id 0.
+    """
+    __tablename__ = "DataVersion"
+    table_name = _sql.Column(_sql.String(100), index=False, nullable=False)
+    personal_data_id = _sql.Column(_sql.Integer, default=0, index=False, nullable=False)
+    version = _sql.Column(_sql.Integer, default=0, index=False, nullable=False)
+
+    __table_args__ = (
+        _sql.Index("ix_DataVersion_table_name_personal_data_id", "table_name", "personal_data_id", unique=True),
+    )
+
+    def __init__(
+            self,
+            table_name: str = '',
+            personal_data_id: int = 0,
+            version: int = 0):
+        self.table_name = table_name
+        self.personal_data_id = personal_data_id
+        self.version = version
+
 class StatementTypeSettings(EntityBase):
     __tablename__ = "StatementTypeSettings"
     statement_type = _sql.Column(_sql.Enum(StatementType), index=False, nullable=False)
@@ -0,0 +1,271 @@
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+import sqlalchemy as _sql
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.category_tree import CategoryTreeIndex, get_category_tree, load_category_tree
+from src.data_versions import record_data_change
+from src.models.entities import FinanceItem, FinanceItemCategory, FinanceItemMonthlySummary
+from src.upserts import increment_rows, register_upsert_listener
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# The unique index of FinanceItemMonthlySummary and the totals added up under it
+_SUMMARY_KEY_COLUMNS = ["personal_data_id", "month", "finance_item_category_id"]
+_SUMMARY_TOTAL_COLUMNS = ["direct_amount", "direct_count", "rollup_amount", "rollup_count"]
+
+def to_month(record_date: date | datetime) -> date:
+    return date(record_date.year, record_date.month, 1)
+
+#--------------------------------------------------------------------------------------------
+# Summary deltas
+#--------------------------------------------------------------------------------------------
+class MonthlySummaryDeltas:
+    """
+    Changes to apply to FinanceItemMonthlySummary rows, accumulated per (person, month, category).
+    Rollups follow the shared category index, resolved once on the first add, unless a
+    category_tree is given.
+    """
+
+    def __init__(self, category_tree: Optional[CategoryTreeIndex] = None):
+        # key -> [direct_amount, direct_count, rollup_amount, rollup_count]
+        self.changes: dict[tuple[int, date, int], list[Any]] = {}
+        self.category_tree = category_tree
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def add(
+            self,
+            connection: Connection,
+            personal_data_id: int,
+            record_date: date | datetime,
+            finance_item_category_id: int,
+            amount: Any,
+            sign: int = 1) -> None:
+        """
+        Records one finance item being added (sign 1) or removed (sign -1). Raises KeyError
+        for a category the database on connection does not hold either.
+        """
+        month = to_month(record_date)
+        amount = Decimal(str(amount)).quantize(CENT) * sign
+        if self.category_tree is None:
+            self.category_tree = get_category_tree(connection)
+        category_tree = self.category_tree
+        if finance_item_category_id not in category_tree:
+            # Committed after the cached index was checked, or inserted by plain SQL in this
+            # transaction; read on the writing connection, the rest of the deltas reuse it
+            category_tree = self.category_tree = load_category_tree(connection)
+        for depth, category_id in enumerate(category_tree.ancestors(finance_item_category_id)):
+            change = self.changes.setdefault((personal_data_id, month, category_id), [Decimal(0), 0, Decimal(0), 0])
+            if depth == 0:
+                change[0] += amount
+                change[1] += sign
+            change[2] += amount
+            change[3] += sign
+
+def apply_monthly_summary_deltas(connection: Connection, deltas: MonthlySummaryDeltas) -> None:
+    """
+    Applies the deltas inside the caller's transaction. On SQL Server, PostgreSQL and
+    SQLite this is one atomic increment upsert on the (person, month, category) index,
+    so concurrent imports of the same month cannot both insert the row; elsewhere one
+    UPDATE per touched summary row, followed by an INSERT when the row does not exist yet.
+    """
+    summary = FinanceItemMonthlySummary
+    rows = [
+        {
+            "personal_data_id": personal_data_id,
+            "month": month,
+            "finance_item_category_id": category_id,
+            "direct_amount": direct_amount,
+            "direct_count": direct_count,
+            "rollup_amount": rollup_amount,
+            "rollup_count": rollup_count
+        }
+        for (personal_data_id, month, category_id), (direct_amount, direct_count, rollup_amount, rollup_count) in deltas.changes.items()
+        if direct_count or rollup_count or direct_amount or rollup_amount
+    ]
+    if not rows or increment_rows(connection, summary.__table__, rows, _SUMMARY_KEY_COLUMNS, _SUMMARY_TOTAL_COLUMNS):  # type: ignore
+        return
+    for row in rows:
+        result = connection.execute(
+            update(summary)
+            .where(
+                summary.personal_data_id == row["personal_data_id"],
+                summary.month == row["month"],
+                summary.finance_item_category_id == row["finance_item_category_id"])
+            .values(
+                direct_amount=summary.direct_amount + row["direct_amount"],
+                direct_count=summary.direct_count + row["direct_count"],
+                rollup_amount=summary.rollup_amount + row["rollup_amount"],
+                rollup_count=summary.rollup_count + row["rollup_count"]))
+        if result.rowcount == 0:
+            connection.execute(insert(summary).values(**row))
+
+def apply_finance_item_rows(connection: Connection, rows: Iterable[dict[str, Any]], sign: int = 1) -> None:
+    """Adds (or with sign -1 removes) finance item rows written outside the ORM unit of work."""
+    deltas = MonthlySummaryDeltas()
+    for row in rows:
+        deltas.add(connection, row["personal_data_id"], row["record_date"], row["finance_item_category_id"], row["amount"], sign)
+    apply_monthly_summary_deltas(connection, deltas)
+
+def _rebuild_summaries_of_person(
+        connection: Connection,
+        personal_data_id: int,
+        category_tree: Optional[CategoryTreeIndex] = None,
+        batch_size: int = 1000) -> int:
+    """Replaces every summary row of a person inside the caller's transaction. Returns the rows written."""
+    connection.execute(delete(FinanceItemMonthlySummary).where(FinanceItemMonthlySummary.personal_data_id == personal_data_id))
+    deltas = MonthlySummaryDeltas(category_tree)
+    rows = connection.execution_options(yield_per=batch_size).execute(
+        select(FinanceItem.record_date, FinanceItem.finance_item_category_id, FinanceItem.amount)
+        .where(FinanceItem.personal_data_id == personal_data_id))
+    for record_date, finance_item_category_id, amount in rows:
+        deltas.add(connection, personal_data_id, record_date, finance_item_category_id, amount)
+    apply_monthly_summary_deltas(connection, deltas)
+    return len(deltas.changes)
+
+def rebuild_monthly_summaries(database_session: Session, personal_data_id: int, batch_size: int = 1000) -> None:
+    """Recomputes every summary row of a person from their finance items, e.g. after a backfill."""
+    rebuilt = _rebuild_summaries_of_person(database_session.connection(), personal_data_id, batch_size=batch_size)
+    record_data_change(database_session, {(FinanceItemMonthlySummary.__tablename__, personal_data_id)})
+    database_session.commit()
+    logger.info("Rebuilt %d monthly summaries for PersonalData %s.", rebuilt, personal_data_id)
+
+def rebuild_summaries_under_categories(connection: Connection, finance_item_category_ids: Iterable[int]) -> list[int]:
+    """
+    Rebuilds, inside the caller's transaction, the summaries of every person with finance
+    items under the given categories, after those categories moved to another parent and
+    their old and new ancestors' rollups went wrong. The hierarchy is read on the same
+    connection, so it already holds the uncommitted move. Returns the persons rebuilt.
+    """
+    summary = FinanceItemMonthlySummary
+    finance_item_category_ids = list(finance_item_category_ids)
+    if not finance_item_category_ids:
+        return []
+    # A category's own rollup rows count every item in its subtree
+    personal_data_ids = list(connection.execute(
+        select(summary.personal_data_id).distinct()
+        .where(summary.finance_item_category_id.in_(finance_item_category_ids), summary.rollup_count != 0)).scalars())
+    if personal_data_ids:
+        category_tree = load_category_tree(connection)
+        for personal_data_id in personal_data_ids:
+            _rebuild_summaries_of_person(connection, personal_data_id, category_tree)
+        logger.info("Rebuilt the monthly summaries of %d people after categories %s moved.", len(personal_data_ids), finance_item_category_ids)
+    return personal_data_ids
+
+#--------------------------------------------------------------------------------------------
+# Keep the summaries in step with every ORM flush of FinanceItem rows
+#--------------------------------------------------------------------------------------------
+_SUMMARY_ATTRIBUTES = ("personal_data_id", "record_date", "finance_item_category_id", "amount")
+
+def _committed_values(finance_item: FinanceItem) -> tuple[Any, ...]:
+    state = _sql.inspect(finance_item)
+    values = []
+    for attribute in _SUMMARY_ATTRIBUTES:
+        history = state.attrs[attribute].history
+        values.append(history.deleted[0] if history.deleted else getattr(finance_item, attribute))
+    return tuple(values)
+
+def _on_after_flush(database_session: Session, flush_context: Any) -> None:
+    deltas = MonthlySummaryDeltas()
+    connection = database_session.connection()
+    for finance_item in database_session.new:
+        if isinstance(finance_item, FinanceItem):
+            deltas.add(connection, *(getattr(finance_item, attribute) for attribute in _SUMMARY_ATTRIBUTES))
+    for finance_item in database_session.dirty:
+        if isinstance(finance_item, FinanceItem) and database_session.is_modified(finance_item):
+            old_values = _committed_values(finance_item)
+            new_values = tuple(getattr(finance_item, attribute) for attribute in _SUMMARY_ATTRIBUTES)
+            if old_values != new_values:
+                deltas.add(connection, *old_values, sign=-1)
+                deltas.add(connection, *new_values)
+    for finance_item in database_session.deleted:
+        if isinstance(finance_item, FinanceItem):
+            deltas.add(connection, *_committed_values(finance_item), sign=-1)
+    if deltas:
+        apply_monthly_summary_deltas(connection, deltas)
+    # Last, as the rebuild recomputes from every flushed finance item
+    rebuild_summaries_under_categories(connection, [
+        finance_item_category.id for finance_item_category in database_session.dirty
+        if isinstance(finance_item_category, FinanceItemCategory)
+        and _sql.inspect(finance_item_category).attrs["parent_id"].history.has_changes()
+    ])
+
+_sql.event.listen(Session, "after_flush", _on_after_flush)
+
+#--------------------------------------------------------------------------------------------
+# ... and with every upsert of FinanceItem rows, which bypasses the flush
+#--------------------------------------------------------------------------------------------
+def _before_finance_item_upsert(connection: Connection, finance_item_ids: list[int]) -> dict[int, tuple[Any, ...]]:
+    if not finance_item_ids:
+        return {}
+    rows = connection.execute(
+        select(FinanceItem.id, *(getattr(FinanceItem, attribute) for attribute in _SUMMARY_ATTRIBUTES))
+        .where(FinanceItem.id.in_(finance_item_ids)))
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def _after_finance_item_upsert(
+        connection: Connection,
+        written_rows: list[dict[str, Any]],
+        old_values_by_id: dict[int, tuple[Any, ...]]) -> None:
+    deltas = MonthlySummaryDeltas()
+    for row in written_rows:
+        new_values = tuple(row[attribute] for attribute in _SUMMARY_ATTRIBUTES)
+        old_values = old_values_by_id.get(row["id"])
+        if old_values == new_values:
+            continue
+        if old_values is not None:
+            deltas.add(connection, *old_values, sign=-1)
+        deltas.add(connection, *new_values)
+    if deltas:
+        apply_monthly_summary_deltas(connection, deltas)
+
+register_upsert_listener(FinanceItem, _after_finance_item_upsert, _before_finance_item_upsert)
+
+#--------------------------------------------------------------------------------------------
+# ... and rebuild them when an upsert moves a category to another parent
+#--------------------------------------------------------------------------------------------
+def _before_finance_item_category_upsert(connection: Connection, finance_item_category_ids: list[int]) -> dict[int, Optional[int]]:
+    if not finance_item_category_ids:
+        return {}
+    rows = connection.execute(
+        select(FinanceItemCategory.id, FinanceItemCategory.parent_id)
+        .where(FinanceItemCategory.id.in_(finance_item_category_ids)))
+    return {finance_item_category_id: parent_id for finance_item_category_id, parent_id in rows}
+
+def _after_finance_item_category_upsert(
+        connection: Connection,
+        written_rows: list[dict[str, Any]],
+        old_parents_by_id: dict[int, Optional[int]]) -> None:
+    rebuild_summaries_under_categories(connection, [
+        row["id"] for row in written_rows
+        if row["id"] in old_parents_by_id and old_parents_by_id[row["id"]] != row["parent_id"]
+    ])
+
+register_upsert_listener(FinanceItemCategory, _after_finance_item_category_upsert, _before_finance_item_category_upsert)
+
+#--------------------------------------------------------------------------------------------
+# python -m src.monthly_summaries rebuild [personal_data_id ...]
+#--------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import sys
+    import src.database as _database
+    from src.models.entities import PersonalData
+    if sys.argv[1:2] == ["rebuild"]:
+        with _database.create_session() as database_session:
+            personal_data_ids = [int(argument) for argument in sys.argv[2:]] or list(
+                database_session.execute(select(PersonalData.id).order_by(PersonalData.id)).scalars())
+            for personal_data_id in personal_data_ids:
+                rebuild_monthly_summaries(database_session, personal_data_id)
+        print(f"Rebuilt the monthly summaries of {len(personal_data_ids)} people")
+    else:
+        print("Usage: python -m src.monthly_summaries rebuild [personal_data_id ...]")
+        sys.exit(2)
@@ -0,0 +1,93 @@
+import re
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+import sqlalchemy as _sql
+
+from src.models.entities import SettingsJson, StatementTypeSettings
+from src.models.enumerations import StatementType
+
+# Transaction lines start with 'DD Mon' (e.g. '12 May') or 'DD/MM/YYYY'
+TRANSACTION_DATE_PATTERN = re.compile(r'(\d{1,2}\s+\w{3}|\d{1,2}/\d{1,2}/\d{4})')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+AMOUNT_NOISE_PATTERN = re.compile(r'[^\d.-]')
+
+STATEMENT_DATE_FORMATS = ('%d %b', '%d/%m/%Y', '%d-%m-%Y')
+# Statements printing only 'DD Mon' do not carry a year, assume 2025 (based on context)
+DEFAULT_STATEMENT_YEAR = 2025
+
+@lru_cache(maxsize=4096)
+def parse_statement_date(date_str: str) -> Optional[datetime]:
+    """
+    Parses a statement date string, returning None when no known format matches.
+    Statements repeat the same handful of dates, so results are memoized.
+    """
+    date_str = WHITESPACE_PATTERN.sub(' ', date_str.strip())
+    for fmt in STATEMENT_DATE_FORMATS:
+        try:
+            parsed_date = datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+        if fmt == '%d %b':
+            parsed_date = parsed_date.replace(year=DEFAULT_STATEMENT_YEAR)
+        return parsed_date
+    return None
+
+class ParserPlan:
+    """
+    Everything extract_transactions needs from a SettingsJson, compiled once: the
+    transaction date regex, a single matcher for all lines to skip and the fixed line
+    offsets of the description, amount and credit marker.
+    """
+
+    def __init__(self, settings_json: SettingsJson):
+        self.settings_key = settings_json.to_json()
+        self.date_pattern = TRANSACTION_DATE_PATTERN
+        self.skip_matcher = (
+            re.compile('|'.join(re.escape(keyword) for keyword in settings_json.transaction_lines_to_skip))
+            if settings_json.transaction_lines_to_skip else None
+        )
+        self.description_offsets: tuple[int, ...] = tuple(settings_json.description_indices)
+        self.amount_offset: int = settings_json.amount_index
+        self.credit_offset: int = settings_json.credit_index
+        self.credit_line_exists: bool = settings_json.credit_line_exists
+        self.parse_date = parse_statement_date
+
+    def should_skip(self, description: str) -> bool:
+        return not description or (self.skip_matcher is not None and self.skip_matcher.search(description) is not None)
+
+_parser_plans: dict[StatementType, ParserPlan] = {}
+_parser_plans_lock = threading.Lock()
+
+def get_parser_plan(
+        settings_json: SettingsJson,
+        statement_type: Optional[StatementType] = None) -> ParserPlan:
+    """
+    Returns the compiled plan for the settings, reusing the plan cached for the
+    statement type as long as it was compiled from the same settings.
+    """
+    if statement_type is None:
+        return ParserPlan(settings_json)
+
+    settings_key = settings_json.to_json()
+    plan = _parser_plans.get(statement_type)
+    if plan is None or plan.settings_key != settings_key:
+        plan = ParserPlan(settings_json)
+        with _parser_plans_lock:
+            _parser_plans[statement_type] = plan
+    return plan
+
+def invalidate_parser_plan(statement_type: StatementType) -> None:
+    with _parser_plans_lock:
+        _parser_plans.pop(statement_type, None)
+
+def _on_statement_type_settings_changed(mapper, connection, target: StatementTypeSettings) -> None:
+    history = _sql.inspect(target).attrs.statement_type.history
+    for statement_type in {target.statement_type, *history.deleted}:
+        if isinstance(statement_type, StatementType):
+            invalidate_parser_plan(statement_type)
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    _sql.event.listen(StatementTypeSettings, _event_name, _on_statement_type_settings_changed)
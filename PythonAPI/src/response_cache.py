@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+from fastapi.requests import Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import src.config as config
+from src.data_versions import DataScope, get_data_versions
+from src.metrics import http_cache_responses
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------------
+# Conditional GET for the read endpoints. The ETag of a response is built from the write
+# counters of the data it reads, read before the data itself, so a client sending a
+# matching If-None-Match gets a 304 after one small query and without any serialization.
+#--------------------------------------------------------------------------------------------
+# Clients keep the body but revalidate it on every use
+_CACHE_CONTROL = "private, no-cache"
+
+class CachedResponse:
+    """The encoded body of one read response and the ETag it was built under."""
+
+    def __init__(
+            self,
+            etag: str,
+            body: bytes,
+            media_type: Optional[str]):
+        self.etag = etag
+        self.body = body
+        self.media_type = media_type
+
+class ResponseCache:
+    """
+    Size bounded LRU of encoded read responses, one entry per URL. An entry only answers
+    requests made under the same ETag; after a write it is replaced on the next request.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 256,
+            max_entry_bytes: int = 256 * 1024):
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResponse) -> None:
+        if self.max_entries <= 0 or len(entry.body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_MAX_ENTRIES, config.RESPONSE_CACHE_MAX_ENTRY_BYTES)
+
+def build_etag(versions: Iterable[int]) -> str:
+    return f'W/"{".".join(str(version) for version in versions)}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against etag, as If-None-Match requires.
+    "*" never matches: the ETag is known before it is known whether the resource exists.
+    """
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+async def conditional_response(
+        request: Request,
+        database_session: AsyncSession,
+        scopes: list[DataScope],
+        build_response: Callable[[], Awaitable[Response]]) -> Response:
+    """
+    Answers a read request whose body only depends on the data of the given scopes:
+    304 when If-None-Match holds the current ETag, otherwise the cached body of the URL,
+    and only when neither applies the response of build_response, which is then cached.
+    Error responses and streamed bodies are never cached.
+    """
+    if not config.HTTP_CACHE_ENABLED:
+        return await build_response()
+
+    etag = build_etag(await get_data_versions(database_session, scopes))
+    headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        http_cache_responses.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    cache_key = f"{request.url.path}?{request.url.query}"
+    entry = response_cache.get(cache_key, etag)
+    if entry is not None:
+        http_cache_responses.inc(result="hit")
+        return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+    http_cache_responses.inc(result="miss")
+    response = await build_response()
+    body = getattr(response, "body", None)  # StreamingResponse has none
+    if response.status_code == 200 and isinstance(body, bytes):
+        response_cache.put(cache_key, CachedResponse(etag, body, response.media_type))
+    response.headers.update(headers)
+    return response
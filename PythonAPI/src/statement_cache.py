@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, BinaryIO, Optional
+
+import sqlalchemy as _sql
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+import src.config as config
+from src.models.apimodels import FinanceItemModel
+from src.models.entities import SettingsJson, StatementTypeSettings
+from src.models.enumerations import StatementType
+from src.upserts import register_upsert_listener
+
+logger = logging.getLogger(__name__)
+
+class StatementCacheEntry:
+    """
+    Filtered page text and parsed transactions of one uploaded statement. Statements
+    parsed page by page in streaming mode keep no page text.
+    """
+
+    def __init__(
+            self,
+            pages: list[str],
+            transactions: list[FinanceItemModel]):
+        self.pages = pages
+        self.transactions = transactions
+
+    def copy_transactions(self) -> list[FinanceItemModel]:
+        return [transaction.model_copy() for transaction in self.transactions]
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "pages": self.pages,
+            "transactions": [transaction.model_dump(mode="json") for transaction in self.transactions]
+        })
+
+    @classmethod
+    def from_json(cls, json_str: str) -> 'StatementCacheEntry':
+        data = json.loads(json_str)
+        return cls(
+            pages=[str(page) for page in data["pages"]],
+            transactions=[FinanceItemModel.model_validate(transaction) for transaction in data["transactions"]])
+
+class StatementCache:
+    """
+    Content addressed cache of parsed statements. Entries are keyed by the hash of the
+    PDF bytes and the SettingsJson used to parse them, kept in a size bounded LRU and
+    optionally mirrored to disk under one directory per StatementType. Disk entries are
+    plain JSON validated on load, so a file planted in the directory cannot run code.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 128,
+            disk_directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_directory = disk_directory or None
+        self._entries: OrderedDict[tuple[StatementType, str], StatementCacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(
+            content: bytes,
+            settings_json: SettingsJson) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(b"\0")
+        digest.update(settings_json.to_json().encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def build_file_key(
+            source: BinaryIO,
+            settings_json: SettingsJson,
+            chunk_size: int = 1024 * 1024) -> str:
+        """build_key of a seekable file, hashed chunk by chunk; the file is rewound afterwards."""
+        source.seek(0)
+        digest = hashlib.sha256()
+        while chunk := source.read(chunk_size):
+            digest.update(chunk)
+        source.seek(0)
+        digest.update(b"\0")
+        digest.update(settings_json.to_json().encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(
+            self,
+            statement_type: StatementType,
+            key: str) -> Optional[StatementCacheEntry]:
+        with self._lock:
+            entry = self._entries.get((statement_type, key))
+            if entry is not None:
+                self._entries.move_to_end((statement_type, key))
+                return entry
+
+        entry = self._read_from_disk(statement_type, key)
+        if entry is not None:
+            self._store_in_memory(statement_type, key, entry)
+        return entry
+
+    def put(
+            self,
+            statement_type: StatementType,
+            key: str,
+            entry: StatementCacheEntry) -> None:
+        self._store_in_memory(statement_type, key, entry)
+        self._write_to_disk(statement_type, key, entry)
+
+    def invalidate_statement_type(self, statement_type: StatementType) -> None:
+        """Drops every entry parsed with the settings of the given statement type."""
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == statement_type]:
+                del self._entries[cache_key]
+        if self.disk_directory:
+            shutil.rmtree(os.path.join(self.disk_directory, statement_type.value), ignore_errors=True)
+        logger.info("Statement cache invalidated for %s.", statement_type.value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.disk_directory:
+            for statement_type in StatementType:
+                shutil.rmtree(os.path.join(self.disk_directory, statement_type.value), ignore_errors=True)
+
+    def _store_in_memory(
+            self,
+            statement_type: StatementType,
+            key: str,
+            entry: StatementCacheEntry) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(statement_type, key)] = entry
+            self._entries.move_to_end((statement_type, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(
+            self,
+            statement_type: StatementType,
+            key: str) -> Optional[str]:
+        if not self.disk_directory:
+            return None
+        return os.path.join(self.disk_directory, statement_type.value, f"{key}.json")
+
+    def _read_from_disk(
+            self,
+            statement_type: StatementType,
+            key: str) -> Optional[StatementCacheEntry]:
+        path = self._disk_path(statement_type, key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as cache_file:
+                return StatementCacheEntry.from_json(cache_file.read())
+        except Exception as e:
+            logger.warning("Discarding unreadable statement cache file %s: %s", path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_to_disk(
+            self,
+            statement_type: StatementType,
+            key: str,
+            entry: StatementCacheEntry) -> None:
+        path = self._disk_path(statement_type, key)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                cache_file.write(entry.to_json())
+            os.replace(temporary_path, path)
+        except Exception as e:
+            logger.warning("Failed to write statement cache file %s: %s", path, e)
+
+statement_cache = StatementCache(
+    max_entries=config.STATEMENT_CACHE_MAX_ENTRIES,
+    disk_directory=config.STATEMENT_CACHE_DIRECTORY)
+
+#--------------------------------------------------------------------------------------------
+# Invalidate cached statements whenever the StatementTypeSettings row of their type changes
+#--------------------------------------------------------------------------------------------
+def _on_statement_type_settings_changed(mapper, connection, target: StatementTypeSettings) -> None:
+    history = _sql.inspect(target).attrs.statement_type.history
+    for statement_type in {target.statement_type, *history.deleted}:
+        if isinstance(statement_type, StatementType):
+            statement_cache.invalidate_statement_type(statement_type)
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    _sql.event.listen(StatementTypeSettings, _event_name, _on_statement_type_settings_changed)
+
+# Upserts bypass the mapper events above
+def _before_statement_type_settings_upsert(connection: Connection, statement_type_settings_ids: list[int]) -> set[StatementType]:
+    """The statement types of the settings rows about to be updated, before the update."""
+    if not statement_type_settings_ids:
+        return set()
+    return set(connection.execute(
+        select(StatementTypeSettings.statement_type).where(StatementTypeSettings.id.in_(statement_type_settings_ids))).scalars())
+
+def _after_statement_type_settings_upsert(
+        connection: Connection,
+        written_rows: list[dict[str, Any]],
+        old_statement_types: set[StatementType]) -> None:
+    for statement_type in {*old_statement_types, *(row.get("statement_type") for row in written_rows)}:
+        if isinstance(statement_type, StatementType):
+            statement_cache.invalidate_statement_type(statement_type)
+
+register_upsert_listener(
+    StatementTypeSettings, _after_statement_type_settings_upsert, _before_statement_type_settings_upsert)
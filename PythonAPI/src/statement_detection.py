@@ -0,0 +1,107 @@
+import io
+import re
+from typing import BinaryIO, Iterable, Optional
+
+from src.metrics import pdf_pages_scanned
+from src.models.entities import SettingsJson
+from src.models.enumerations import StatementType
+
+#--------------------------------------------------------------------------------------------
+# StatementType detection from the transaction_page_keywords of every statement type.
+# All keywords are compiled into one regular expression, so each page is scanned once
+# however many types are configured.
+#--------------------------------------------------------------------------------------------
+class StatementTypeNotDetectedError(ValueError):
+    pass
+
+class StatementTypeDetector:
+    """
+    Scores statement types by the keywords found on the first pages of a statement. A
+    page is a transaction page of a type when it holds every keyword of that type, which
+    is the same test extraction uses to keep pages.
+    """
+
+    def __init__(self, settings: dict[StatementType, SettingsJson]):
+        self.settings = settings
+        self.keywords_by_type: dict[StatementType, frozenset[str]] = {
+            statement_type: frozenset(settings_json.transaction_page_keywords)
+            for statement_type, settings_json in settings.items()
+            if settings_json.transaction_page_keywords  # Without keywords every page would match
+        }
+        keywords = sorted({keyword for keywords in self.keywords_by_type.values() for keyword in keywords}, key=len, reverse=True)
+        # The lookahead finds a keyword at every position, so keywords inside other keywords
+        # are found as well; only the shorter keywords starting at the same position as a
+        # longer one are hidden, and those are credited through _prefixes.
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in keywords) + "))") if keywords else None
+        self._prefixes: dict[str, tuple[str, ...]] = {
+            keyword: tuple(other for other in keywords if other != keyword and keyword.startswith(other))
+            for keyword in keywords
+        }
+
+    def find_keywords(self, text: str) -> set[str]:
+        """The configured keywords contained in text."""
+        found: set[str] = set()
+        if self._pattern is None:
+            return found
+        for keyword_match in self._pattern.finditer(text):
+            keyword = keyword_match.group(1)
+            if keyword not in found:
+                found.add(keyword)
+                found.update(self._prefixes[keyword])
+        return found
+
+    def score(self, pages: Iterable[str]) -> list[tuple[StatementType, int, float]]:
+        """
+        Scores every type over the pages as (type, transaction pages, share of its keywords
+        seen on any page), best first. Ties go to the type with more keywords, the more
+        specific layout. Stops after the first page that is a transaction page of any type.
+        """
+        transaction_pages = dict.fromkeys(self.keywords_by_type, 0)
+        seen: set[str] = set()
+        for page in pages:
+            found = self.find_keywords(page)
+            seen |= found
+            matched = False
+            for statement_type, keywords in self.keywords_by_type.items():
+                if keywords <= found:
+                    transaction_pages[statement_type] += 1
+                    matched = True
+            if matched:
+                break
+
+        scores = [
+            (statement_type, transaction_pages[statement_type], len(keywords & seen) / len(keywords))
+            for statement_type, keywords in self.keywords_by_type.items()
+        ]
+        scores.sort(key=lambda score: (score[1], score[2], len(self.keywords_by_type[score[0]])), reverse=True)
+        return scores
+
+    def detect(self, pages: Iterable[str]) -> Optional[StatementType]:
+        """The best scoring type with at least one transaction page, None when no type has one."""
+        scores = self.score(pages)
+        if not scores or scores[0][1] == 0:
+            return None
+        return scores[0][0]
+
+def iter_first_page_texts(source: bytes | BinaryIO, max_pages: int) -> Iterable[str]:
+    """Yields the text of up to max_pages leading pages, extracting each only when it is needed."""
+    from PyPDF2 import PdfReader  # Loaded on first use to keep application start-up light
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    else:
+        source.seek(0)
+    reader = PdfReader(source)
+    for page_number in range(min(max_pages, len(reader.pages))):
+        pdf_pages_scanned.inc()
+        yield reader.pages[page_number].extract_text() or ""
+
+def detect_statement_type(
+        source: bytes | BinaryIO,
+        detector: StatementTypeDetector,
+        max_pages: int) -> Optional[StatementType]:
+    """Detects the type of a statement PDF from its first pages. A file source is left at its start."""
+    try:
+        return detector.detect(iter_first_page_texts(source, max_pages))
+    finally:
+        if not isinstance(source, bytes):
+            source.seek(0)
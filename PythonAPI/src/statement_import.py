@@ -0,0 +1,270 @@
+import asyncio
+import io
+import logging
+import zipfile
+from typing import Awaitable, BinaryIO, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+import src.config as config
+import src.database as _database
+from src.async_database import run_blocking
+from src.categorization import categorize_transactions, get_category_matcher
+from src.entitybuilder import bulk_insert_finance_items
+from src.file_utils import extract_transaction_pages_from_pdf_bytes, extract_transactions_batch, extract_transactions_streaming
+from src.models.apimodels import FinanceItemModel, PersistedFinanceItemModel, StatementImportResult
+from src.models.entities import SettingsJson
+from src.metrics import timed_stage, transactions_parsed, transactions_unparsed
+from src.models.enumerations import StatementType
+from src.statement_cache import statement_cache, StatementCacheEntry
+from src.statement_detection import StatementTypeNotDetectedError, detect_statement_type
+from src.statement_settings_registry import statement_settings_registry
+from src.transaction_columns import TransactionBatch
+
+logger = logging.getLogger(__name__)
+
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+# Unparsable transactions listed in the log line of a statement; the rest are only counted
+_LOGGED_PARSE_FAILURES = 20
+
+# Awaited with (stage, fraction done) while a statement is imported
+ProgressCallback = Callable[[str, float], Awaitable[None]]
+
+async def _ignore_progress(stage: str, progress: float) -> None:
+    pass
+
+class StatementUpload:
+    """
+    One statement PDF to import, either uploaded directly or taken from a zip archive.
+    A statement_type of None is detected when the statement is imported.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            content: bytes,
+            statement_type: Optional[StatementType]):
+        self.filename = filename
+        self.content = content
+        self.statement_type = statement_type
+
+def is_zip_archive(filename: Optional[str], content: bytes) -> bool:
+    return content.startswith(ZIP_SIGNATURE) or (filename or "").lower().endswith(".zip")
+
+def expand_zip_archive(
+        filename: str,
+        content: bytes,
+        statement_type: Optional[StatementType],
+        max_files: int) -> list[StatementUpload]:
+    """
+    Returns the PDFs of a zip archive. A PDF inside a folder named after a StatementType
+    (e.g. HSBC_SB_STATEMENT/2025-01.pdf) is imported as that type, any other PDF as the
+    type the archive was tagged with, or detected when it has none. Raises ValueError for
+    a bad or oversized archive.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"{filename} is not a valid zip archive") from e
+
+    with archive:
+        members = [
+            member for member in archive.infolist()
+            if not member.is_dir() and member.filename.lower().endswith(".pdf")
+        ]
+        if len(members) > max_files:
+            raise ValueError(f"{filename} holds {len(members)} PDFs, at most {max_files} are accepted")
+        if sum(member.file_size for member in members) > config.STATEMENT_BATCH_MAX_ARCHIVE_BYTES:
+            raise ValueError(f"{filename} expands to more than {config.STATEMENT_BATCH_MAX_ARCHIVE_BYTES} bytes")
+
+        uploads = []
+        for member in members:
+            folders = member.filename.split("/")[:-1]
+            member_statement_type = statement_type
+            if folders and folders[-1] in StatementType.__members__:
+                member_statement_type = StatementType[folders[-1]]
+            uploads.append(StatementUpload(f"{filename}/{member.filename}", archive.read(member), member_statement_type))
+        return uploads
+
+def _batch_transactions(batch: TransactionBatch, filename: str) -> list[FinanceItemModel]:
+    """The models of the rows of batch that parsed; the others are logged and counted."""
+    transactions = batch.to_finance_item_models()
+    transactions_parsed.inc(len(transactions))
+    if batch.failures:
+        unparsed = len({failure.row for failure in batch.failures})
+        transactions_unparsed.inc(unparsed)
+        logger.warning(
+            "Skipped %d transactions of %s whose date or amount did not parse: %s",
+            unparsed, filename or "the upload", [failure.to_dict() for failure in batch.failures[:_LOGGED_PARSE_FAILURES]])
+    return transactions
+
+def _parse_statement_text(
+        text: str,
+        settings_json: SettingsJson,
+        statement_type: StatementType,
+        filename: str = "") -> list[FinanceItemModel]:
+    return _batch_transactions(extract_transactions_batch(text, settings_json, statement_type), filename)
+
+def _parse_statement_file(
+        source: BinaryIO,
+        settings_json: SettingsJson,
+        statement_type: StatementType,
+        filename: str = "") -> list[FinanceItemModel]:
+    return _batch_transactions(extract_transactions_streaming(source, settings_json, statement_type), filename)
+
+async def resolve_statement_type(
+        content: bytes | BinaryIO,
+        statement_type: Optional[StatementType],
+        database_session: Session,
+        filename: str = "") -> StatementType:
+    """
+    Returns statement_type, or detects it from the first pages of the PDF when it is None.
+    Raises StatementTypeNotDetectedError when no configured type matches.
+    """
+    if statement_type is not None:
+        return statement_type
+    with timed_stage("detect_statement_type"):
+        detector = await run_blocking(statement_settings_registry.get_detector, database_session)
+        detected_type = await asyncio.to_thread(
+            detect_statement_type, content, detector, config.STATEMENT_DETECTION_MAX_PAGES)
+    if detected_type is None:
+        raise StatementTypeNotDetectedError(
+            f"Could not detect the statement type of {filename or 'the upload'} from its first {config.STATEMENT_DETECTION_MAX_PAGES} pages")
+    logger.info("Detected %s for %s", detected_type.value, filename)
+    return detected_type
+
+async def import_statement(
+        content: bytes | BinaryIO,
+        statement_type: Optional[StatementType],
+        personal_data_id: int,
+        persist: bool,
+        database_session: Session,
+        filename: str = "",
+        on_progress: Optional[ProgressCallback] = None) -> list[FinanceItemModel]:
+    """
+    Extracts, categorizes and optionally stores the transactions of one statement PDF.
+    Page extraction runs in the PDF process pool, parsing and database work in the
+    blocking thread pool, so the event loop is never held up. When persist is set the
+    returned models are PersistedFinanceItemModel carrying their FinanceItem ids.
+    on_progress is awaited with the stage name and the fraction done as each stage starts.
+    content may also be a seekable file, such as an upload spooled to disk; the PDF is then
+    extracted and parsed page by page in one worker thread to keep peak memory bounded.
+    Without a statement_type the type is detected first, see resolve_statement_type.
+    """
+    report_progress = on_progress or _ignore_progress
+    await report_progress("loading_settings", 0.0)
+    statement_type = await resolve_statement_type(content, statement_type, database_session, filename)
+    with timed_stage("settings_lookup"):
+        settings_json_obj: SettingsJson = await run_blocking(
+            statement_settings_registry.get,
+            database_session,
+            statement_type)
+
+    with timed_stage("statement_cache_lookup"):
+        if isinstance(content, bytes):
+            cache_key = statement_cache.build_key(content, settings_json_obj)
+        else:
+            cache_key = await asyncio.to_thread(statement_cache.build_file_key, content, settings_json_obj)
+        cache_entry = statement_cache.get(statement_type, cache_key)
+    if cache_entry is not None:
+        logger.info("Statement cache hit for %s", filename)
+    elif not isinstance(content, bytes):
+        await report_progress("extracting_pages", 0.1)
+        with timed_stage("extract_and_parse_streaming"):
+            extracted_transactions = await asyncio.to_thread(
+                _parse_statement_file,
+                content,
+                settings_json_obj,
+                statement_type,
+                filename)
+        cache_entry = StatementCacheEntry([], extracted_transactions)
+        statement_cache.put(statement_type, cache_key, cache_entry)
+    else:
+        await report_progress("extracting_pages", 0.1)
+        with timed_stage("extract_pages"):  # Page text extraction and keyword filtering
+            pages = await extract_transaction_pages_from_pdf_bytes(
+                content,
+                settings_json_obj.transaction_page_keywords)
+        await report_progress("parsing_transactions", 0.6)
+        with timed_stage("parse_transactions"):
+            extracted_transactions: list[FinanceItemModel] = await run_blocking(
+                _parse_statement_text,
+                "".join(pages),
+                settings_json_obj,
+                statement_type,
+                filename)
+        cache_entry = StatementCacheEntry(pages, extracted_transactions)
+        statement_cache.put(statement_type, cache_key, cache_entry)
+
+    await report_progress("categorizing", 0.7)
+    with timed_stage("categorize"):
+        transactions = cache_entry.copy_transactions()
+        for transaction in transactions:
+            transaction.personal_data_id = personal_data_id
+        category_matcher = await run_blocking(get_category_matcher, database_session, personal_data_id)
+        categorize_transactions(transactions, category_matcher)
+
+    if not persist:
+        return transactions
+
+    await report_progress("persisting", 0.8)
+    with timed_stage("persist"):
+        finance_item_ids = await run_blocking(bulk_insert_finance_items, transactions, database_session)
+    return [
+        PersistedFinanceItemModel(id=finance_item_id, **transaction.model_dump())
+        for finance_item_id, transaction in zip(finance_item_ids, transactions)
+    ]
+
+def build_import_result(
+        filename: str,
+        statement_type: Optional[StatementType],
+        transactions: list[FinanceItemModel]) -> StatementImportResult:
+    return StatementImportResult(
+        filename=filename,
+        statement_type=statement_type,
+        transaction_count=len(transactions),
+        transactions=[
+            transaction if isinstance(transaction, PersistedFinanceItemModel)
+            else PersistedFinanceItemModel(**transaction.model_dump())
+            for transaction in transactions
+        ])
+
+async def import_statement_batch(
+        uploads: list[StatementUpload],
+        personal_data_id: int,
+        persist: bool,
+        max_concurrency: Optional[int] = None) -> list[StatementImportResult]:
+    """
+    Imports the statements concurrently, at most max_concurrency at a time, each with
+    its own database session. A failing statement is reported in its result and does
+    not affect the others. Results are in upload order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or config.STATEMENT_BATCH_MAX_CONCURRENCY)
+
+    async def import_one(upload: StatementUpload) -> StatementImportResult:
+        async with semaphore:
+            database_session = _database.create_session()
+            statement_type = upload.statement_type
+            try:
+                statement_type = await resolve_statement_type(
+                    upload.content, statement_type, database_session, upload.filename)
+                transactions = await import_statement(
+                    upload.content,
+                    statement_type,
+                    personal_data_id,
+                    persist,
+                    database_session,
+                    upload.filename)
+                return build_import_result(upload.filename, statement_type, transactions)
+            except Exception as e:
+                logger.error("Failed to import %s: %s", upload.filename, e)
+                await run_blocking(database_session.rollback)
+                return StatementImportResult(
+                    filename=upload.filename,
+                    statement_type=statement_type,
+                    error=str(e))
+            finally:
+                await run_blocking(database_session.close)
+
+    return list(await asyncio.gather(*(import_one(upload) for upload in uploads)))
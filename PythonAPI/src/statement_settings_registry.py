@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+import sqlalchemy as _sql
+from sqlalchemy.orm import Session
+
+import src.config as config
+from src.entitybuilder import get_all_statement_type_settings
+from src.models.entities import SettingsJson, StatementTypeSettings
+from src.models.enumerations import StatementType
+from src.statement_detection import StatementTypeDetector
+from src.upserts import register_upsert_listener
+
+logger = logging.getLogger(__name__)
+
+class StatementSettingsRegistry:
+    """
+    In-process registry of the parsed SettingsJson of every StatementTypeSettings row.
+    All rows are loaded with a single query and reloaded once the TTL expires or after
+    invalidate() is called, so lookups normally never touch the database.
+    """
+
+    def __init__(self, ttl_seconds: int = 300):
+        self.ttl_seconds = ttl_seconds
+        self._settings: dict[StatementType, SettingsJson] = {}
+        self._loaded_at: Optional[float] = None
+        self._detector: Optional[StatementTypeDetector] = None
+        self._lock = threading.Lock()
+
+    def get(
+            self,
+            database_session: Session,
+            statement_type: StatementType) -> SettingsJson:
+        settings = self.get_all(database_session).get(statement_type)
+        return settings if settings is not None else SettingsJson([], [])  # Default empty settings
+
+    def get_all(self, database_session: Session) -> dict[StatementType, SettingsJson]:
+        if self._is_stale():
+            self.refresh(database_session)
+        return self._settings
+
+    def get_detector(self, database_session: Session) -> StatementTypeDetector:
+        """The keyword detector over all loaded settings, rebuilt only when they are reloaded."""
+        settings = self.get_all(database_session)
+        detector = self._detector
+        if detector is None or detector.settings is not settings:
+            detector = self._detector = StatementTypeDetector(settings)
+        return detector
+
+    def refresh(self, database_session: Session) -> None:
+        with self._lock:
+            if not self._is_stale():
+                return
+            settings: dict[StatementType, SettingsJson] = {}
+            for statement_type_settings in get_all_statement_type_settings(database_session):
+                statement_type = statement_type_settings.statement_type
+                settings_json_str = getattr(statement_type_settings, "settings_json", "")
+                if statement_type in settings or not settings_json_str:
+                    continue
+                settings[statement_type] = SettingsJson.from_json(str(settings_json_str))
+            self._settings = settings
+            self._loaded_at = time.monotonic()
+        logger.info("Loaded settings for %s statement types.", len(settings))
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+    def _is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        return self.ttl_seconds > 0 and time.monotonic() - self._loaded_at > self.ttl_seconds
+
+statement_settings_registry = StatementSettingsRegistry(ttl_seconds=config.STATEMENT_SETTINGS_TTL_SECONDS)
+
+def _on_statement_type_settings_changed(mapper, connection, target: StatementTypeSettings) -> None:
+    statement_settings_registry.invalidate()
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    _sql.event.listen(StatementTypeSettings, _event_name, _on_statement_type_settings_changed)
+
+register_upsert_listener(StatementTypeSettings, lambda connection, written_rows, state: statement_settings_registry.invalidate())
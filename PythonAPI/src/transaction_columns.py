@@ -0,0 +1,150 @@
+from array import array
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from typing import Optional
+
+from src.models.apimodels import FinanceItemModel
+from src.parser_plan import AMOUNT_NOISE_PATTERN, parse_statement_date
+
+EPOCH = datetime(1970, 1, 1)
+CENT = Decimal('0.01')
+
+class RawTransactionColumns:
+    """Raw transaction fields collected column by column while scanning a statement."""
+
+    def __init__(self):
+        self.line_indices = array('q')
+        self.date_strings: list[str] = []
+        self.descriptions: list[str] = []
+        self.amount_strings: list[str] = []
+        self.credit_flags = array('b')
+
+    def append(
+            self,
+            line_index: int,
+            date_str: str,
+            description: str,
+            amount_str: str,
+            is_credit: bool) -> None:
+        self.line_indices.append(line_index)
+        self.date_strings.append(date_str)
+        self.descriptions.append(description)
+        self.amount_strings.append(amount_str)
+        self.credit_flags.append(1 if is_credit else 0)
+
+    def __len__(self) -> int:
+        return len(self.date_strings)
+
+class TransactionParseFailure:
+    def __init__(
+            self,
+            row: int,
+            line_index: int,
+            field: str,
+            value: str):
+        self.row = row
+        self.line_index = line_index
+        self.field = field
+        self.value = value
+
+    def to_dict(self) -> dict:
+        return {
+            "row": self.row,
+            "line_index": self.line_index,
+            "field": self.field,
+            "value": self.value
+        }
+
+class NormalizedTransactionColumns:
+    """
+    Normalized transaction columns. Dates are stored as days since 1970-01-01 (the
+    datetime64[D] layout) and amounts as signed fixed-point cents. Rows that failed to
+    parse have valid set to 0 and are listed in failures.
+    """
+
+    def __init__(
+            self,
+            descriptions: list[str],
+            record_days: array,
+            amount_cents: array,
+            valid: array,
+            failures: list[TransactionParseFailure]):
+        self.descriptions = descriptions
+        self.record_days = record_days
+        self.amount_cents = amount_cents
+        self.valid = valid
+        self.failures = failures
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
+
+    def record_date(self, row: int) -> datetime:
+        return EPOCH + timedelta(days=self.record_days[row])
+
+    def amount(self, row: int) -> float:
+        return self.amount_cents[row] / 100
+
+def parse_amount_cents(amount_str: str) -> Optional[int]:
+    """Parses a statement amount into cents, returning None when it is not a number."""
+    try:
+        return int(Decimal(AMOUNT_NOISE_PATTERN.sub('', amount_str)).quantize(CENT, ROUND_HALF_EVEN) * 100)
+    except InvalidOperation:
+        return None
+
+def normalize_transaction_columns(raw_columns: RawTransactionColumns) -> NormalizedTransactionColumns:
+    """
+    Normalizes the raw date and amount columns in one pass. Each distinct date and
+    amount string is parsed once, every row then only does dictionary lookups.
+    """
+    days_by_date: dict[str, Optional[int]] = {}
+    for date_str in dict.fromkeys(raw_columns.date_strings):
+        parsed_date = parse_statement_date(date_str)
+        days_by_date[date_str] = (parsed_date - EPOCH).days if parsed_date is not None else None
+    cents_by_amount = {amount_str: parse_amount_cents(amount_str) for amount_str in dict.fromkeys(raw_columns.amount_strings)}
+
+    row_count = len(raw_columns)
+    record_days = array('q', bytes(8 * row_count))
+    amount_cents = array('q', bytes(8 * row_count))
+    valid = array('b', bytes(row_count))
+    failures: list[TransactionParseFailure] = []
+
+    for row in range(row_count):
+        date_str = raw_columns.date_strings[row]
+        amount_str = raw_columns.amount_strings[row]
+        days = days_by_date[date_str]
+        cents = cents_by_amount[amount_str]
+        if days is None:
+            failures.append(TransactionParseFailure(row, raw_columns.line_indices[row], "record_date", date_str))
+        if cents is None:
+            failures.append(TransactionParseFailure(row, raw_columns.line_indices[row], "amount", amount_str))
+        if days is None or cents is None:
+            continue
+        record_days[row] = days
+        amount_cents[row] = -cents if raw_columns.credit_flags[row] else cents
+        valid[row] = 1
+
+    return NormalizedTransactionColumns(raw_columns.descriptions, record_days, amount_cents, valid, failures)
+
+class TransactionBatch:
+    """Result of a batch extraction: the normalized columns plus the rows that failed."""
+
+    def __init__(self, columns: NormalizedTransactionColumns):
+        self.columns = columns
+        self.failures = columns.failures
+
+    def to_finance_item_models(
+            self,
+            finance_item_category_id: int = 1,
+            personal_data_id: int = 1) -> list[FinanceItemModel]:
+        columns = self.columns
+        record_dates = {days: EPOCH + timedelta(days=days) for days in set(columns.record_days)}
+        return [
+            FinanceItemModel(
+                record_date=record_dates[columns.record_days[row]],
+                description=columns.descriptions[row],
+                amount=columns.amount_cents[row] / 100,
+                finance_item_category_id=finance_item_category_id,
+                personal_data_id=personal_data_id
+            )
+            for row in range(len(columns)) if columns.valid[row]
+        ]
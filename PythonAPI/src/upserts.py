@@ -0,0 +1,381 @@
+import logging
+from typing import Any, Callable, Optional
+
+import sqlalchemy as _sql
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.metrics import rows_persisted, timed_stage
+from src.models.entities import EntityBase
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------------
+# Single statement upserts of mapped entities: MERGE ... OUTPUT on SQL Server and
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING on SQLite and PostgreSQL. An entity
+# with an id updates that row, or inserts it when the id does not exist; an entity
+# without one is inserted. The generated columns come back from the same statement,
+# so nothing is refreshed afterwards.
+#--------------------------------------------------------------------------------------------
+UPSERT_DIALECTS = ("mssql", "postgresql", "sqlite")
+
+# Columns the database maintains; never copied from an entity into an UPDATE
+_SERVER_MAINTAINED_COLUMNS = ("id", "created_at", "updated_at")
+
+# SQL Server accepts at most 2100 parameters per statement
+_MSSQL_MAX_PARAMETERS = 2000
+# Rows per multi-row VALUES on SQLite and PostgreSQL
+_VALUES_CHUNK_SIZE = 500
+
+#--------------------------------------------------------------------------------------------
+# Listeners. Upserts bypass the ORM unit of work, so mapper and flush events do not
+# fire; modules deriving data from a table register here as well.
+#--------------------------------------------------------------------------------------------
+# before(connection, ids of the rows about to be updated) -> state handed to after
+BeforeUpsert = Callable[[Connection, list[int]], Any]
+# after(connection, every written row as a column dict, state from before)
+AfterUpsert = Callable[[Connection, list[dict[str, Any]], Any], None]
+
+_upsert_listeners: dict[type, list[tuple[Optional[BeforeUpsert], AfterUpsert]]] = {}
+
+def register_upsert_listener(
+        entity_class: type[EntityBase],
+        after: AfterUpsert,
+        before: Optional[BeforeUpsert] = None) -> None:
+    _upsert_listeners.setdefault(entity_class, []).append((before, after))
+
+def notify_inserted_rows(connection: Connection, entity_class: type[EntityBase], written_rows: list[dict[str, Any]]) -> None:
+    """Runs the listeners of entity_class for rows inserted outside upsert_models, e.g. a bulk INSERT."""
+    for before, after in _upsert_listeners.get(entity_class, []):
+        after(connection, written_rows, before(connection, []) if before else None)
+
+#--------------------------------------------------------------------------------------------
+# Column values
+#--------------------------------------------------------------------------------------------
+def _column_keys(entity_class: type[EntityBase]) -> list[str]:
+    return [column_attribute.key for column_attribute in _sql.inspect(entity_class).column_attrs]
+
+def upsert_values(entity: EntityBase) -> dict[str, Any]:
+    """
+    The column values to write for an entity. A persistent entity only contributes the
+    columns changed since it was loaded, a new or detached one every column it has set.
+    """
+    state = _sql.inspect(entity)
+    column_keys = _column_keys(type(entity))
+    if state.persistent:
+        values = {
+            key: getattr(entity, key) for key in column_keys
+            if key not in _SERVER_MAINTAINED_COLUMNS and state.attrs[key].history.has_changes()
+        }
+    else:
+        values = {
+            key: value for key, value in state.dict.items()
+            if key in column_keys and key not in _SERVER_MAINTAINED_COLUMNS
+        }
+    entity_id = state.dict.get("id")
+    if isinstance(entity_id, int) and entity_id > 0:
+        values["id"] = entity_id
+    return values
+
+def supports_upsert(database_session: Session) -> bool:
+    return database_session.get_bind().dialect.name in UPSERT_DIALECTS
+
+#--------------------------------------------------------------------------------------------
+# Statements
+#--------------------------------------------------------------------------------------------
+def _upsert_mssql(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        update_keys: list[str]) -> list[tuple[int, dict[str, Any]]]:
+    """
+    One MERGE for the rows, all with the same keys. Rows are matched on id; a row
+    without an id, or with one that does not exist, is inserted with a new id. A matched
+    row is only written when one of its columns differs. Returns (row index, written row).
+    """
+    preparer = connection.dialect.identifier_preparer
+    quote = preparer.quote
+    insert_keys = [key for key in rows[0] if key != "id"]
+    source_keys = ["_row", "id", *insert_keys]
+    parameters: dict[str, Any] = {}
+    bind_parameters = []
+    value_rows = []
+    for row_index, row in enumerate(rows):
+        placeholders = []
+        for key_index, key in enumerate(source_keys):
+            name = f"p{row_index}_{key_index}"
+            value = row_index if key == "_row" else row.get(key)
+            column_type = _sql.Integer() if key == "_row" else table.c[key].type
+            parameters[name] = value
+            bind_parameters.append(_sql.bindparam(name, type_=column_type))
+            placeholders.append(f"CAST(:{name} AS {column_type.compile(dialect=connection.dialect)})")
+        value_rows.append(f"({', '.join(placeholders)})")
+
+    returned_columns = [column.key for column in table.c]
+    matched_clause = ""
+    if update_keys:
+        changed = (
+            f"EXISTS (SELECT {', '.join(f'source.{quote(key)}' for key in update_keys)}"
+            f" EXCEPT SELECT {', '.join(f'target.{quote(key)}' for key in update_keys)})")
+        assignments = [f"{quote(key)} = source.{quote(key)}" for key in update_keys]
+        if "updated_at" in table.c:
+            assignments.append(f"{quote('updated_at')} = CURRENT_TIMESTAMP")
+        matched_clause = f" WHEN MATCHED AND {changed} THEN UPDATE SET {', '.join(assignments)}"
+    statement = (
+        f"MERGE INTO {preparer.format_table(table)} WITH (HOLDLOCK) AS target"
+        f" USING (VALUES {', '.join(value_rows)}) AS source ({', '.join(quote(key) for key in source_keys)})"
+        f" ON target.{quote('id')} = source.{quote('id')}"
+        f"{matched_clause}"
+        f" WHEN NOT MATCHED THEN INSERT ({', '.join(quote(key) for key in insert_keys)})"
+        f" VALUES ({', '.join(f'source.{quote(key)}' for key in insert_keys)})"
+        f" OUTPUT source.{quote('_row')}, {', '.join(f'inserted.{quote(key)}' for key in returned_columns)};")
+    result = connection.execute(
+        _sql.text(statement).bindparams(*bind_parameters).columns(
+            _sql.column("_row", _sql.Integer()), *(table.c[key] for key in returned_columns)),
+        parameters)
+    return [(row[0], dict(zip(returned_columns, row[1:]))) for row in result]
+
+def _upsert_on_conflict(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        update_keys: list[str]) -> list[tuple[int, dict[str, Any]]]:
+    """
+    INSERT ... ON CONFLICT (id) DO UPDATE ... RETURNING for rows, all with the same keys,
+    that carry an id. A conflicting row is only updated when one of its columns differs.
+    """
+    dialect_insert = sqlite.insert if connection.dialect.name == "sqlite" else postgresql.insert
+    statement = dialect_insert(table).values(rows)
+    if update_keys:
+        assignments: dict[str, Any] = {key: statement.excluded[key] for key in update_keys}
+        if "updated_at" in table.c:
+            assignments["updated_at"] = func.now()
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_=assignments,
+            where=_sql.or_(*(table.c[key].is_distinct_from(statement.excluded[key]) for key in update_keys)))
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[table.c.id])
+    row_index_by_id = {row["id"]: row_index for row_index, row in enumerate(rows)}
+    return [
+        (row_index_by_id[written_row["id"]], written_row)
+        for written_row in (dict(row._mapping) for row in connection.execute(statement.returning(*table.c)))
+    ]
+
+def _insert_returning(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]]) -> list[tuple[int, dict[str, Any]]]:
+    """Multi-row INSERT ... RETURNING for rows without an id, in row order."""
+    # SQLite hands out rowids in VALUES order, see bulk_insert_finance_items
+    written_rows = [dict(row._mapping) for row in connection.execute(insert(table).values(rows).returning(*table.c))]
+    if connection.dialect.name == "sqlite":
+        written_rows.sort(key=lambda written_row: written_row["id"])
+    return list(enumerate(written_rows))
+
+def _update_many(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        update_keys: list[str]) -> list[tuple[int, dict[str, Any]]]:
+    """
+    The changed columns of rows known to exist, all with the same keys, written with one
+    executemany UPDATE and read back with one SELECT. A row deleted meanwhile is left out.
+    """
+    assignments: dict[str, Any] = {key: _sql.bindparam(f"new_{key}") for key in update_keys}
+    if "updated_at" in table.c:
+        assignments["updated_at"] = func.now()
+    connection.execute(
+        _sql.update(table).where(table.c.id == _sql.bindparam("row_id")).values(assignments),
+        [{"row_id": row["id"], **{f"new_{key}": row[key] for key in update_keys}} for row in rows])
+    row_index_by_id = {row["id"]: row_index for row_index, row in enumerate(rows)}
+    return [
+        (row_index_by_id[written_row["id"]], written_row)
+        for written_row in (
+            dict(row._mapping) for row in connection.execute(select(*table.c).where(table.c.id.in_(row_index_by_id))))
+    ]
+
+def _advance_id_sequence(connection: Connection, table: _sql.Table, max_id: int) -> None:
+    """
+    Moves the PostgreSQL sequence of table.id past max_id. Rows inserted with an explicit
+    id do not advance it, so later inserts taking the default id would collide with them.
+    """
+    connection.execute(
+        _sql.text(
+            "SELECT setval(pg_get_serial_sequence(:table_name, 'id'),"
+            " GREATEST(:max_id, COALESCE(pg_sequence_last_value(pg_get_serial_sequence(:table_name, 'id')), 0)))"),
+        {"table_name": connection.dialect.identifier_preparer.format_table(table), "max_id": max_id})
+
+def _increment_mssql(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        key_columns: list[str],
+        increment_keys: list[str]) -> None:
+    """One MERGE WITH (HOLDLOCK) adding the increments of rows, all with the same keys."""
+    preparer = connection.dialect.identifier_preparer
+    quote = preparer.quote
+    source_keys = [*key_columns, *increment_keys]
+    parameters: dict[str, Any] = {}
+    bind_parameters = []
+    value_rows = []
+    for row_index, row in enumerate(rows):
+        placeholders = []
+        for key_index, key in enumerate(source_keys):
+            name = f"p{row_index}_{key_index}"
+            column_type = table.c[key].type
+            parameters[name] = row[key]
+            bind_parameters.append(_sql.bindparam(name, type_=column_type))
+            placeholders.append(f"CAST(:{name} AS {column_type.compile(dialect=connection.dialect)})")
+        value_rows.append(f"({', '.join(placeholders)})")
+
+    assignments = [f"{quote(key)} = target.{quote(key)} + source.{quote(key)}" for key in increment_keys]
+    if "updated_at" in table.c:
+        assignments.append(f"{quote('updated_at')} = CURRENT_TIMESTAMP")
+    statement = (
+        f"MERGE INTO {preparer.format_table(table)} WITH (HOLDLOCK) AS target"
+        f" USING (VALUES {', '.join(value_rows)}) AS source ({', '.join(quote(key) for key in source_keys)})"
+        f" ON {' AND '.join(f'target.{quote(key)} = source.{quote(key)}' for key in key_columns)}"
+        f" WHEN MATCHED THEN UPDATE SET {', '.join(assignments)}"
+        f" WHEN NOT MATCHED THEN INSERT ({', '.join(quote(key) for key in source_keys)})"
+        f" VALUES ({', '.join(f'source.{quote(key)}' for key in source_keys)});")
+    connection.execute(_sql.text(statement).bindparams(*bind_parameters), parameters)
+
+def _increment_on_conflict(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        key_columns: list[str],
+        increment_keys: list[str]) -> None:
+    """INSERT ... ON CONFLICT (key columns) DO UPDATE SET column = column + excluded.column."""
+    dialect_insert = sqlite.insert if connection.dialect.name == "sqlite" else postgresql.insert
+    statement = dialect_insert(table).values(rows)
+    assignments: dict[str, Any] = {key: table.c[key] + statement.excluded[key] for key in increment_keys}
+    if "updated_at" in table.c:
+        assignments["updated_at"] = func.now()
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c[key] for key in key_columns],
+        set_=assignments))
+
+def increment_rows(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        key_columns: list[str],
+        increment_keys: list[str]) -> bool:
+    """
+    Adds the increment_keys values of rows to the stored rows with the same key_columns,
+    which must be covered by a unique index, inserting the rows that do not exist yet.
+    Each statement is atomic, so concurrent writers of the same key never collide on the
+    unique index. Returns False without writing when the dialect has no upsert.
+    """
+    if connection.dialect.name not in UPSERT_DIALECTS:
+        return False
+    if connection.dialect.name == "mssql":
+        chunk_size = max(1, _MSSQL_MAX_PARAMETERS // (len(key_columns) + len(increment_keys)))
+        write = lambda chunk: _increment_mssql(connection, table, chunk, key_columns, increment_keys)
+    else:
+        chunk_size = _VALUES_CHUNK_SIZE
+        write = lambda chunk: _increment_on_conflict(connection, table, chunk, key_columns, increment_keys)
+    for _, chunk in _chunks(rows, chunk_size):
+        write(chunk)
+    return True
+
+def _chunks(rows: list[dict[str, Any]], chunk_size: int) -> list[tuple[int, list[dict[str, Any]]]]:
+    return [(start, rows[start:start + chunk_size]) for start in range(0, len(rows), chunk_size)]
+
+def upsert_rows(
+        connection: Connection,
+        table: _sql.Table,
+        rows: list[dict[str, Any]],
+        persistent: Optional[list[bool]] = None) -> list[Optional[dict[str, Any]]]:
+    """
+    Upserts column dicts into table and returns the written row for each, in order.
+    Rows flagged persistent are known to exist and only hold their changed columns; they
+    are written with an UPDATE. Rows that were not written, because none of their columns
+    differed from the stored row, come back as None.
+    """
+    explicit_ids: list[int] = []
+    written: list[Optional[dict[str, Any]]] = [None] * len(rows)
+    groups: dict[tuple[tuple[str, ...], bool, bool], list[int]] = {}
+    for row_index, row in enumerate(rows):
+        is_persistent = bool(persistent and persistent[row_index])
+        groups.setdefault((tuple(sorted(row)), "id" in row, is_persistent), []).append(row_index)
+
+    for (keys, has_id, is_persistent), row_indexes in groups.items():
+        group_rows = [rows[row_index] for row_index in row_indexes]
+        update_keys = [key for key in keys if key not in _SERVER_MAINTAINED_COLUMNS]
+        if is_persistent:
+            if not update_keys:
+                continue
+            chunk_size = _VALUES_CHUNK_SIZE
+            write = lambda chunk: _update_many(connection, table, chunk, update_keys)
+        elif connection.dialect.name == "mssql":
+            chunk_size = max(1, _MSSQL_MAX_PARAMETERS // (len(keys) + 2))
+            write = lambda chunk: _upsert_mssql(connection, table, chunk, update_keys)
+        elif has_id:
+            chunk_size = _VALUES_CHUNK_SIZE
+            write = lambda chunk: _upsert_on_conflict(connection, table, chunk, update_keys)
+            explicit_ids.extend(row["id"] for row in group_rows)
+        else:
+            chunk_size = _VALUES_CHUNK_SIZE
+            write = lambda chunk: _insert_returning(connection, table, chunk)
+        for start, chunk in _chunks(group_rows, chunk_size):
+            for chunk_index, written_row in write(chunk):
+                written[row_indexes[start + chunk_index]] = written_row
+    if explicit_ids and connection.dialect.name == "postgresql":
+        _advance_id_sequence(connection, table, max(explicit_ids))
+    return written
+
+def upsert_models(entities: list[EntityBase], database_session: Session) -> list[EntityBase]:
+    """
+    Writes entities of one class with one upsert statement per group of rows setting the
+    same columns, then commits. The returned columns are stored on the entities as their
+    committed state, so they need no refresh. Rows that did not change are read back
+    with a single SELECT. Registered upsert listeners run inside the transaction.
+    """
+    if not entities:
+        return []
+    entity_class = type(entities[0])
+    table: _sql.Table = entity_class.__table__  # type: ignore
+    rows = [upsert_values(entity) for entity in entities]
+    persistent = [_sql.inspect(entity).persistent for entity in entities]
+    listeners = _upsert_listeners.get(entity_class, [])
+    try:
+        connection = database_session.connection()
+        updated_ids = [row["id"] for row in rows if "id" in row]
+        listener_states = [before(connection, updated_ids) if before else None for before, _ in listeners]
+        with timed_stage("database_upsert"):
+            written = upsert_rows(connection, table, rows, persistent)
+
+        unchanged_ids = [row["id"] for row, written_row in zip(rows, written) if written_row is None and "id" in row]
+        stored_rows = {}
+        if unchanged_ids:
+            stored_rows = {row.id: dict(row._mapping) for row in connection.execute(select(*table.c).where(table.c.id.in_(unchanged_ids)))}
+        written_rows = [written_row for written_row in written if written_row is not None]
+        for (_, after), listener_state in zip(listeners, listener_states):
+            after(connection, written_rows, listener_state)
+        # Stored as committed before the commit too, so the flush does not write persistent entities again
+        stored_values = [
+            written_row if written_row is not None else stored_rows.get(row.get("id")) or {}
+            for row, written_row in zip(rows, written)
+        ]
+        _set_committed_values(entities, stored_values)
+        with timed_stage("database_commit"):
+            database_session.commit()
+    except Exception as e:
+        logger.error("Error upserting %s rows: %s", table.name, e)
+        database_session.rollback()
+        raise
+
+    rows_persisted.inc(len(written_rows), table=table.name)
+    _set_committed_values(entities, stored_values)  # The commit expired persistent entities
+    return entities
+
+def _set_committed_values(entities: list[EntityBase], stored_values: list[dict[str, Any]]) -> None:
+    for entity, values in zip(entities, stored_values):
+        for key, value in values.items():
+            set_committed_value(entity, key, value)